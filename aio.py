@@ -0,0 +1,103 @@
+"""
+aio.py
+
+Description:
+    This file contains an asyncio based event loop for nodes.
+    Instead of a blocking receive loop per node, every node is attached to an
+    asyncio datagram endpoint, so a single thread can run many nodes and
+    receives, sends and timers of these nodes are interleaved by the loop.
+    The message handling itself is done by the unchanged on_message and
+    on_tick functions of the Follower and Leader classes.
+"""
+
+import asyncio
+import logging
+
+
+class AsyncioTransport:
+    def __init__(self, udp_transport, datagram_transport):
+        self.udp_transport = udp_transport
+        self.datagram_transport = datagram_transport
+
+    # Encodes a message and queues its datagram(s) without blocking
+    def send(self, message, addr):
+        for datagram in self.udp_transport.datagrams(message):
+            self.datagram_transport.sendto(datagram, addr)
+
+    # Timeouts are handled by the event loop
+    def settimeout(self, timeout):
+        pass
+
+    # Closes the endpoint, which stops the node
+    def close(self):
+        self.datagram_transport.close()
+
+
+class NodeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, node, loop):
+        self.node = node
+        self.loop = loop
+        self.udp_transport = node.transport
+        self.closed = loop.create_future()
+        self.timer = None
+
+    # Routes all sends of the node through the asyncio endpoint
+    def connection_made(self, transport):
+        self.node.transport = AsyncioTransport(self.udp_transport, transport)
+        self.schedule_tick()
+
+    # Decodes a datagram and lets the node handle the message
+    def datagram_received(self, data, addr):
+        message = self.udp_transport.decode_datagram(data, addr)
+        if message is None:
+            return
+
+        if self.node.trace_net is not None:
+            self.node.trace_net.debug("received", addr, message)
+        self.node.handle_message(addr, message)
+
+        if self.node.is_connected:
+            self.node.tick()
+
+    # Errors of earlier sends are reported here, UDP simply carries on
+    def error_received(self, exc):
+        logging.warning("{}: {}".format(self.node, exc))
+
+    def connection_lost(self, exc):
+        if self.timer:
+            self.timer.cancel()
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    # Calls the timers of the node every tick_interval
+    def schedule_tick(self):
+        if self.node.tick_interval:
+            self.timer = self.loop.call_later(self.node.tick_interval, self.tick)
+
+    def tick(self):
+        if self.node.is_connected:
+            self.node.tick()
+            self.schedule_tick()
+
+
+# Attaches all nodes to the loop and waits until every node has exited
+async def serve(nodes, loop):
+    protocols = []
+    for node in nodes:
+        protocol = NodeProtocol(node, loop)
+        await loop.create_datagram_endpoint(lambda protocol=protocol: protocol, sock=node.transport.socket)
+        protocols.append(protocol)
+
+    await asyncio.gather(*[protocol.closed for protocol in protocols])
+
+
+# Runs the nodes on a new event loop in the calling thread
+def run_nodes(nodes):
+    if any(node.config.transport != "udp" for node in nodes):
+        raise ValueError("The asyncio event loop needs the udp transport")
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(serve(nodes, loop))
+    finally:
+        loop.close()
@@ -0,0 +1,159 @@
+"""
+asyncclient.py
+
+Description:
+    This file contains the definition of the asyncio client class.
+    Every request is tagged with a request id (rid), which the nodes echo in
+    their write_result and read_result messages. Responses are matched to
+    their request by this id, so a single socket can have many requests in
+    flight at the same time.
+"""
+
+import asyncio
+import logging
+import random
+
+from aio import AsyncioTransport
+from client import BusyError
+from config import Config
+from transport import UdpTransport
+
+
+class ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    # Decodes a datagram and resolves the request it answers
+    def datagram_received(self, data, addr):
+        message = self.client.udp_transport.decode_datagram(data, addr)
+        if message is not None:
+            self.client.on_response(message)
+
+    def error_received(self, exc):
+        logging.warning("AsyncClient: {}".format(exc))
+
+
+class AsyncClient:
+    def __init__(self, node_hosts, config=None, timeout=5, leader_host=None):
+        self.node_hosts = node_hosts
+        self.config = config or Config()
+        self.timeout = timeout
+        self.leader_host = leader_host
+
+        self.udp_transport = UdpTransport(0, self.config)
+        self.transport = None
+        self.loop = None
+
+        self.next_rid = 0
+        self.pending = {}
+
+        logging.info("AsyncClient: constructed with hosts: {}".format(node_hosts))
+
+    # Attaches the client to an event loop, has to be awaited before sending requests
+    async def start(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: ClientProtocol(self), sock=self.udp_transport.socket)
+        self.transport = AsyncioTransport(self.udp_transport, transport)
+        return self
+
+    # Sends a request and returns a future for its response
+    def request(self, data, host=None):
+        # If no host is specified a random one is chosen
+        if not host:
+            host = random.choice(self.node_hosts)
+
+        rid = self.next_rid
+        self.next_rid += 1
+        data["rid"] = rid
+
+        future = self.loop.create_future()
+        timer = self.loop.call_later(self.timeout, self.expire, rid)
+        self.pending[rid] = (future, host, timer)
+
+        self.transport.send(data, host)
+        return future
+
+    # Resolves the future of the request that a response belongs to
+    def on_response(self, message):
+        entry = self.pending.pop(message.get("rid"), None)
+        # Responses to requests that already timed out are dropped
+        if entry is None:
+            return
+
+        future, host, timer = entry
+        timer.cancel()
+        message["host"] = host
+        if future.done():
+            return
+
+        if message["type"] == "busy":
+            future.set_exception(BusyError("{} is busy, write of {} rejected".format(host, message["keys"])))
+        else:
+            future.set_result(message)
+
+    # Fails a request for which no response arrived in time
+    def expire(self, rid):
+        future, host, _ = self.pending.pop(rid)
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError(
+                "No response from {} for request {}".format(host, rid)))
+
+    # Performs a write operation, the future resolves to the write_result message
+    def write(self, keys, values, host=None):
+        # This makes sure that even single inputs get put into a list
+        keys = keys if type(keys) == list else [keys]
+        values = values if type(values) == list else [values]
+
+        if len(keys) != len(values) or len(keys) != len(set(keys)):
+            raise ValueError("Invalid key-value pair(s): {} = {}".format(keys, values))
+
+        data = {
+            "type": "client_write",
+            "keys": keys,
+            "values": values
+        }
+
+        return self.request(data, host=host)
+
+    # Performs a read operation, the future resolves to the read_result message.
+    # See Client.read for snapshot, leader, max_staleness and max_staleness_ms
+    def read(self, key, host=None, snapshot=None, leader=None, max_staleness=None, max_staleness_ms=None):
+        if not isinstance(key, list):
+            key = [key]
+
+        data = {
+            "type": "client_read",
+            "key": key,
+        }
+        if snapshot is not None:
+            data["snapshot"] = snapshot
+        if max_staleness is not None:
+            data["max_staleness"] = max_staleness
+        if max_staleness_ms is not None:
+            data["max_staleness_ms"] = max_staleness_ms
+
+        if leader is None:
+            leader = self.config.leader_reads and self.leader_host is not None and host is None
+        if leader:
+            if self.leader_host is None:
+                raise ValueError("Leader read of {} without a known leader".format(key))
+            host = self.leader_host
+            data["leader"] = True
+
+        return self.request(data, host=host)
+
+    # Function to shut down all known hosts
+    def exit(self):
+        for host in self.node_hosts:
+            self.transport.send({"type": "exit"}, host)
+        self.close()
+
+    # Closes the socket, requests that are still in flight fail
+    def close(self):
+        for future, _, timer in self.pending.values():
+            timer.cancel()
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+        self.transport.close()
@@ -7,20 +7,42 @@ Description:
     on the distributed key-value store system.
 """
 
+from collections import defaultdict
+from itertools import cycle
 import logging
 import random
-import socket
-import json
+
+from config import Config
+from tracing import Tracer
+from transport import make_transport
+
+# Requests that can carry a trace id
+TRACED_REQUESTS = ("client_write", "client_read")
+
+
+# Raised when a node rejects a write because its write window is full
+class BusyError(Exception):
+    pass
 
 
 class Client:
-    def __init__(self, node_hosts):
+    def __init__(self, node_hosts, config=None, leader_host=None):
         self.node_hosts = node_hosts
+        self.config = config or Config()
+        self.leader_host = leader_host
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind(("", 0))
-        self.socket.settimeout(5)
+        self.transport = make_transport(0, self.config)
+        self.transport.settimeout(5)
+
+        # Request ids of pipelined requests, nodes echo them in their responses
+        self.next_rid = 0
+
+        # A fraction of the requests is tagged with a trace id, their send and receive
+        # times are recorded in the same format as the hops on the nodes
+        self.tracer = Tracer("Client:{}".format(self.transport.port), self.config)
+        self.trace_request = self.tracer.subsystem("request")
+        # Requests and responses, recorded only when tracing is enabled (see tracing.py)
+        self.trace_net = self.tracer.subsystem("net")
 
         logging.info("Client: constructed with hosts: {}".format(node_hosts))
 
@@ -30,13 +52,23 @@ class Client:
         if not host:
             host = random.choice(self.node_hosts)
 
+        trace = None
+        if (self.trace_request is not None and data["type"] in TRACED_REQUESTS
+                and random.random() < self.config.request_trace_sample):
+            trace = data["trace"] = random.getrandbits(62)
+            self.trace_request.info("sent", trace, data["type"], host)
+
         # Send data and await response
-        self.socket.sendto(json.dumps(data).encode(), host)
-        logging.info("Client: send message to node:{} : {}".format(host, data))
-        data, addr = self.socket.recvfrom(1024)
-        logging.info("Client: received message: {} from {}".format(data, addr))
+        self.transport.send(data, host)
+        if self.trace_net is not None:
+            self.trace_net.debug("sent", host, data)
+        result, addr = self.transport.recv()
+        if self.trace_net is not None:
+            self.trace_net.debug("received", addr, result)
+
+        if trace is not None:
+            self.trace_request.info("received", trace, result["type"])
 
-        result = json.loads(data.decode())
         result['host'] = host
 
         return result
@@ -44,7 +76,7 @@ class Client:
     # Send data to all known hosts
     def send_all(self, data):
         for host in self.node_hosts:
-            self.socket.sendto(json.dumps(data).encode(), host)
+            self.transport.send(data, host)
 
     # Performs a write operation
     def write(self, keys, values, host=None, blocking=True):
@@ -67,22 +99,34 @@ class Client:
 
         # Sending the client write message
         if blocking:
-            host = self.send_recv(data, host=host)['host']
+            result = self.send_recv(data, host=host)
+            if result["type"] == "busy":
+                raise BusyError("{} is busy, write of {} rejected".format(result["host"], keys))
+            host = result['host']
         else:
             if not host:
                 host = random.choice(self.node_hosts)
-            self.socket.sendto(json.dumps(data).encode(), host)
+            self.transport.send(data, host)
 
         return host
 
-    # Function for receiving write acknoledgement
+    # Function for receiving write acknoledgement or the result of a non-blocking read
     def write_recv(self):
-        data, addr = self.socket.recvfrom(1024)
-        logging.info("Client: received message: {} from {}".format(data, addr))
-        return json.loads(data.decode())
+        result, addr = self.transport.recv()
+        if self.trace_net is not None:
+            self.trace_net.debug("received", addr, result)
+        return result
 
-    # Performs a read operation
-    def read(self, key, host=None):
+    # Performs a read operation. With a snapshot (an order index, or True for the
+    # last applied write) the keys are read as they were at that index, without
+    # waiting for pending writes, the result reports the index in "snapshot".
+    # A leader read goes to the leader, which answers from its own state while it
+    # holds its lease, by default reads go there if config.leader_reads is set and the
+    # leader is known. A leader read without a known leader raises ValueError.
+    # With max_staleness (orders) and/or max_staleness_ms the node answers right away
+    # if its values are within the bound, the result reports "staleness" and "staleness_ms"
+    def read(self, key, host=None, blocking=True, snapshot=None, leader=None, max_staleness=None,
+             max_staleness_ms=None):
         if not isinstance(key, list):
             key = [key]
 
@@ -91,9 +135,97 @@ class Client:
             "type": "client_read",
             "key": key,
         }
+        if snapshot is not None:
+            data["snapshot"] = snapshot
+        if max_staleness is not None:
+            data["max_staleness"] = max_staleness
+        if max_staleness_ms is not None:
+            data["max_staleness_ms"] = max_staleness_ms
+
+        if leader is None:
+            leader = self.config.leader_reads and self.leader_host is not None and host is None
+        if leader:
+            if self.leader_host is None:
+                raise ValueError("Leader read of {} without a known leader".format(key))
+            host = self.leader_host
+            data["leader"] = True
+
+        if not blocking:
+            if not host:
+                host = random.choice(self.node_hosts)
+            self.transport.send(data, host)
+            return host
 
         return self.send_recv(data, host=host)
 
+    # Writes (key, value) pairs in chunks and yields the write_result of every chunk as it completes
+    def bulk_write(self, items, chunk_size=None, window=None):
+        requests = ({"type": "client_write", "keys": [k for k, _ in chunk], "values": [v for _, v in chunk]}
+                    for chunk in chunks(items, chunk_size or self.config.bulk_chunk_size, unique=True))
+        return self.pipeline(requests, window or self.config.bulk_window, ordered=True)
+
+    # Reads keys in chunks and yields a (key, value, order_index) tuple for every key,
+    # per chunk as it completes
+    def bulk_read(self, keys, chunk_size=None, window=None):
+        requests = ({"type": "client_read", "key": chunk}
+                    for chunk in chunks(keys, chunk_size or self.config.bulk_chunk_size))
+        for result in self.pipeline(requests, window or self.config.bulk_window):
+            if len(result["key"]) == 1:
+                yield result["key"][0], result["value"], result["order_index"]
+            else:
+                yield from zip(result["key"], result["value"], result["order_index"])
+
+    # Sends requests round robin to all nodes with at most window of them in flight and
+    # yields the responses as they arrive. If ordered, a write waits for earlier writes
+    # of the same keys, so they are ordered in the order they were given
+    def pipeline(self, requests, window, ordered=False):
+        in_flight = {}
+        in_flight_keys = defaultdict(int)
+        hosts = cycle(self.node_hosts)
+
+        for data in requests:
+            keys = data["keys"] if ordered else ()
+            while len(in_flight) >= window or any(key in in_flight_keys for key in keys):
+                yield self.pipeline_recv(in_flight, in_flight_keys)
+
+            rid = self.next_rid
+            self.next_rid += 1
+            data["rid"] = rid
+
+            host = next(hosts)
+            self.transport.send(data, host)
+            in_flight[rid] = (host, keys)
+            for key in keys:
+                in_flight_keys[key] += 1
+
+        while in_flight:
+            yield self.pipeline_recv(in_flight, in_flight_keys)
+
+    # Receives the response to one of the requests in flight
+    def pipeline_recv(self, in_flight, in_flight_keys):
+        while True:
+            result, addr = self.transport.recv()
+            # Responses to earlier requests that are not part of this pipeline are skipped
+            if result.get("rid") in in_flight:
+                break
+
+        host, keys = in_flight.pop(result["rid"])
+        for key in keys:
+            in_flight_keys[key] -= 1
+            if not in_flight_keys[key]:
+                del in_flight_keys[key]
+
+        result["host"] = host
+        if result["type"] == "busy":
+            raise BusyError("{} is busy, write of {} rejected".format(host, result["keys"]))
+
+        return result
+
+    # Returns the metrics of a node: message counts and rates per message type,
+    # counters, buffer depths and latency histograms (see metrics.py)
+    def stats(self, host):
+        return self.send_recv({"type": "stats"}, host=host)["stats"]
+
     # Function to shut down all known hosts
     def exit(self):
         data = {
@@ -101,7 +233,7 @@ class Client:
         }
 
         self.send_all(data)
-        self.socket.close()
+        self.transport.close()
 
     # Function for only shutting down one specific host
     def exit_single(self, host):
@@ -109,4 +241,23 @@ class Client:
             "type": "exit"
         }
 
-        self.socket.sendto(json.dumps(data).encode(), host)
\ No newline at end of file
+        self.transport.send(data, host)
+
+
+# Splits an iterable into lists of at most size items. If unique, a chunk ends
+# before an item with a key that is already in it, items are (key, value) pairs
+def chunks(iterable, size, unique=False):
+    chunk = []
+    keys = set()
+    for item in iterable:
+        if len(chunk) >= size or (unique and item[0] in keys):
+            yield chunk
+            chunk = []
+            keys = set()
+
+        chunk.append(item)
+        if unique:
+            keys.add(item[0])
+
+    if chunk:
+        yield chunk
@@ -0,0 +1,201 @@
+"""
+codec.py
+
+Description:
+    This file contains the wire formats that are used to encode messages
+    before they are sent over the network.
+    The JsonCodec is the original format, the BinaryCodec is a compact format
+    with a fixed tag for every message type, struct-packed numbers and
+    length-prefixed strings and lists.
+    Decoding detects the format from the first byte, so nodes and clients
+    that use different codecs can still talk to each other.
+"""
+
+import json
+import struct
+
+_INT = struct.Struct("!q")
+_FLOAT = struct.Struct("!d")
+_LENGTH = struct.Struct("!I")
+_COUNT = struct.Struct("!H")
+
+_INT_MIN = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+# Every JSON message is an object, so it always starts with this byte
+JSON_START = ord("{")
+
+# Message types with a fixed binary tag and the fields stored in that order.
+# Fields that are not listed here are appended as named extra fields.
+# New message types are added at the end, so existing tags never change.
+MESSAGE_TYPES = [
+    ("exit", ()),
+    ("write", ("id", "keys", "values", "from")),
+    ("acknowledge", ("id", "from")),
+    ("write_order", ("id", "index")),
+    ("client_write", ("keys", "values")),
+    ("client_read", ("key",)),
+    ("client_write_ack", ("id",)),
+    ("write_result", ("key", "value")),
+    ("read_result", ("key", "value", "order_index")),
+    ("acknowledge_batch", ("ids", "from")),
+    ("write_order_batch", ("index", "ids")),
+    ("busy", ("keys",)),
+    ("rel_ack", ("upto", "sack")),
+    ("fetch", ("index",)),
+    ("catch_up", ("index", "id", "keys", "values")),
+    ("lease_renew", ("round",)),
+    ("lease_ack", ("round",)),
+    ("heartbeat", ("term", "index")),
+    ("vote_request", ("term", "index")),
+    ("vote", ("term", "granted")),
+    ("stats", ()),
+    ("stats_result", ("stats",)),
+    ("read_index", ("round",)),
+    ("read_index_result", ("round", "index")),
+    ("heartbeat_ack", ("term", "round")),
+]
+
+_TAGS = {name: (tag, fields) for tag, (name, fields) in enumerate(MESSAGE_TYPES, start=1)}
+_TYPES = {tag: (name, fields) for tag, (name, fields) in enumerate(MESSAGE_TYPES, start=1)}
+
+
+class JsonCodec:
+    name = "json"
+
+    # Encodes a message dict to bytes
+    def encode(self, message):
+        return json.dumps(message).encode()
+
+    # Decodes bytes or a memoryview of a receive buffer to a message dict
+    def decode(self, data):
+        return json.loads(str(data, "utf-8"))
+
+
+class BinaryCodec:
+    name = "binary"
+
+    # Encodes a message dict to bytes, messages that do not fit a known
+    # message type are encoded as JSON instead
+    def encode(self, message):
+        tag, fields = _TAGS.get(message.get("type"), (None, None))
+        if tag is None or any(field not in message for field in fields):
+            return json.dumps(message).encode()
+
+        out = bytearray((tag,))
+        for field in fields:
+            _encode_value(out, message[field])
+
+        extra = [name for name in message if name != "type" and name not in fields]
+        out += _COUNT.pack(len(extra))
+        for name in extra:
+            _encode_value(out, name)
+            _encode_value(out, message[name])
+
+        return bytes(out)
+
+    # Decodes bytes or a memoryview of a receive buffer to a message dict
+    def decode(self, data):
+        if data[0] == JSON_START:
+            return json.loads(str(data, "utf-8"))
+
+        if data[0] not in _TYPES:
+            raise ValueError("Unknown message tag: {}".format(data[0]))
+
+        name, fields = _TYPES[data[0]]
+        message = {"type": name}
+        offset = 1
+        for field in fields:
+            message[field], offset = _decode_value(data, offset)
+
+        n_extra, = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        for _ in range(n_extra):
+            field, offset = _decode_value(data, offset)
+            message[field], offset = _decode_value(data, offset)
+
+        return message
+
+
+# Appends a single value to the output buffer, prefixed with a type byte
+def _encode_value(out, value):
+    if value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif type(value) is int and _INT_MIN <= value <= _INT_MAX:
+        out += b"i"
+        out += _INT.pack(value)
+    elif type(value) is float:
+        out += b"d"
+        out += _FLOAT.pack(value)
+    elif type(value) is str:
+        encoded = value.encode()
+        out += b"s"
+        out += _LENGTH.pack(len(encoded))
+        out += encoded
+    elif type(value) in (list, tuple):
+        out += b"l"
+        out += _LENGTH.pack(len(value))
+        for item in value:
+            _encode_value(out, item)
+    else:
+        # Anything else (dicts, big integers) is stored as embedded JSON
+        encoded = json.dumps(value).encode()
+        out += b"j"
+        out += _LENGTH.pack(len(encoded))
+        out += encoded
+
+
+# Reads a single value starting at offset, returns the value and the new offset
+def _decode_value(data, offset):
+    kind = data[offset]
+    offset += 1
+
+    if kind == 0x73:  # s
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        return str(data[offset:offset + length], "utf-8"), offset + length
+    elif kind == 0x69:  # i
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    elif kind == 0x6c:  # l
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        items = []
+        for _ in range(length):
+            item, offset = _decode_value(data, offset)
+            items.append(item)
+        return items, offset
+    elif kind == 0x64:  # d
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    elif kind == 0x4e:  # N
+        return None, offset
+    elif kind == 0x54:  # T
+        return True, offset
+    elif kind == 0x46:  # F
+        return False, offset
+    elif kind == 0x6a:  # j
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        return json.loads(str(data[offset:offset + length], "utf-8")), offset + length
+
+    raise ValueError("Unknown value type: {}".format(kind))
+
+
+CODECS = {codec.name: codec for codec in [JsonCodec(), BinaryCodec()]}
+
+_binary = CODECS["binary"]
+
+
+# Returns the codec with the given name
+def get_codec(name):
+    if name not in CODECS:
+        raise ValueError("Unknown codec: {}".format(name))
+    return CODECS[name]
+
+
+# Decodes a message in any of the supported formats
+def decode(data):
+    return _binary.decode(data)
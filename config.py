@@ -0,0 +1,121 @@
+"""
+config.py
+
+Description:
+    This file contains the definition of the Config class.
+    It bundles the tunable options of nodes and clients, so new options
+    can be added without changing the constructor of every class.
+    Options that are not given keep their default value.
+"""
+
+
+class Config:
+    def __init__(self, **options):
+        # Wire format of outgoing messages, see codec.py ("json" or "binary")
+        self.codec = "json"
+        # Largest datagram that is sent, larger messages are fragmented
+        self.max_datagram_size = 8192
+        # Seconds after which an incomplete fragmented message is dropped
+        self.fragment_timeout = 5.0
+        # Requested size of the socket send and receive buffers in bytes, large
+        # enough to hold all fragments of a message of a few MB (None = OS default)
+        self.socket_buffer_size = 4 * 1024 * 1024
+        # Sizes of the receive and send buffer separately, override socket_buffer_size
+        self.recv_buffer_size = None
+        self.send_buffer_size = None
+        # Most datagrams a node receives at once before its timers run, the ones
+        # after the first are only taken if they are already waiting (1 disables)
+        self.recv_batch = 32
+        # Seconds that acknowledgements and write orders are held back to be sent
+        # as one batch message (0 sends every message immediately)
+        self.batch_interval = 0
+        # Number of acknowledgements or write orders after which a batch is sent
+        self.batch_size = 64
+        # Transport between nodes and clients, "udp" or "inproc", which connects them
+        # within one process without sockets (see inproc.py)
+        self.transport = "udp"
+        # inproc.Network that in-process endpoints are bound to (None = a shared one)
+        self.network = None
+        # Encode and decode in-process messages with the codec, as they would be on the wire
+        self.inproc_codec = False
+        # Function that returns the time in seconds for the timers of nodes, None uses
+        # time.monotonic (the simulator in simulation.py gives nodes a virtual clock)
+        self.clock = None
+        # Random generator of the random choices of nodes, None uses the module random
+        # (the simulator gives nodes a seeded one, so a run can be repeated)
+        self.rng = None
+        # How Node.run receives messages, "blocking" (a receive loop per node)
+        # or "asyncio" (see aio.py, which can also run many nodes on one thread)
+        self.event_loop = "blocking"
+        # Directory of the write-ahead logs of the nodes, None keeps data in memory only
+        self.wal_dir = None
+        # When WAL records are synced to disk, "always", "batch" or "off" (see wal.py)
+        self.wal_fsync = "batch"
+        # Number of WAL records and seconds after which waiting records are committed
+        self.wal_batch_size = 128
+        self.wal_commit_interval = 0.01
+        # Number of WAL records after which a snapshot replaces the log
+        self.snapshot_interval = 100000
+        # Maximum number of client writes of a node that are not ordered yet (0 = unbounded)
+        self.write_window = 0
+        # What happens to a client write when the window is full, "queue" or "busy"
+        self.window_policy = "queue"
+        # Number of other nodes that have to acknowledge a write before it is
+        # ordered, None waits for all of them. A node outside the quorum may not
+        # know of a completed write, so with a quorum reads at the followers
+        # first ask the leader how far it has ordered
+        self.ack_quorum = None
+        # Seconds that a node waits for a missing write or order before it fetches
+        # it from the leader, and the number of recent writes the leader keeps for this
+        self.catchup_timeout = 0.2
+        self.catchup_window = 10000
+        # Seconds between heartbeats of the leader (0 disables failure detection), and
+        # seconds without heartbeat after which the followers elect a new leader
+        self.heartbeat_interval = 0
+        self.election_timeout = 1.0
+        # Seconds that a lease granted by a majority of the nodes lets the leader answer
+        # leader reads from its own state (0 disables leases)
+        self.lease_duration = 0
+        # Whether clients send reads to the leader when they know it
+        self.leader_reads = False
+        # Number of orders that old versions are kept for snapshot reads (0 keeps only the latest)
+        self.version_retention = 1000
+        # Number of keys per request and requests in flight of Client.bulk_write and bulk_read
+        self.bulk_chunk_size = 64
+        self.bulk_window = 8
+        # Sequence, acknowledge and retransmit all messages between nodes (see reliable.py)
+        self.reliable = False
+        # Initial, minimum and maximum retransmission timeout in seconds
+        self.rto_initial = 0.05
+        self.rto_min = 0.01
+        self.rto_max = 1.0
+        # Seconds that a reliable acknowledgement is held back to cover more messages
+        self.ack_delay = 0.002
+        # Fraction of the datagrams between nodes that is dropped on purpose, for testing
+        self.loss_rate = 0.0
+        # Level of the structured trace of all subsystems ("debug", "info", "warning" or
+        # None, which disables it) and per subsystem, see tracing.py
+        self.trace_level = None
+        self.trace_levels = {}
+        # Fraction of the debug events (one per message) that is recorded
+        self.trace_sample = 1.0
+        # Number of most recent events that are kept
+        self.trace_buffer_size = 10000
+        # Also pass the recorded events to the logging module
+        self.trace_log = False
+        # Fraction of the client requests that carry a trace id, the nodes record every hop
+        # of a tagged request (see tracing.py and experiments/trace_report.py)
+        self.request_trace_sample = 0.0
+        # Port of the HTTP endpoint with the metrics of a node, in the Prometheus text
+        # format, every node uses this port plus its rank (0 picks a free port, None disables it)
+        self.metrics_port = None
+
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise TypeError("Unknown config option: {}".format(name))
+            setattr(self, name, value)
+
+    # Allows you to print the config as a string
+    def __repr__(self) -> str:
+        return "Config({})".format(", ".join(
+            "{}={!r}".format(k, v) for k, v in sorted(vars(self).items())))
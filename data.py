@@ -4,24 +4,33 @@ data.py
 Description:
     This file contains the defnition of the PendingElement class.
     The PendingElement contains a key-value pair along with
-    the message id, list of nodes who acknowledged it and the client address.
+    the nodes who acknowledged it and the client address
+    and request id.
     It is used to store writes in the acknowledgement buffer until all
-    nodes in the system have acknoledged it.
+    nodes in the system (or a quorum of them) have acknoledged it, and in the write buffer until
+    the write has been ordered. The stamp is the time of the last step of the write, which
+    the node uses to measure how long the next step takes. Many writes can be in flight, so it has no
+    __dict__ and the acknowledging nodes are kept as a bitmask.
 """
 
 class PendingElement:
-    def __init__(self, keys, values, msg_id, client_addr):
+    __slots__ = ("keys", "values", "client_addr", "rid", "acknowledged", "n_acks", "stamp")
+
+    def __init__(self, keys, values, client_addr=None, rid=None, stamp=None):
         self.keys = keys
         self.values = values
-        self.msg_id = msg_id
-        self.acknowledged = set()
         self.client_addr = client_addr
+        self.rid = rid
+        self.stamp = stamp
+        self.acknowledged = 0
+        self.n_acks = 0
 
-    # Adds node_port to set of nodes who acknowledged the write
-    def acknowledge(self, node_port):
-        self.acknowledged.add(node_port)
-
-    # Checks whether all nodes have acknowledged the write
-    def is_complete(self, number_of_nodes):
-        return len(self.acknowledged) == number_of_nodes
+    # Adds the bit of a node to the nodes who acknowledged the write
+    def acknowledge(self, node_bit):
+        if not self.acknowledged & node_bit:
+            self.acknowledged |= node_bit
+            self.n_acks += 1
 
+    # Checks whether enough nodes have acknowledged the write
+    def is_complete(self, quorum):
+        return self.n_acks >= quorum
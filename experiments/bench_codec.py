@@ -0,0 +1,51 @@
+"""
+bench_codec.py
+
+Description:
+    Benchmark of the wire formats in codec.py.
+    For every message type it reports the number of bytes on the wire and
+    the encode and decode throughput of each codec.
+"""
+
+import sys
+from time import perf_counter
+
+sys.path.append('..')
+import codec
+
+
+MESSAGES = {
+    "exit": {"type": "exit"},
+    "write": {"type": "write", "id": "127.0.0.1:25000:1234", "keys": ["17"], "values": [0.6394267984578837], "from": ["127.0.0.1", 25000]},
+    "acknowledge": {"type": "acknowledge", "id": "127.0.0.1:25000:1234", "from": ["127.0.0.1", 25001]},
+    "write_order": {"type": "write_order", "id": "127.0.0.1:25000:1234", "index": 98765},
+    "client_write": {"type": "client_write", "keys": ["17"], "values": [0.6394267984578837]},
+    "client_read": {"type": "client_read", "key": ["17"]},
+    "client_write_ack": {"type": "client_write_ack", "id": "127.0.0.1:25000:1234"},
+    "write_result": {"type": "write_result", "key": ["17"], "value": [0.6394267984578837]},
+    "read_result": {"type": "read_result", "key": ["17"], "value": 0.6394267984578837, "order_index": 98765},
+}
+
+
+# Returns the number of operations per second of func
+def throughput(func, arg, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        func(arg)
+    end = perf_counter()
+
+    return repeat / (end - start)
+
+
+if __name__ == '__main__':
+    repeat = 100000 if len(sys.argv) < 2 else int(sys.argv[1])
+
+    print("{:<18} {:<7} {:>6} {:>14} {:>14}".format("message", "codec", "bytes", "encode/s", "decode/s"))
+    for name, message in MESSAGES.items():
+        for c in codec.CODECS.values():
+            encoded = c.encode(message)
+            assert codec.decode(encoded) == message
+
+            encode_rate = throughput(c.encode, message, repeat)
+            decode_rate = throughput(c.decode, encoded, repeat)
+            print("{:<18} {:<7} {:>6} {:>14.0f} {:>14.0f}".format(name, c.name, len(encoded), encode_rate, decode_rate))
@@ -0,0 +1,54 @@
+"""
+bench_failover.py
+
+Description:
+    Benchmark of the write unavailability during a leader failover.
+    A client writes to the followers of a local cluster without pause. After
+    a second the leader is shut down, the followers detect the missing
+    heartbeats and elect a new leader. For several election timeouts it
+    reports the longest time between two completed writes, which is the
+    window in which no write could complete.
+"""
+
+import random
+import sys
+from time import perf_counter
+
+sys.path.append('..')
+from config import Config
+from leader import Leader
+from system import System
+
+
+def run(config, port, n_nodes=5, before=1.0, after=2.0):
+    system = System("failover", n_nodes, 1, port, config=config)
+    system.start()
+    client = system.clients[0]
+    followers = system.node_hosts[:-1]
+
+    completed = []
+    start = perf_counter()
+    killed_at = None
+    i = 0
+    while perf_counter() - start < before + after:
+        if killed_at is None and perf_counter() - start >= before:
+            client.exit_single(system.node_hosts[-1])
+            killed_at = perf_counter()
+
+        client.write("key{}".format(i % 100), i, host=random.choice(followers))
+        completed.append(perf_counter())
+        i += 1
+
+    system.shutdown()
+
+    gaps = [b - a for a, b in zip(completed, completed[1:]) if b >= killed_at]
+    elected = [node for node in system.followers if isinstance(node, Leader)]
+    return max(gaps), len(completed), len(elected)
+
+
+if __name__ == '__main__':
+    print("{:>18} {:>18} {:>8} {:>8}".format("election timeout", "unavailable (ms)", "writes", "leaders"))
+    for i, election_timeout in enumerate([0.1, 0.25, 0.5]):
+        config = Config(heartbeat_interval=election_timeout / 5, election_timeout=election_timeout)
+        window, n_writes, n_leaders = run(config, 26400 + i * 10)
+        print("{:>18} {:>18.0f} {:>8} {:>8}".format(election_timeout, window * 1e3, n_writes, n_leaders))
@@ -0,0 +1,67 @@
+"""
+bench_inproc.py
+
+Description:
+    Benchmark of the in-process transport in inproc.py.
+    The same blocking writes and reads are run against a local system with
+    every node on its own thread over UDP sockets, over the in-process
+    transport, and with direct dispatch, where the whole system runs on the
+    thread of the client. It reports the operations per second and how long
+    it takes to start the system.
+"""
+
+import sys
+from time import perf_counter
+
+sys.path.append('..')
+from config import Config
+from follower import Follower
+from inproc import Network
+from leader import Leader
+from system import System
+
+
+# Runs all nodes on the thread of the client, with direct dispatch
+class DispatchSystem(System):
+    def _startup_nodes(self):
+        self.followers = [Follower(("127.0.0.1", port), [h for h in self.node_hosts if h[1] != port], self.node_hosts[-1], config=self.config) for port in self.ports[:-1]]
+        self.leader = Leader(self.node_hosts[-1], self.node_hosts[:-1], self.node_hosts[-1], config=self.config)
+        self.config.network.attach(self.leader, *self.followers)
+        self.threads = []
+
+    def shutdown(self):
+        super().shutdown()
+        self.config.network.run_until_idle()
+
+
+# Performs n_ops alternating writes and reads, returns the startup time and the operations per second
+def run(config, n_ops, port, dispatch=False):
+    start = perf_counter()
+    system = (DispatchSystem if dispatch else System)("bench", 4, 1, port, config=config)
+    system.start()
+    startup = perf_counter() - start
+
+    client = system.clients[0]
+    start = perf_counter()
+    for i in range(n_ops // 2):
+        client.write("key{}".format(i % 100), i)
+        client.read("key{}".format(i % 100))
+    elapsed = perf_counter() - start
+    system.shutdown()
+
+    return startup, n_ops / elapsed
+
+
+if __name__ == '__main__':
+    n_ops = 20000
+
+    print("{:>18} {:>14} {:>10}".format("transport", "startup (ms)", "ops/s"))
+    runs = [
+        ("udp", Config(), False),
+        ("inproc", Config(transport="inproc", network=Network()), False),
+        ("inproc + codec", Config(transport="inproc", network=Network(), inproc_codec=True), False),
+        ("inproc dispatch", Config(transport="inproc", network=Network()), True),
+    ]
+    for i, (name, config, dispatch) in enumerate(runs):
+        startup, rate = run(config, n_ops, 27000 + i * 10, dispatch)
+        print("{:>18} {:>14.2f} {:>10.0f}".format(name, startup * 1e3, rate))
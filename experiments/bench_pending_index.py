@@ -0,0 +1,58 @@
+"""
+bench_pending_index.py
+
+Description:
+    Micro-benchmark for the pending-write check of a follower.
+    It fills the write buffer of a follower with an increasing number of
+    in-flight writes and measures the latency of a client read, which
+    should stay flat now that pending keys are tracked in an index.
+"""
+
+import random
+import sys
+from time import perf_counter
+
+sys.path.append('..')
+from follower import Follower
+
+
+# Zipf-like key distribution, similar to the one used in experiment.py
+def zipf_key():
+    return str(int(random.paretovariate(0.1)))
+
+
+def fill_write_buffer(follower, n_writes):
+    for i in range(n_writes):
+        data = {
+            "type": "write",
+            "id": "bench:{}".format(i),
+            "keys": [zipf_key()],
+            "values": [i],
+        }
+        follower.handle_write(("127.0.0.1", 0), data)
+
+
+def measure_reads(follower, n_reads):
+    keys = [zipf_key() for _ in range(n_reads)]
+    start = perf_counter()
+    for key in keys:
+        follower.handle_client_read(("127.0.0.1", 0), {"type": "client_read", "key": [key]})
+    end = perf_counter()
+
+    return (end - start) / n_reads
+
+
+if __name__ == '__main__':
+    n_reads = 10000
+
+    print("{:>10} {:>16}".format("in-flight", "read latency (us)"))
+    for n_writes in [0, 10, 100, 1000, 10000, 100000]:
+        follower = Follower(("127.0.0.1", 0), [], ("127.0.0.1", 0))
+        # Only the local bookkeeping is measured, messages are not sent
+        follower.send = lambda addr, message: None
+
+        fill_write_buffer(follower, n_writes)
+        latency = measure_reads(follower, n_reads)
+        print("{:>10} {:>16.2f}".format(n_writes, latency * 1e6))
+
+        follower.transport.close()
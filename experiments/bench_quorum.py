@@ -0,0 +1,76 @@
+"""
+bench_quorum.py
+
+Description:
+    Benchmark of the write latency with an acknowledgement quorum.
+    A local cluster of 16 nodes, the configuration of perf_exp_1.py, is run
+    with one follower that handles its messages with a delay, like the
+    run_delayed follower in the tests. For several values of
+    config.ack_quorum it reports the median and 99th percentile latency of
+    blocking writes to the other nodes.
+"""
+
+import random
+import sys
+import time
+from threading import Thread
+from time import perf_counter
+
+sys.path.append('..')
+from client import Client
+from config import Config
+from follower import Follower
+from leader import Leader
+
+
+# Receive loop of a node that is slow to handle its messages
+def run_slow(node, delay):
+    node.transport.settimeout(node.tick_interval)
+    while node.is_connected:
+        time.sleep(delay)
+        node.receive()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+# Performs n_writes blocking writes and returns their latencies
+def run(config, n_nodes, n_writes, port, delay):
+    node_hosts = [("127.0.0.1", p) for p in range(port, port + n_nodes)]
+    followers = [Follower(host, [h for h in node_hosts if h != host], node_hosts[-1], config=config)
+                 for host in node_hosts[:-1]]
+    leader = Leader(node_hosts[-1], node_hosts[:-1], node_hosts[-1], config=config)
+
+    # The first follower is the slow one
+    threads = [Thread(target=run_slow, args=(followers[0], delay))]
+    threads += [Thread(target=node.run) for node in [leader, *followers[1:]]]
+    for thread in threads:
+        thread.start()
+
+    client = Client(node_hosts, config=config)
+    latencies = []
+    try:
+        for i in range(n_writes):
+            start = perf_counter()
+            client.write("key{}".format(i % 100), i, host=random.choice(node_hosts[1:-1]))
+            latencies.append(perf_counter() - start)
+    finally:
+        client.exit()
+        for thread in threads:
+            thread.join()
+
+    return latencies
+
+
+if __name__ == '__main__':
+    n_nodes = 16
+    n_writes = 1000
+
+    print("{:>8} {:>9} {:>9}".format("quorum", "p50 (ms)", "p99 (ms)"))
+    for i, quorum in enumerate([None, 12, 8]):
+        config = Config(ack_quorum=quorum)
+        latencies = run(config, n_nodes, n_writes, 26100 + i * 20, delay=0.001)
+        print("{:>8} {:>9.2f} {:>9.2f}".format(
+            str(quorum or "all"), percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3))
@@ -0,0 +1,71 @@
+"""
+bench_read_path.py
+
+Description:
+    Benchmark of the read path of a single node.
+    It replays the read-heavy mix of perf_exp_2.py (two thirds reads of keys
+    that were written before, one third writes of zipf distributed keys)
+    against a follower and reports the reads per second the node handles,
+    once through the fast path for keys without pending writes and once
+    through the ReadTransaction path that every read took before.
+    Only the local handling is measured, messages are not sent.
+"""
+
+import random
+import sys
+from time import perf_counter
+
+sys.path.append('..')
+from follower import Follower
+
+
+# Zipf-like key distribution, similar to the one used in experiment.py
+def zipf_key():
+    return str(int(random.paretovariate(0.1)))
+
+
+# Returns the operations of the read-heavy mix as (is_read, key) tuples
+def read_heavy_mix(n_ops):
+    operations = []
+    used_keys = [zipf_key()]
+    operations.append((False, used_keys[0]))
+    for _ in range(n_ops - 1):
+        if random.random() <= 0.66:
+            operations.append((True, random.choice(used_keys)))
+        else:
+            key = zipf_key()
+            used_keys.append(key)
+            operations.append((False, key))
+
+    return operations
+
+
+def measure_reads(follower, operations):
+    elapsed = 0
+    n_reads = 0
+    for i, (is_read, key) in enumerate(operations):
+        if not is_read:
+            follower.store([key], [i], i)
+            continue
+
+        message = {"type": "client_read", "key": [key], "rid": i}
+        start = perf_counter()
+        follower.handle_client_read(("127.0.0.1", 0), message)
+        elapsed += perf_counter() - start
+        n_reads += 1
+
+    return n_reads / elapsed
+
+
+if __name__ == '__main__':
+    operations = read_heavy_mix(300000)
+
+    print("{:>18} {:>12}".format("read path", "reads/s"))
+    for name in ["fast", "transaction"]:
+        follower = Follower(("127.0.0.1", 0), [], ("127.0.0.1", 0))
+        follower.send = lambda addr, message: None
+        if name == "transaction":
+            follower.handle_client_read = follower.handle_pending_read
+
+        print("{:>18} {:>12.0f}".format(name, measure_reads(follower, operations)))
+        follower.transport.close()
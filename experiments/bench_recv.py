@@ -0,0 +1,132 @@
+"""
+bench_recv.py
+
+Description:
+    Benchmark of the receive path of a node in transport.py.
+    Rounds of messages are sent to a receiving transport until its socket
+    buffer holds a round, then the time it takes to receive and decode the
+    round is measured. This is done with the original receive path, which
+    copies every datagram into a new bytes object with recvfrom and decodes
+    that, with recvfrom_into and decoding straight from the reused buffer, and
+    with recv_batch, which also drains the waiting datagrams without polling
+    the socket first. It reports the messages per second a transport can take
+    in. The second table runs the receive loop of a follower, with reliable
+    delivery, so the timers run after every receive, once per datagram and
+    once per batch.
+"""
+
+import sys
+from time import perf_counter, sleep
+
+sys.path.append('..')
+import codec
+from config import Config
+from follower import Follower
+from transport import MAX_DATAGRAM, UdpTransport
+
+MESSAGES = {
+    "acknowledge": {"type": "acknowledge", "id": 123456, "from": ["127.0.0.1", 25001]},
+    "write": {"type": "write", "id": 123456, "keys": ["key42"], "values": ["value42"], "from": ["127.0.0.1", 25000]},
+}
+
+
+# The receive path before recvfrom_into: a new bytes object per datagram
+def recv_copy(transport, n_messages):
+    for _ in range(n_messages):
+        data, addr = transport.socket.recvfrom(MAX_DATAGRAM)
+        codec.decode(data)
+
+
+def recv_into(transport, n_messages):
+    for _ in range(n_messages):
+        transport.recv()
+
+
+def recv_batch(transport, n_messages):
+    received = 0
+    while received < n_messages:
+        received += len(transport.recv_batch())
+
+
+# Returns the messages per second of a receive path
+def run(recv, codec_name, message, n_rounds, round_size):
+    receiver = UdpTransport(0, Config(recv_batch=64))
+    receiver.settimeout(0.01)
+    sender = UdpTransport(0, Config(codec=codec_name))
+    addr = ("127.0.0.1", receiver.socket.getsockname()[1])
+
+    elapsed = 0
+    try:
+        for _ in range(n_rounds):
+            for _ in range(round_size):
+                sender.send(message, addr)
+            sleep(0.001)
+
+            start = perf_counter()
+            recv(receiver, round_size)
+            elapsed += perf_counter() - start
+    finally:
+        receiver.close()
+        sender.close()
+
+    return n_rounds * round_size / elapsed
+
+
+# Returns the messages per second the receive loop of a follower handles
+def run_node(recv_batch, n_rounds, round_size):
+    config = Config(recv_batch=recv_batch, reliable=True, ack_quorum=2)
+    peers = [("127.0.0.1", 1), ("127.0.0.1", 2), ("127.0.0.1", 3)]
+    follower = Follower(("127.0.0.1", 0), peers, peers[0], config=config)
+    follower.transport.settimeout(0.01)
+    follower.transmit = lambda addr, message: None
+    sender = UdpTransport(0, Config())
+    addr = ("127.0.0.1", follower.transport.socket.getsockname()[1])
+
+    # Acknowledgements of unknown writes are ignored, so mostly the loop itself is measured
+    handled = [0]
+
+    def on_message(addr, data):
+        handled[0] += 1
+    follower.on_message = on_message
+
+    elapsed = 0
+    try:
+        for _ in range(n_rounds):
+            for _ in range(round_size):
+                sender.send(MESSAGES["acknowledge"], addr)
+            sleep(0.001)
+
+            handled[0] = 0
+            start = perf_counter()
+            while handled[0] < round_size:
+                follower.receive()
+            elapsed += perf_counter() - start
+    finally:
+        follower.transport.close()
+        sender.close()
+
+    return n_rounds * round_size / elapsed
+
+
+if __name__ == '__main__':
+    n_rounds = 200
+    round_size = 500
+    paths = [("recvfrom", recv_copy), ("recvfrom_into", recv_into), ("recv_batch", recv_batch)]
+
+    print("{:>8} {:>12} {:>14} {:>12} {:>9}".format("codec", "message", "path", "msgs/s", "speedup"))
+    for codec_name in ["json", "binary"]:
+        for name, message in MESSAGES.items():
+            baseline = None
+            for path, recv in paths:
+                rate = run(recv, codec_name, message, n_rounds, round_size)
+                baseline = baseline or rate
+                print("{:>8} {:>12} {:>14} {:>12.0f} {:>8.2f}x".format(
+                    codec_name, name, path, rate, rate / baseline))
+
+    print()
+    print("{:>12} {:>12} {:>9}".format("recv_batch", "msgs/s", "speedup"))
+    baseline = None
+    for batch in [1, 8, 64]:
+        rate = run_node(batch, n_rounds, round_size)
+        baseline = baseline or rate
+        print("{:>12} {:>12.0f} {:>8.2f}x".format(batch, rate, rate / baseline))
@@ -0,0 +1,63 @@
+"""
+bench_reliable.py
+
+Description:
+    Loss-injection benchmark of the reliable delivery layer in reliable.py.
+    A local system is run with an increasing fraction of the datagrams
+    between nodes dropped (config.loss_rate). For each loss rate it reports
+    the write throughput, the median and 99th percentile write latency and
+    the number of retransmissions, acknowledgements sent on their own and
+    acknowledgements piggybacked on other messages. The first rows run
+    without the reliable layer, which shows its cost when nothing is lost.
+    Reliable writes complete once they are ordered, so the second row, with
+    writes that also complete once ordered, is the baseline to compare with.
+"""
+
+import sys
+from time import perf_counter
+
+sys.path.append('..')
+from config import Config
+from system import System
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+# Performs n_writes blocking writes and returns their latencies
+def run(config, n_writes, port, order_on_write=False):
+    system = System("bench", 4, 1, port, order_on_write=order_on_write, config=config)
+    system.start()
+    client = system.clients[0]
+
+    latencies = []
+    try:
+        for i in range(n_writes):
+            start = perf_counter()
+            client.write("key{}".format(i % 100), i)
+            latencies.append(perf_counter() - start)
+    finally:
+        system.shutdown()
+
+    nodes = [system.leader, *system.followers]
+    stats = {name: sum(node.reliable.stats.get(name, 0) for node in nodes if node.reliable)
+             for name in ["retransmitted", "acks_sent", "acks_piggybacked"]}
+    return latencies, stats
+
+
+if __name__ == '__main__':
+    n_writes = 2000
+
+    print("{:>9} {:>8} {:>6} {:>12} {:>9} {:>9} {:>14} {:>10} {:>12}".format(
+        "reliable", "ordered", "loss", "writes/s", "p50 (ms)", "p99 (ms)", "retransmitted", "acks", "piggybacked"))
+    runs = [(False, False, 0.0), (False, True, 0.0), (True, True, 0.0), (True, True, 0.01), (True, True, 0.05),
+            (True, True, 0.1)]
+    for i, (reliable, ordered, loss_rate) in enumerate(runs):
+        config = Config(reliable=reliable, loss_rate=loss_rate)
+        latencies, stats = run(config, n_writes, 26000 + i * 10, order_on_write=ordered)
+        print("{:>9} {:>8} {:>6.2f} {:>12.0f} {:>9.2f} {:>9.2f} {:>14} {:>10} {:>12}".format(
+            str(reliable), str(ordered), loss_rate, len(latencies) / sum(latencies),
+            percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3, stats["retransmitted"],
+            stats["acks_sent"], stats["acks_piggybacked"]))
@@ -0,0 +1,58 @@
+"""
+bench_trace.py
+
+Description:
+    Overhead benchmark of the tracing in tracing.py.
+    Node.transmit is called for a typical write message with the transport
+    replaced by a no-op, so the cost of the tracing on the send path is
+    measured. It is compared with the eager logging.debug call that was made
+    for every message before, which formats the message even though DEBUG
+    is disabled. The logging module is left at its default WARNING level.
+"""
+
+import logging
+import sys
+from time import perf_counter
+
+sys.path.append('..')
+from config import Config
+from follower import Follower
+
+MESSAGE = {"type": "write", "id": 123456, "keys": ["key42"], "values": ["value42"], "from": ["127.0.0.1", 25000]}
+ADDR = ("127.0.0.1", 25001)
+
+
+# Returns the nanoseconds per transmit of a follower with the given config
+def run(config, n_messages, eager_logging=False):
+    follower = Follower(("127.0.0.1", 0), [], ("127.0.0.1", 0), config=config)
+    follower.transport.close()
+    follower.transport.send = lambda message, addr: None
+
+    # The eager logging that was used before tracing.py, its message is always formatted
+    def logged_transmit(addr, message):
+        logging.debug("{}, sent message: {} to {}".format(follower, message, addr))
+        follower.transport.send(message, addr)
+
+    transmit = logged_transmit if eager_logging else follower.transmit
+
+    start = perf_counter()
+    for _ in range(n_messages):
+        transmit(ADDR, MESSAGE)
+    return (perf_counter() - start) / n_messages * 1e9, len(follower.tracer.events)
+
+
+if __name__ == '__main__':
+    n_messages = 300000
+    modes = [
+        ("eager logging", Config(), True),
+        ("disabled", Config(), False),
+        ("ring buffer", Config(trace_level="debug"), False),
+        ("sampled 1%", Config(trace_level="debug", trace_sample=0.01), False),
+        ("info level", Config(trace_level="info"), False),
+        ("ring + logging", Config(trace_level="debug", trace_log=True), False),
+    ]
+
+    print("{:>16} {:>14} {:>9}".format("mode", "ns/message", "events"))
+    for name, config, eager_logging in modes:
+        ns, events = run(config, n_messages, eager_logging)
+        print("{:>16} {:>14.0f} {:>9}".format(name, ns, events))
@@ -0,0 +1,69 @@
+"""
+bench_wal_recovery.py
+
+Description:
+    Benchmark of the write-ahead log in wal.py.
+    It measures the append throughput of each fsync policy and the time it
+    takes to recover a node from logs of increasing size, with and without
+    a snapshot that covers most of the log.
+"""
+
+import random
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.append('..')
+from wal import WriteAheadLog
+
+
+# Appends n_records single-key writes over n_keys keys
+def fill_log(directory, n_records, n_keys=10000, fsync="off", snapshot_at=None):
+    wal = WriteAheadLog(directory, fsync=fsync, snapshot_interval=float("inf"))
+    wal.recover()
+    data = {}
+
+    start = perf_counter()
+    for i in range(n_records):
+        key = str(random.randrange(n_keys))
+        wal.append(i, [key], [random.random()], now=0)
+        data[key] = (i, i)
+        if snapshot_at is not None and i + 1 == snapshot_at:
+            wal.snapshot(data, i + 1)
+    wal.close()
+    end = perf_counter()
+
+    return n_records / (end - start)
+
+
+def recovery_time(directory):
+    start = perf_counter()
+    WriteAheadLog(directory).recover()
+    end = perf_counter()
+
+    return end - start
+
+
+if __name__ == '__main__':
+    print("Append throughput")
+    print("{:>8} {:>12}".format("fsync", "records/s"))
+    for fsync, n_records in [("always", 1000), ("batch", 100000), ("off", 100000)]:
+        directory = tempfile.mkdtemp()
+        print("{:>8} {:>12.0f}".format(fsync, fill_log(directory, n_records, fsync=fsync)))
+        shutil.rmtree(directory)
+
+    print("\nRecovery time")
+    print("{:>10} {:>12} {:>20}".format("records", "log only (s)", "snapshot at 90% (s)"))
+    for n_records in [1000, 10000, 100000, 1000000]:
+        directory = tempfile.mkdtemp()
+        fill_log(directory, n_records)
+        log_only = recovery_time(directory)
+        shutil.rmtree(directory)
+
+        directory = tempfile.mkdtemp()
+        fill_log(directory, n_records, snapshot_at=int(n_records * 0.9))
+        with_snapshot = recovery_time(directory)
+        shutil.rmtree(directory)
+
+        print("{:>10} {:>12.3f} {:>20.3f}".format(n_records, log_only, with_snapshot))
@@ -0,0 +1,79 @@
+"""
+bench_write_memory.py
+
+Description:
+    Memory benchmark of the per-write state of a node.
+    It measures the bytes allocated per in-flight write with tracemalloc,
+    for writes that this node originated and that are waiting for their
+    acknowledgements (ack_buffer), and for writes of other nodes that are
+    waiting for their order (write_buffer).
+    Only the local bookkeeping is measured, messages are not sent. The keys,
+    values and write messages are built before the measurement starts.
+"""
+
+import sys
+import tracemalloc
+
+sys.path.append('..')
+from follower import Follower
+
+
+def make_follower():
+    node_hosts = [("127.0.0.1", 1), ("127.0.0.1", 2), ("127.0.0.1", 3)]
+    follower = Follower(("127.0.0.1", 0), node_hosts, node_hosts[-1])
+    follower.send = lambda addr, message: None
+    return follower
+
+
+# Keys and values of n_writes writes that this node originates, each acknowledged by all but one node
+def prepare_ack_buffer(follower, n_writes):
+    return [(["key{}".format(i)], [i]) for i in range(n_writes)]
+
+
+def fill_ack_buffer(follower, writes):
+    for keys, values in writes:
+        msg_id = follower.write(keys, values, ("127.0.0.1", 9))
+        for host in follower.node_hosts[:-1]:
+            follower.handle_acknowledge(host, {"type": "acknowledge", "id": msg_id, "from": host})
+
+
+# Write messages of another node, none of them is ordered yet. The ids are taken from a
+# second node before the measurement, so its own buffers are not counted
+def prepare_write_buffer(follower, n_writes):
+    sender = Follower(("127.0.0.1", 1), [("127.0.0.1", 0)], ("127.0.0.1", 0))
+    sender.send = lambda addr, message: None
+    messages = []
+    for i in range(n_writes):
+        keys, values = ["key{}".format(i)], [i]
+        msg_id = sender.write(keys, values, None)
+        messages.append({"type": "write", "id": msg_id, "keys": keys, "values": values, "from": ("127.0.0.1", 1)})
+    sender.transport.close()
+    return messages
+
+
+def fill_write_buffer(follower, messages):
+    for message in messages:
+        follower.handle_write(("127.0.0.1", 1), message)
+
+
+# Only the allocations of fill are counted, the writes are prepared before the measurement
+def measure(prepare, fill, n_writes):
+    follower = make_follower()
+    writes = prepare(follower, n_writes)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fill(follower, writes)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    follower.transport.close()
+    return (after - before) / n_writes
+
+
+if __name__ == '__main__':
+    n_writes = 100000
+
+    print("{:>14} {:>16}".format("buffer", "bytes per write"))
+    print("{:>14} {:>16.0f}".format("ack_buffer", measure(prepare_ack_buffer, fill_ack_buffer, n_writes)))
+    print("{:>14} {:>16.0f}".format("write_buffer", measure(prepare_write_buffer, fill_write_buffer, n_writes)))
@@ -122,4 +122,4 @@ class Experiment:
             return None, False
 
     def _is_leader(self, host):
-        return self._current_system.node_hosts[-1] == host
\ No newline at end of file
+        return self._current_system.is_leader(host)
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""
+simulate.py
+
+Description:
+    Runs a cluster in the deterministic simulator of simulation.py and prints
+    the simulated throughput and latency percentiles of every seed, next to
+    the wall time the simulation took. A fault schedule can isolate the first
+    follower for a while or crash the leader. A run is repeated exactly with
+    the same seed, so two versions of the protocol can be compared on the
+    same schedule.
+
+    Usage: python simulate.py [--nodes 5] [--clients 8] [--duration 2] [--seeds 3]
+        [--latency 0.2] [--distribution exponential] [--loss 0.01] [--reliable]
+        [--partition 0.5:1.0] [--crash-leader 1.0] [--batch-interval 0.001]
+"""
+
+import argparse
+import sys
+from time import perf_counter
+
+sys.path.append('..')
+from config import Config
+import simulation
+
+
+# Returns the latency distribution of the arguments, the mean latency is given in ms
+def latency(args):
+    mean = args.latency / 1e3
+    if args.distribution == "constant":
+        return simulation.constant(mean)
+    if args.distribution == "uniform":
+        return simulation.uniform(0, 2 * mean)
+    if args.distribution == "lognormal":
+        return simulation.lognormal(mean, 0.5)
+    return simulation.exponential(mean / 2, base=mean / 2)
+
+
+def run(args, seed):
+    config = Config(reliable=args.reliable, batch_interval=args.batch_interval)
+    if args.crash_leader is not None:
+        config.heartbeat_interval = 0.05
+        config.election_timeout = 0.25
+
+    start = perf_counter()
+    sim = simulation.Simulation(args.nodes, seed=seed, latency=latency(args), service_time=args.service / 1e6,
+                                loss_rate=args.loss, reorder_rate=args.reorder, config=config)
+    sim.add_clients(args.clients, write_ratio=args.write_ratio, n_keys=args.keys)
+    if args.partition:
+        begin, end = (float(t) for t in args.partition.split(":"))
+        sim.partition([sim.node_hosts[0]], at=begin)
+        sim.heal(at=end)
+    if args.crash_leader is not None:
+        sim.crash(sim.leader.host, at=args.crash_leader)
+
+    sim.run(args.duration)
+    report = sim.report()
+    sim.close()
+    return report, perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated throughput and latencies under a fault schedule")
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=8, help="closed-loop clients")
+    parser.add_argument("--duration", type=float, default=2.0, help="simulated seconds")
+    parser.add_argument("--seeds", type=int, default=3, help="number of seeds, starting at 0")
+    parser.add_argument("--latency", type=float, default=0.2, help="mean one-way latency in ms")
+    parser.add_argument("--distribution", default="exponential",
+                        choices=["constant", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--service", type=float, default=20, help="microseconds a node spends per message")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of messages between nodes lost")
+    parser.add_argument("--reorder", type=float, default=0.0, help="fraction of messages held back 1 ms")
+    parser.add_argument("--reliable", action="store_true", help="retransmit lost messages (see reliable.py)")
+    parser.add_argument("--batch-interval", type=float, default=0)
+    parser.add_argument("--write-ratio", type=float, default=0.5)
+    parser.add_argument("--keys", type=int, default=100)
+    parser.add_argument("--partition", help="BEGIN:END seconds that the first follower is cut off")
+    parser.add_argument("--crash-leader", type=float, help="seconds after which the leader crashes")
+    args = parser.parse_args()
+
+    print("{:>5} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9} {:>11} {:>9}".format(
+        "seed", "ops/s", "write p50", "write p99", "read p50", "read p99", "max (ms)", "timeouts", "violations",
+        "wall (s)"))
+    for seed in range(args.seeds):
+        report, wall = run(args, seed)
+        latencies = report["latency"]
+        write = latencies.get("write", {})
+        read = latencies.get("read", {})
+        print("{:>5} {:>10.0f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>9} {:>11} {:>9.2f}".format(
+            seed, report["throughput"], write.get("p50", 0) * 1e3, write.get("p99", 0) * 1e3,
+            read.get("p50", 0) * 1e3, read.get("p99", 0) * 1e3,
+            max([s["max"] for s in latencies.values()] or [0]) * 1e3, report["timeouts"],
+            report["violations"], wall))
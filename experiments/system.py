@@ -5,16 +5,18 @@ import socket
 import time
 
 sys.path.append('..')
+import aio
 from leader import Leader
 from follower import Follower
 from client import Client
+import shard
 
 from threading import Thread
 
 
 class System:
 
-    def __init__(self, name, num_nodes, num_clients, port, order_on_write=False):
+    def __init__(self, name, num_nodes, num_clients, port, order_on_write=False, config=None):
         self.name = name
         self.num_nodes = num_nodes
         self.num_clients = num_clients
@@ -22,6 +24,7 @@ class System:
         self.node_hosts = [("127.0.0.1", port) for port in self.ports]
 
         self.order_on_write = order_on_write
+        self.config = config
 
         self.leader = None
         self.followers = None
@@ -33,28 +36,46 @@ class System:
         self._make_clients()
 
     def shutdown(self):
+        # The clients do not know the first node, so it is stopped separately
+        self.clients[0].exit_single(self.node_hosts[0])
         for client in self.clients: client.exit()
         for thread in self.threads: thread.join()
 
+    # Writes the trace events of every node and client to a file per node in directory,
+    # experiments/trace_report.py merges them
+    def dump_traces(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for node in [self.leader, *self.followers]:
+            node.tracer.dump(os.path.join(directory, "node_{}.trace".format(node.port)), subsystems=["request"])
+        for i, client in enumerate(self.clients):
+            client.tracer.dump(os.path.join(directory, "client_{}.trace".format(i)), subsystems=["request"])
+
     def _startup_nodes(self):
-        self.followers = [Follower(("127.0.0.1", port), [h for h in self.node_hosts if h[1] != port], self.node_hosts[-1], order_on_write=self.order_on_write) for port in self.ports[:-1]]
-        self.leader = Leader(self.node_hosts[-1], self.node_hosts[:-1], self.node_hosts[-1], order_on_write=self.order_on_write)
-        self.threads = [Thread(target=node.run) for node in [self.leader, *self.followers]]
+        self.followers = [Follower(("127.0.0.1", port), [h for h in self.node_hosts if h[1] != port], self.node_hosts[-1], order_on_write=self.order_on_write, config=self.config) for port in self.ports[:-1]]
+        self.leader = Leader(self.node_hosts[-1], self.node_hosts[:-1], self.node_hosts[-1], order_on_write=self.order_on_write, config=self.config)
+        if self.config and self.config.event_loop == "asyncio":
+            # A single event loop runs all nodes
+            self.threads = [Thread(target=aio.run_nodes, args=([self.leader, *self.followers],))]
+        else:
+            self.threads = [Thread(target=node.run) for node in [self.leader, *self.followers]]
 
         for thread in self.threads:
             thread.start()
 
     def _make_clients(self):
-        self.clients = [Client(self.node_hosts[1:]) for _ in range(self.num_clients)]
+        self.clients = [Client(self.node_hosts[1:], config=self.config, leader_host=self.node_hosts[-1]) for _ in range(self.num_clients)]
+
+    def is_leader(self, host):
+        return self.node_hosts[-1] == host
 
 class DasSystem(System):
 
-    def __init__(self, num_clients, port, order_on_write=False):
+    def __init__(self, num_clients, port, order_on_write=False, config=None):
         self.hostname = socket.gethostname()
         self.hostnames = os.getenv('HOSTS').split()
         self.port = port
 
-        super().__init__('DAS', len(self.hostnames) - 1, num_clients, port, order_on_write)
+        super().__init__('DAS', len(self.hostnames) - 1, num_clients, port, order_on_write, config)
         self.node_hosts = [(h, port) for h in self.hostnames]
     
     def _startup_nodes(self):
@@ -67,12 +88,35 @@ class DasSystem(System):
 
         host = (self.hostname, self.ports[0])
         if is_leader:
-            leader = Leader(host, [(h, self.port) for h in self.hostnames[1:] if h != self.hostname], host, order_on_write=self.order_on_write)
+            leader = Leader(host, [(h, self.port) for h in self.hostnames[1:] if h != self.hostname], host, order_on_write=self.order_on_write, config=self.config)
             leader.run() 
         elif not is_client:
-            follower = Follower(host, [(h, self.port) for h in self.hostnames[1:] if h != self.hostname], (self.hostnames[-1], self.port), order_on_write=self.order_on_write)
+            follower = Follower(host, [(h, self.port) for h in self.hostnames[1:] if h != self.hostname], (self.hostnames[-1], self.port), order_on_write=self.order_on_write, config=self.config)
             follower.run()
 
     def shutdown(self):
         for client in self.clients: 
             client.exit()
+
+
+class ShardedSystem(System):
+
+    def __init__(self, name, num_shards, nodes_per_shard, num_clients, port, order_on_write=False, config=None):
+        super().__init__(name, num_shards * nodes_per_shard, num_clients, port, order_on_write, config)
+        self.shards = shard.shard_hosts(num_shards, nodes_per_shard, port)
+        self.node_hosts = [host for node_hosts in self.shards for host in node_hosts]
+
+    def _startup_nodes(self):
+        # Every node runs in its own process, the processes are joined on shutdown
+        self.threads = shard.start_shards(self.shards, order_on_write=self.order_on_write, config=self.config)
+
+    # The sharded clients know every node, so they stop all of them
+    def shutdown(self):
+        for client in self.clients: client.exit()
+        for process in self.threads: process.join()
+
+    def _make_clients(self):
+        self.clients = [shard.ShardedClient(self.shards, config=self.config) for _ in range(self.num_clients)]
+
+    def is_leader(self, host):
+        return any(node_hosts[-1] == host for node_hosts in self.shards)
@@ -0,0 +1,206 @@
+"""
+trace_report.py
+
+Description:
+    Merges the request traces of all nodes and clients of a run into a
+    breakdown of the time every tagged request spent per hop.
+    The trace files are written by System.dump_traces (Tracer.dump), one per
+    node and client. Timestamps are moved to the wall clock with the offset
+    in the first line of every file; across machines the one-way hops
+    include the clock skew between them.
+
+    A write is split into the hops of its critical path to the client: the
+    client_write to its origin node, the write broadcast to the node whose
+    acknowledgement completed the quorum, that acknowledgement back, and the
+    write_result back to the client. The ordering path, which decides when
+    the write becomes visible, is reported separately: the client_write_ack
+    to the leader, and the write_order until the last node applied it.
+
+    Usage: python trace_report.py <directory or trace files> [--top N] [--folded FILE]
+    --folded writes the total time per hop as folded stacks, the input of
+    flame graph tools such as flamegraph.pl or speedscope.
+"""
+
+import argparse
+from collections import defaultdict
+from functools import lru_cache
+import json
+import os
+import socket
+
+WRITE_HOPS = ["client -> origin", "write -> peer", "peer ack -> origin", "origin -> client"]
+ORDER_HOPS = ["client_write_ack -> leader", "write_order -> applied"]
+READ_HOPS = ["client -> node", "node -> client"]
+
+
+# Returns the events of all files as (wall time, source, event, fields) tuples
+def load(paths):
+    events = []
+    for path in paths:
+        with open(path) as file:
+            header = json.loads(file.readline())
+            for line in file:
+                at, subsystem, event, fields = json.loads(line)
+                if subsystem == "request":
+                    events.append((at + header["clock_offset"], header["node"], event, fields))
+    return events
+
+
+def trace_files(inputs):
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".trace"))
+        else:
+            paths.append(path)
+    return paths
+
+
+# Groups the events by trace id, every request is a dict of event name to a list of (time, source, fields)
+def group(events):
+    requests = defaultdict(lambda: defaultdict(list))
+    for at, source, event, fields in sorted(events, key=lambda event: event[0]):
+        requests[fields[0]][event].append((at, source, fields[1:]))
+    return requests
+
+
+# Returns (kind, total latency, {hop: seconds}, {ordering hop: seconds}) of a request
+def breakdown(request):
+    sent = request.get("sent")
+    received = request.get("received")
+    hops = {}
+    order_hops = {}
+
+    if "client_read" in request:
+        arrived = request["client_read"][0][0]
+        if sent:
+            hops["client -> node"] = arrived - sent[0][0]
+        if received:
+            hops["node -> client"] = received[0][0] - arrived
+        total = received[0][0] - sent[0][0] if sent and received else None
+        return "read", total, hops, order_hops
+
+    if "client_write" not in request:
+        return None, None, hops, order_hops
+
+    origin_at = request["client_write"][0][0]
+    if sent:
+        hops["client -> origin"] = origin_at - sent[0][0]
+
+    # The acknowledgement that completed the quorum is the last one before acked
+    acked = request.get("acked")
+    if acked:
+        acked_at = acked[0][0]
+        acks = [(at, _normalize(tuple(fields[1]))) for at, _, fields in request.get("ack", ()) if at <= acked_at]
+        if acks:
+            ack_at, peer = max(acks, key=lambda ack: ack[0])
+            writes = [at for at, source, _ in request.get("write", ()) if _address(source) == peer]
+            if writes:
+                hops["write -> peer"] = writes[0] - origin_at
+                hops["peer ack -> origin"] = ack_at - writes[0]
+            else:
+                hops["write -> peer"] = ack_at - origin_at
+        if received:
+            hops["origin -> client"] = received[0][0] - acked_at
+
+        leader_ack = request.get("client_write_ack")
+        ordered = request.get("ordered")
+        applied = request.get("applied")
+        if leader_ack:
+            order_hops["client_write_ack -> leader"] = leader_ack[0][0] - acked_at
+        if ordered and applied:
+            order_hops["write_order -> applied"] = max(at for at, _, _ in applied) - ordered[0][0]
+
+    total = received[0][0] - sent[0][0] if sent and received else None
+    return "write", total, hops, order_hops
+
+
+# Returns the address of a node from its name, such as "Follower:127.0.0.1:25000"
+def _address(node):
+    host, port = node.split(":")[1:3]
+    return _normalize((host, int(port)))
+
+
+@lru_cache(maxsize=None)
+def _normalize(addr):
+    return socket.gethostbyname(addr[0]), int(addr[1])
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+# Prints the latencies per hop, with the share of the hop in the total latency if known
+def print_table(title, hops, samples, totals):
+    print(title)
+    print("{:>28} {:>8} {:>10} {:>10} {:>10} {:>8}".format("hop", "count", "p50 (ms)", "p99 (ms)", "max (ms)", "share"))
+    for hop in hops:
+        values = samples[hop]
+        if not values:
+            continue
+        share = "{:.1f}%".format(sum(values) / sum(totals) * 100) if totals else ""
+        print("{:>28} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>8}".format(
+            hop, len(values), percentile(values, 0.5) * 1e3, percentile(values, 0.99) * 1e3,
+            max(values) * 1e3, share))
+    if totals:
+        print("{:>28} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            "total", len(totals), percentile(totals, 0.5) * 1e3, percentile(totals, 0.99) * 1e3, max(totals) * 1e3))
+    print()
+
+
+# Prints a bar per hop with its share of the total time, a flame graph of one level
+def print_flame(stacks):
+    total = sum(stacks.values()) or 1
+    print("Time per hop over the whole run")
+    for stack, seconds in sorted(stacks.items(), key=lambda item: -item[1]):
+        share = seconds / total
+        print("{:<45} {:>9.1f} ms {:>6.1f}% {}".format(stack, seconds * 1e3, share * 100, "#" * int(share * 50)))
+    print()
+
+
+def report(requests, top):
+    samples = defaultdict(list)
+    totals = defaultdict(list)
+    stacks = defaultdict(float)
+    slowest = []
+
+    for trace, request in requests.items():
+        kind, total, hops, order_hops = breakdown(request)
+        if kind is None:
+            continue
+        for hop, seconds in list(hops.items()) + list(order_hops.items()):
+            samples[hop].append(seconds)
+        for hop, seconds in hops.items():
+            stacks["{};{}".format(kind, hop)] += seconds
+        for hop, seconds in order_hops.items():
+            stacks["{} ordering;{}".format(kind, hop)] += seconds
+        if total is not None:
+            totals[kind].append(total)
+            slowest.append((total, trace, kind, hops))
+
+    print_table("Writes, critical path to the client", WRITE_HOPS, samples, totals["write"])
+    print_table("Writes, ordering until visible on all nodes", ORDER_HOPS, samples, [])
+    print_table("Reads", READ_HOPS, samples, totals["read"])
+    print_flame(stacks)
+
+    print("Slowest {} requests".format(top))
+    for total, trace, kind, hops in sorted(slowest, reverse=True)[:top]:
+        parts = ", ".join("{} {:.3f}".format(hop, seconds * 1e3) for hop, seconds in hops.items())
+        print("{:>20} {:>6} {:>9.3f} ms: {}".format(trace, kind, total * 1e3, parts))
+
+    return stacks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-hop breakdown of traced requests")
+    parser.add_argument("inputs", nargs="+", help="trace files or directories with .trace files")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest requests to show")
+    parser.add_argument("--folded", help="file to write the time per hop to as folded stacks (microseconds)")
+    args = parser.parse_args()
+
+    stacks = report(group(load(trace_files(args.inputs))), args.top)
+    if args.folded:
+        with open(args.folded, "w") as file:
+            for stack, seconds in sorted(stacks.items()):
+                file.write("{} {}\n".format(stack, int(seconds * 1e6)))
@@ -8,38 +8,136 @@ Description:
     function for handeling read and write operations.
 """
 
-from collections import defaultdict
+from collections import defaultdict, deque
 from data import PendingElement
 from node import Node
 from readtransaction import ReadTransaction
+from reliable import normalize
+from store import NO_ENTRY, VersionedStore
+from wal import WriteAheadLog
 import logging
+import os
 import sys
 
 
 class Follower(Node):
     """
     """
-    def __init__(self, host, node_hosts, leader_host, order_on_write=False):
-        super().__init__(host, node_hosts, leader_host)
+    def __init__(self, host, node_hosts, leader_host, order_on_write=False, config=None):
+        super().__init__(host, node_hosts, leader_host, config=config)
         self.ack_buffer = {}
         self.write_buffer = {}
         self.read_buffer = defaultdict(list)
-        self.order_buffer = []
+        self.order_buffer = {}
+        self.pending_keys = defaultdict(int)
+        # Time at which each pending key got its oldest pending write
+        self.pending_since = {}
 
         self.write_id = 0
-        self.data = defaultdict(lambda: (None, None))
+        self.data = VersionedStore(keep_history=bool(self.config.version_retention))
         self.order_index = 0
         self.leader_host = leader_host
-        self.order_on_write = order_on_write
+        # With retransmissions a client_write_ack can reach the leader after those of later
+        # writes, and with a quorum the leader may not have a write when its quorum is
+        # reached, so in both cases a write is only reported complete once it has been ordered
+        self.order_on_write = order_on_write or self.config.reliable or self.config.ack_quorum is not None
+
+        # Number of other nodes that have to acknowledge a write. With a quorum a node
+        # can miss writes and orders, it fetches them from the leader when it stalls
+        self.ack_quorum = len(node_hosts)
+        if self.config.ack_quorum is not None:
+            self.ack_quorum = min(self.config.ack_quorum, len(node_hosts))
+            self.require_tick(self.config.catchup_timeout)
+        self.caught_up = set()
+        self.lag_reads = deque()
+        self.highest_order = -1
+        self.stalled_at = None
+        self.stalled_index = None
+        # With a quorum this node may not know of a write that completed, so a read first
+        # asks the leader how far it has ordered. The reads of the round that is out wait
+        # for its answer, reads that arrive meanwhile are sent with the next round
+        self.read_round = 0
+        self.read_round_sent = None
+        self.round_reads = []
+        self.next_round_reads = []
+        # Recent applied writes, which lagging nodes can fetch from the leader
+        self.recent_writes = deque(maxlen=self.config.catchup_window)
+        self.retain_writes = self.config.ack_quorum is not None or bool(self.config.heartbeat_interval)
+
+        # Failure detection of the leader and election of a new one. Term is the term of
+        # the leader that this node follows, voted_term the highest term it voted in
+        self.term = 0
+        self.voted_term = 0
+        # Failed nodes, which the leader still sends heartbeats to. A leader that was cut
+        # off steps down and is removed by the others, it no longer receives writes and orders
+        self.removed_hosts = []
+        self.removed = False
+        self.last_heartbeat = None
+        self.election_deadline = None
+        self.candidate = False
+        self.votes = 0
+        self.require_tick(self.config.heartbeat_interval)
+
+        # Leader that this node granted a lease to and when the lease expires
+        self.lease_holder = None
+        self.lease_expires = None
+
+        # Acknowledgements per node that are waiting to be sent as one batch
+        self.ack_batches = defaultdict(list)
+        self.batch_started = None
+        self.require_tick(self.config.batch_interval)
+
+        # Client writes of this node that are not ordered yet, and the writes
+        # waiting for a free slot when the window is full
+        self.in_flight = 0
+        self.write_queue = deque()
+        self.window_stats = {
+            "max_in_flight": 0,
+            "max_queued": 0,
+            "busy": 0,
+            "queue_wait_count": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+        }
+
+        # Time from sending a write to its last needed acknowledgement, from the
+        # acknowledgement to applying it, and that reads wait for pending writes
+        self.write_ack_latency = self.metrics.histogram("write_ack_seconds")
+        self.apply_latency = self.metrics.histogram("ack_to_apply_seconds")
+        self.read_blocked = self.metrics.histogram("read_blocked_seconds")
+        self.queue_wait = self.metrics.histogram("write_queue_wait_seconds")
+        for name in ["ack_buffer", "write_buffer", "order_buffer", "read_buffer", "lag_reads", "pending_keys"]:
+            self.metrics.gauge(name, lambda name=name: len(getattr(self, name)))
+        self.metrics.gauge("order_index", lambda: self.order_index)
+        self.metrics.gauge("window", self.window_metrics)
+
+        # Trace ids of the tagged writes that this node knows of, by message id
+        self.request_traces = {}
+
+        # Applied writes are logged and recovered when a WAL directory is configured
+        self.wal = None
+        if self.config.wal_dir:
+            self.wal = WriteAheadLog(os.path.join(self.config.wal_dir, "{}_{}".format(host[0], host[1])),
+                fsync=self.config.wal_fsync, batch_size=self.config.wal_batch_size,
+                commit_interval=self.config.wal_commit_interval,
+                snapshot_interval=self.config.snapshot_interval)
+            data, self.order_index = self.wal.recover()
+            self.data.update(data)
+            # Older versions are not logged, so snapshots before recovery cannot be read
+            self.data.low_water = max(self.data.low_water, self.order_index - 1)
+            self.require_tick(self.config.wal_commit_interval)
+            logging.info("{}: recovered {} keys up to order index {}".format(self, len(data), self.order_index))
 
         logging.info("{}: constructed with hosts: {}".format(self, node_hosts))
 
     # Handles initial part of write operation by client
-    def write(self, keys, values, addr):
+    def write(self, keys, values, addr, rid=None, trace=None):
         '''Add key-value pair to acknowledge buffer and send write message to
         all the other nodes.'''
-        msg_id = "{}:{}:{}".format(self.host[0], self.host[1], self.write_id)
-        self.ack_buffer[msg_id] = PendingElement(keys, values, msg_id, addr)
+        # Integer ids are unique over all nodes, as every node has its own rank
+        msg_id = self.write_id * self.n_nodes + self.rank
+        self.ack_buffer[msg_id] = PendingElement(keys, values, addr, rid, self.now())
+        self.add_pending(keys)
         self.write_id += 1
 
         # Send the write to all other nodes
@@ -51,48 +149,44 @@ class Follower(Node):
             "from": self.host,
         }
 
+        # The trace id travels with the write, later hops find it by the message id
+        if trace is not None:
+            data["trace"] = trace
+            self.request_traces[msg_id] = trace
+            if self.trace_request is not None:
+                self.trace_request.info("client_write", trace, msg_id)
+
         self.send_to_all(data)
         return msg_id
 
-    # Checks whether there is a pending write for a given key
-    def is_key_pending(self, key):
-        for value in self.ack_buffer.values():
-            for k in value.keys:
-                if k == key:
-                    print("ack_buffer", self.ack_buffer)
-                    return True
-
-        for value in self.write_buffer.values():
-            for k in value[0]:
-                if k == key:
-                    return True
-
-        return False
-
-    # This function takes care of ordering write in the buffer as assigned by the leader
-    def handle_write_order(self, addr, data):
-        self.order_buffer.append(data)
+    # Marks the keys of a write as pending until the write has been ordered
+    def add_pending(self, keys):
+        now = self.now()
+        for key in keys:
+            if key not in self.pending_keys:
+                self.pending_since[key] = now
+            self.pending_keys[key] += 1
 
-        # Goes over all the key-value pairs in the write buffer
-        for write_order in list(sorted(self.order_buffer, key=lambda x: x["index"])):
-            if write_order["index"] == self.order_index:
-                keys, values, client_addr = self.write_buffer[write_order["id"]]
-                del self.write_buffer[write_order["id"]]
-                self.order_buffer.remove(write_order)
+    # Releases the keys of a write once it has been ordered and stored
+    def remove_pending(self, keys):
+        for key in keys:
+            self.pending_keys[key] -= 1
+            if not self.pending_keys[key]:
+                del self.pending_keys[key]
+                del self.pending_since[key]
 
-                logging.debug("{}: saved {} = {} of message: {}".format(self, keys, values, write_order['id']))
+    # Records a hop of a tagged write, its trace id is forgotten once the write is applied
+    def trace_hop(self, event, msg_id, *fields, done=False):
+        trace = self.request_traces.pop(msg_id) if done else self.request_traces[msg_id]
+        if self.trace_request is not None:
+            self.trace_request.info(event, trace, msg_id, *fields)
 
-                # Stores all key-value pairs seperatly in case of multiple write
-                for i in range(len(keys)):
-                    self.data[keys[i]] = (values[i], self.order_index)
-                self.order_index += 1
-                
-                if self.order_on_write and client_addr:
-                    self.send_write_result(client_addr, keys, values)
+    # Checks whether there is a pending write for a given key
+    def is_key_pending(self, key):
+        return key in self.pending_keys
 
-            else:
-                break
-        
+    # Sends the buffered reads for all keys that are no longer pending
+    def release_reads(self):
         for key, transactions in list(self.read_buffer.items()):
             if self.is_key_pending(key):
                 continue
@@ -100,13 +194,245 @@ class Follower(Node):
             for t in transactions:
                 is_final = t.add_pair(key, self.data[key][0], self.data[key][1], True)
                 if is_final:
+                    self.read_blocked.record(self.now() - t.started_at)
                     self.send(t.addr, t.return_data())
 
             del self.read_buffer[key]
 
+    # This function takes care of ordering write in the buffer as assigned by the leader
+    def handle_write_order(self, addr, data):
+        # Orders of an older term come from a deposed leader, those of a newer term are
+        # fetched once this node follows its leader (see handle_heartbeat)
+        if data["term"] != self.term:
+            return
+
+        # Orders that were already applied can safely be ignored
+        if data["index"] >= self.order_index:
+            self.order_buffer[data["index"]] = data["id"]
+            self.highest_order = max(self.highest_order, data["index"])
+
+        self.apply_write_orders()
+
+    # Applies the run of consecutive orders starting at the current order index
+    def apply_write_orders(self):
+        applied = False
+        now = self.now()
+        while self.order_index in self.order_buffer:
+            msg_id = self.order_buffer[self.order_index]
+
+            # The order can overtake the write itself, in that case the run
+            # continues once the write message has arrived
+            if msg_id not in self.write_buffer:
+                break
+
+            element = self.write_buffer.pop(msg_id)
+            keys, values, client_addr, rid = element.keys, element.values, element.client_addr, element.rid
+            del self.order_buffer[self.order_index]
+            self.remove_pending(keys)
+
+            self.apply_latency.record(now - element.stamp)
+            if self.request_traces and msg_id in self.request_traces:
+                self.trace_hop("applied", msg_id, self.order_index, done=True)
+            if self.trace_write is not None:
+                self.trace_write.debug("applied", msg_id, self.order_index, keys, values)
+
+            self.store(keys, values, self.order_index, msg_id)
+            self.order_index += 1
+            applied = True
+
+            if self.order_on_write and client_addr:
+                self.send_write_result(client_addr, keys, values, rid)
+            if client_addr:
+                self.finish_client_write()
+
+        if applied:
+            self.release_reads()
+            if self.lag_reads:
+                self.release_lag_reads()
+
+    # Stores the key-value pair(s) of a write under its order index
+    def store(self, keys, values, index, msg_id=None):
+        if self.retain_writes:
+            self.recent_writes.append((msg_id, keys, values))
+
+        # The write is logged before it becomes visible
+        if self.wal:
+            self.wal.append(index, keys, values, self.now())
+
+        # Stores all key-value pairs seperatly in case of multiple write
+        for i in range(len(keys)):
+            self.data.put(keys[i], values[i], index)
+
+        # Old versions are kept for at least version_retention orders
+        retention = self.config.version_retention
+        if retention and index - self.data.low_water >= 2 * retention:
+            self.data.collect(index - retention)
+
+        if self.wal and self.wal.needs_snapshot():
+            self.wal.snapshot(self.data, index + 1)
+
     # Returns the value of a key to the client
     def handle_client_read(self, addr, data):
-        rt = ReadTransaction(addr)
+        if "trace" in data and self.trace_request is not None:
+            self.trace_request.info("client_read", data["trace"])
+
+        if data.get("snapshot") is not None:
+            self.handle_snapshot_read(addr, data)
+            return
+
+        if "max_staleness" in data or "max_staleness_ms" in data:
+            if self.handle_bounded_read(addr, data):
+                return
+
+        if self.config.ack_quorum is not None or self.removed:
+            self.read_after_index(addr, data)
+            return
+
+        self.read_latest(addr, data)
+
+    # Answers a read once this node has applied every write that the leader had
+    # ordered after the read arrived here. With a quorum this node may have missed
+    # writes, a removed node misses all of them and fetches them from the leader
+    def read_after_index(self, addr, data):
+        self.next_round_reads.append((addr, data, self.now()))
+        if self.read_round_sent is None:
+            self.send_read_round()
+
+    # Asks the leader for its order index on behalf of the reads that are waiting for the next round
+    def send_read_round(self):
+        self.read_round += 1
+        self.read_round_sent = self.now()
+        self.round_reads, self.next_round_reads = self.next_round_reads, []
+        self.ask_read_index()
+
+    # A deposed leader follows no other node yet, its reads wait until it does
+    def ask_read_index(self):
+        if self.leader_host != self.host:
+            self.send(self.leader_host, {"type": "read_index", "round": self.read_round})
+
+    # The reads of the round wait until the writes ordered before the answer are applied,
+    # this node fetches those it missed when it stalls
+    def handle_read_index_result(self, addr, data):
+        if self.read_round_sent is None or data["round"] != self.read_round:
+            return
+
+        self.read_round_sent = None
+        self.highest_order = max(self.highest_order, data["index"] - 1)
+        for read_addr, read_data, since in self.round_reads:
+            self.lag_reads.append((data["index"] - 1, read_addr, read_data, since))
+        self.round_reads = []
+        self.release_lag_reads()
+
+        if self.next_round_reads:
+            self.send_read_round()
+
+    # Asks again if the round or its answer was lost
+    def check_read_round(self):
+        if self.read_round_sent is not None and self.now() - self.read_round_sent >= self.config.catchup_timeout:
+            self.read_round_sent = self.now()
+            self.ask_read_index()
+
+    # Answers the reads that wait for the leader from the own state, once this node leads
+    def release_round_reads(self):
+        now = self.now()
+        reads = self.round_reads + self.next_round_reads + [entry[1:] for entry in self.lag_reads]
+        self.read_round_sent = None
+        self.round_reads, self.next_round_reads = [], []
+        self.lag_reads.clear()
+        for addr, data, since in reads:
+            self.read_blocked.record(now - since)
+            self.read_latest(addr, data)
+
+    # Answers a read with the latest values once none of its keys is pending
+    def read_latest(self, addr, data):
+        keys = data["key"]
+        pending_keys = self.pending_keys
+        for key in keys:
+            if key in pending_keys:
+                self.handle_pending_read(addr, data)
+                return
+
+        # Fast path: no key has a pending write, so the response is built
+        # straight from the store without a ReadTransaction
+        latest = self.data.latest
+        self.send(addr, self.read_result(keys, [latest.get(key, NO_ENTRY) for key in keys], data.get("rid")))
+
+    # Answers the reads that waited for orders which have been applied now
+    def release_lag_reads(self):
+        now = self.now()
+        while self.lag_reads and self.lag_reads[0][0] < self.order_index:
+            _, addr, data, since = self.lag_reads.popleft()
+            self.read_blocked.record(now - since)
+            self.read_latest(addr, data)
+
+    # Answers a read right away from the applied values if they are within the staleness
+    # bound of the client, returns False if the read has to wait instead. Staleness is
+    # the number of writes of a key (or orders of a lagging node) that this node knows
+    # of but has not applied, and for how long the oldest of those writes has been pending
+    def handle_bounded_read(self, addr, data):
+        keys = data["key"]
+        now = self.now()
+
+        staleness = self.highest_order + 1 - self.order_index if self.order_buffer else 0
+        staleness_ms = 0.0
+        for key in keys:
+            count = self.pending_keys.get(key)
+            if count:
+                staleness = max(staleness, count)
+                staleness_ms = max(staleness_ms, (now - self.pending_since[key]) * 1000)
+
+        max_staleness = data.get("max_staleness")
+        max_staleness_ms = data.get("max_staleness_ms")
+        if max_staleness is not None and staleness > max_staleness:
+            return False
+        if max_staleness_ms is not None and staleness_ms > max_staleness_ms:
+            return False
+
+        response = self.read_result(keys, [self.data.get(key) for key in keys], data.get("rid"))
+        response["staleness"] = staleness
+        response["staleness_ms"] = staleness_ms
+        self.send(addr, response)
+        return True
+
+    # Client read helper function for reads at a snapshot, these never wait for pending writes.
+    # The snapshot is the given order index or, if it is True, the last applied write
+    def handle_snapshot_read(self, addr, data):
+        keys = data["key"]
+
+        # Writes beyond the last applied one are not visible yet, and versions
+        # below the low-water mark may have been collected
+        index = self.order_index - 1
+        if data["snapshot"] is not True:
+            index = min(data["snapshot"], index)
+        index = max(index, self.data.low_water)
+
+        response = self.read_result(keys, [self.data.read_at(key, index) for key in keys], data.get("rid"))
+        response["snapshot"] = index
+        self.send(addr, response)
+
+    # Builds a read_result message from the (value, order_index) entries of the keys
+    def read_result(self, keys, entries, rid=None):
+        if len(keys) == 1:
+            value, order_index = entries[0]
+        else:
+            value = [entry[0] for entry in entries]
+            order_index = [entry[1] for entry in entries]
+
+        response = {
+            "type": "read_result",
+            "key": keys,
+            "value": value,
+            "order_index": order_index
+        }
+
+        if rid is not None:
+            response["rid"] = rid
+
+        return response
+
+    # Client read helper function for reads of which at least one key has a pending write
+    def handle_pending_read(self, addr, data):
+        rt = ReadTransaction(addr, data.get("rid"), self.now())
         keys = data["key"]
 
         # Goes over all keys to check whether they have pending writes
@@ -124,24 +450,192 @@ class Follower(Node):
         if not rt.n_pending:
             self.send(addr, rt.return_data())
 
-    # Client write helper function
+    # Client write helper function, applies backpressure once the window is full
     def handle_client_write(self, addr, data):
-        self.write(data["keys"], data["values"], addr)
+        window = self.config.write_window
+        if window and self.in_flight >= window:
+            if self.config.window_policy == "busy":
+                self.window_stats["busy"] += 1
+                self.send_busy(addr, data["keys"], data.get("rid"))
+                return
+
+            self.write_queue.append((data["keys"], data["values"], addr, data.get("rid"), data.get("trace"), self.now()))
+            self.window_stats["max_queued"] = max(self.window_stats["max_queued"], len(self.write_queue))
+            return
+
+        self.start_client_write(data["keys"], data["values"], addr, data.get("rid"), data.get("trace"))
+
+    # Starts a client write and takes a slot of the window
+    def start_client_write(self, keys, values, addr, rid, trace=None):
+        self.in_flight += 1
+        self.window_stats["max_in_flight"] = max(self.window_stats["max_in_flight"], self.in_flight)
+        self.write(keys, values, addr, rid, trace)
+
+    # Frees the slot of an ordered client write and starts the next queued write
+    def finish_client_write(self):
+        self.in_flight -= 1
+
+        window = self.config.write_window
+        while self.write_queue and (not window or self.in_flight < window):
+            keys, values, addr, rid, trace, queued_at = self.write_queue.popleft()
+
+            wait = self.now() - queued_at
+            self.window_stats["queue_wait_count"] += 1
+            self.window_stats["queue_wait_total"] += wait
+            self.window_stats["queue_wait_max"] = max(self.window_stats["queue_wait_max"], wait)
+            self.queue_wait.record(wait)
+
+            self.start_client_write(keys, values, addr, rid, trace)
+
+    # Returns the current occupancy of the write window and its statistics
+    def window_metrics(self):
+        metrics = dict(self.window_stats)
+        metrics["in_flight"] = self.in_flight
+        metrics["queued"] = len(self.write_queue)
+        metrics["window"] = self.config.write_window
+        return metrics
+
+    # Tells a client that its write was rejected because the window is full
+    def send_busy(self, client_addr, keys, rid=None):
+        data = {
+            "type": "busy",
+            "keys": keys,
+        }
+        if rid is not None:
+            data["rid"] = rid
+
+        self.send(client_addr, data)
 
     # Handles a write message from another node in the system
     def handle_write(self, addr, data):
+        # The write was already applied after a catch-up from the leader
+        if data["id"] in self.caught_up:
+            self.caught_up.remove(data["id"])
+            return
+
         # Add to own write buffer
-        self.write_buffer[data["id"]] = (data["keys"], data["values"], None)
+        self.write_buffer[data["id"]] = PendingElement(data["keys"], data["values"], stamp=self.now())
+        self.add_pending(data["keys"])
+        if "trace" in data:
+            self.request_traces[data["id"]] = data["trace"]
+            self.trace_hop("write", data["id"])
 
         # Send acknowledge back
+        self.send_acknowledge(addr, data["id"])
+
+        # The order of this write may have arrived before the write itself
+        if self.order_buffer:
+            self.apply_write_orders()
+
+    # Acknowledges a write, either directly or as part of the next batch
+    def send_acknowledge(self, addr, msg_id):
+        if not self.config.batch_interval:
+            data = {
+                "type": "acknowledge",
+                "id": msg_id,
+                "from": self.host,
+            }
+
+            self.send(addr, data)
+            return
+
+        batch = self.ack_batches[tuple(addr)]
+        batch.append(msg_id)
+        self.start_batch()
+        if len(batch) >= self.config.batch_size:
+            self.flush_acknowledgements(tuple(addr))
+
+    # Sends all acknowledgements for a node as a single message
+    def flush_acknowledgements(self, addr):
         data = {
-            "type": "acknowledge",
-            "id": data["id"],
+            "type": "acknowledge_batch",
+            "ids": self.ack_batches.pop(addr),
             "from": self.host,
         }
 
         self.send(addr, data)
 
+    # Starts the batch timer if it is not running yet
+    def start_batch(self):
+        if self.batch_started is None:
+            self.batch_started = self.now()
+
+    # Sends all batches that are waiting
+    def flush_batches(self):
+        self.batch_started = None
+        for addr in list(self.ack_batches):
+            self.flush_acknowledgements(addr)
+
+    # Sends the waiting batches once the oldest one has waited for batch_interval
+    # and commits the waiting WAL records
+    def on_tick(self):
+        if self.batch_started is not None and self.now() - self.batch_started >= self.config.batch_interval:
+            self.flush_batches()
+
+        if self.wal:
+            self.wal.tick(self.now())
+
+        if self.retain_writes:
+            self.check_lag()
+        self.check_read_round()
+        if self.config.heartbeat_interval and self.is_connected:
+            self.check_leader()
+
+    # Fetches missed writes and orders from the leader once the writes waiting
+    # for their order have made no progress for catchup_timeout
+    def check_lag(self):
+        if not self.order_buffer and not self.write_buffer and self.highest_order < self.order_index:
+            self.stalled_at = None
+            return
+
+        now = self.now()
+        if self.stalled_at is None or self.stalled_index != self.order_index:
+            self.stalled_at = now
+            self.stalled_index = self.order_index
+        elif now - self.stalled_at >= self.config.catchup_timeout:
+            logging.info("{}: stalled at order index {}, fetching from the leader".format(self, self.order_index))
+            self.send(self.leader_host, {"type": "fetch", "index": self.order_index})
+            self.stalled_at = now
+
+    # Grants the leader its lease, this node accepts no other leader until it expires
+    def handle_lease_renew(self, addr, data):
+        self.lease_holder = addr
+        self.lease_expires = self.now() + self.config.lease_duration
+        self.send(addr, {"type": "lease_ack", "round": data["round"]})
+
+    # Sends the retained writes from the requested order index on to a lagging node
+    def handle_fetch(self, addr, data):
+        first = self.order_index - len(self.recent_writes)
+        if data["index"] < first:
+            logging.warning("{}: order {} is no longer retained for {}".format(self, data["index"], addr))
+
+        for index in range(max(data["index"], first), self.order_index):
+            msg_id, keys, values = self.recent_writes[index - first]
+            self.send(addr, {
+                "type": "catch_up",
+                "term": self.term,
+                "index": index,
+                "id": msg_id,
+                "keys": keys,
+                "values": values,
+            })
+
+    # Applies a write and its order that were fetched from the leader
+    def handle_catch_up(self, addr, data):
+        msg_id = data["id"]
+        if data["term"] != self.term or data["index"] < self.order_index:
+            return
+
+        # The write itself may still arrive later, it is dropped then
+        if msg_id not in self.write_buffer:
+            self.write_buffer[msg_id] = PendingElement(data["keys"], data["values"], stamp=self.now())
+            self.add_pending(data["keys"])
+            self.caught_up.add(msg_id)
+
+        self.order_buffer[data["index"]] = msg_id
+        self.highest_order = max(self.highest_order, data["index"])
+        self.apply_write_orders()
+
     # Sends write ack to client once all nodes have acknowledged the write
     def send_client_write_ack(self, msg_id):
         data = {
@@ -151,39 +645,260 @@ class Follower(Node):
 
         self.send(self.leader_host, data)
 
+    # Handles a batch of consecutive orders assigned by the leader
+    def handle_write_order_batch(self, addr, data):
+        # Orders of another term are dropped, see handle_write_order
+        if data["term"] != self.term:
+            return
+
+        for i, msg_id in enumerate(data["ids"]):
+            index = data["index"] + i
+            if index >= self.order_index:
+                self.order_buffer[index] = msg_id
+                self.highest_order = max(self.highest_order, index)
+
+        self.apply_write_orders()
+
     # Handles ack messages from other nodes
     def handle_acknowledge(self, addr, data):
         msg_id = data["id"]
-        self.ack_buffer[msg_id].acknowledge(addr)
-
-        # Once all nodes have acknowledged the write it is moved to the write buffer
-        if self.ack_buffer[msg_id].is_complete(len(self.node_hosts)):
-            logging.debug("{}: received all acknowledgements for message: {}".format(self, msg_id))
-            pending_element = self.ack_buffer[msg_id]
-            self.write_buffer[msg_id] = (pending_element.keys, pending_element.values, pending_element.client_addr)
-            del self.ack_buffer[msg_id]
-
-            if not self.order_on_write:
-                self.send_write_result(pending_element.client_addr,
-                    pending_element.keys, pending_element.values)
-            self.send_client_write_ack(msg_id)
-
-    # Send the result of the write back to the client
-    def send_write_result(self, client_addr, key, value):
+        pending_element = self.ack_buffer.get(msg_id)
+        bit = self.peer_bit(addr)
+
+        # Acknowledgements that arrive after the quorum was reached, or that come
+        # from unknown nodes, are ignored
+        if pending_element is None or not bit:
+            return
+        pending_element.acknowledge(bit)
+        if self.request_traces and msg_id in self.request_traces:
+            self.trace_hop("ack", msg_id, addr)
+
+        if pending_element.is_complete(self.ack_quorum):
+            self.complete_write(msg_id, pending_element)
+
+    # Once enough nodes have acknowledged a write it is moved to the write buffer,
+    # its keys stay in pending_keys until the write has been ordered
+    def complete_write(self, msg_id, pending_element):
+        if self.trace_write is not None:
+            self.trace_write.debug("acknowledged", msg_id)
+        now = self.now()
+        self.write_ack_latency.record(now - pending_element.stamp)
+        pending_element.stamp = now
+        if self.request_traces and msg_id in self.request_traces:
+            self.trace_hop("acked", msg_id)
+        self.write_buffer[msg_id] = pending_element
+        del self.ack_buffer[msg_id]
+
+        if not self.order_on_write:
+            self.send_write_result(pending_element.client_addr,
+                pending_element.keys, pending_element.values, pending_element.rid)
+        self.send_client_write_ack(msg_id)
+
+    # Handles a batch of ack messages from a single node
+    def handle_acknowledge_batch(self, addr, data):
+        for msg_id in data["ids"]:
+            self.handle_acknowledge(addr, {"id": msg_id})
+
+    # Send the result of the write back to the client, along with the request id of the client
+    def send_write_result(self, client_addr, key, value, rid=None):
         data = {
             "type": "write_result",
             "key": key,
             "value": value
         }
+        if rid is not None:
+            data["rid"] = rid
 
         self.send(client_addr, data)
 
+    # Starts an election once no heartbeat of the leader arrived for the election timeout
+    def check_leader(self):
+        now = self.now()
+        if self.election_deadline is None:
+            self.reset_election_timer(now)
+        if now < self.election_deadline:
+            return
+
+        # The leader may answer reads until the lease this node granted it expires
+        if self.lease_expires is not None and now < self.lease_expires:
+            return
+
+        self.start_election(now)
+
+    # The timeout is randomized, so nodes rarely start an election at the same time
+    def reset_election_timer(self, now):
+        self.election_deadline = now + self.config.election_timeout * (1 + self.random.random())
+
+    # Becomes a candidate for the next term and asks all nodes for their vote
+    def start_election(self, now):
+        self.voted_term = max(self.voted_term, self.term) + 1
+        self.candidate = True
+        self.votes = 0
+        self.reset_election_timer(now)
+
+        logging.info("{}: starting election for term {} at order index {}".format(self, self.voted_term, self.order_index))
+        if self.trace_election is not None:
+            self.trace_election.info("candidate", self.voted_term, self.order_index)
+        self.send_to_all({"type": "vote_request", "term": self.voted_term, "index": self.order_index})
+
+    # Votes for a candidate that has applied at least as many writes as this node, once
+    # the leader has been silent for the election timeout here as well
+    def handle_vote_request(self, addr, data):
+        now = self.now()
+        granted = (data["term"] > self.voted_term and data["index"] >= self.order_index
+                   and (self.last_heartbeat is None or now - self.last_heartbeat >= self.config.election_timeout)
+                   and (self.lease_expires is None or now >= self.lease_expires))
+
+        if granted:
+            self.voted_term = data["term"]
+            self.candidate = False
+            self.reset_election_timer(now)
+
+        self.send(addr, {"type": "vote", "term": data["term"], "granted": granted})
+
+    # Becomes the leader once a majority of all nodes, counting this one, voted for it
+    def handle_vote(self, addr, data):
+        if not self.candidate or data["term"] != self.voted_term or not data["granted"]:
+            return
+
+        self.votes |= self.peer_bit(addr)
+        if bin(self.votes).count("1") + 1 > self.n_nodes // 2:
+            self.become_leader(data["term"])
+
+    # Takes over the ordering from the failed leader. The next order index follows the
+    # writes applied here, which are at least those applied by every node that voted.
+    # Orders that could not be applied are dropped and their writes are ordered again:
+    # the writes of the failed leader right away, the others once their node asks for it
+    def become_leader(self, term):
+        from leader import Leader
+
+        logging.warning("{}: elected leader for term {} at order index {}".format(self, term, self.order_index))
+        failed_leader = self.leader_host
+        self.__class__ = Leader
+        self.tracer.name = str(self)
+        self.init_leader()
+        self.candidate = False
+        self.removed = False
+        self.term = term
+        self.leader_host = self.host
+        self.order_buffer.clear()
+        self.highest_order = self.order_index - 1
+        self.release_round_reads()
+        if self.trace_election is not None:
+            self.trace_election.warning("elected", term, self.order_index)
+
+        # A deposed leader that is elected again only takes over its own writes
+        failed_ranks = {self.rank}
+        if failed_leader != self.host:
+            self.remove_node(failed_leader)
+            failed_ranks.add(self.peer_bits[normalize(failed_leader)].bit_length() - 1)
+
+        # The followers learn the new term before the first order of it
+        self.send_heartbeat(self.now())
+        for msg_id in sorted(self.write_buffer):
+            if msg_id % self.n_nodes in failed_ranks and msg_id in self.write_buffer:
+                self.send_client_write_ack(msg_id)
+
+    # Follows the leader that sent a heartbeat, a new leader replaces the failed one.
+    # The acknowledgement tells the leader that it is still followed by this node
+    def handle_heartbeat(self, addr, data):
+        if data["term"] < self.term:
+            return
+
+        now = self.now()
+        self.last_heartbeat = now
+        self.reset_election_timer(now)
+        self.send(addr, {"type": "heartbeat_ack", "term": data["term"], "round": data["round"]})
+
+        if data["term"] > self.term:
+            self.follow(addr, data["term"], data["start"])
+        self.highest_order = max(self.highest_order, data["index"] - 1)
+
+    # The new leader ordered writes from order index start on, a deposed leader (or a
+    # node that applied its last orders) rolls back the orders it applied from there
+    def follow(self, addr, term, start=None):
+        logging.warning("{}: following {} in term {}".format(self, addr, term))
+        if self.trace_election is not None:
+            self.trace_election.warning("following", addr, term)
+        failed_leader = self.leader_host
+        self.term = term
+        self.voted_term = max(self.voted_term, term)
+        self.candidate = False
+        self.leader_host = addr
+
+        # Orders of the failed leader that were not applied yet may be assigned differently
+        self.order_buffer.clear()
+        self.highest_order = self.order_index - 1
+
+        if start is not None and self.order_index > start:
+            self.roll_back(start)
+
+        if normalize(failed_leader) not in (normalize(addr), normalize(self.host)):
+            self.remove_node(failed_leader)
+
+        # A round that the failed leader did not answer is asked of the new one
+        if self.read_round_sent is not None:
+            self.read_round_sent = self.now()
+            self.send(addr, {"type": "read_index", "round": self.read_round})
+
+        # The own writes that the failed leader did not order are handed to the new one
+        for msg_id in sorted(self.write_buffer):
+            if msg_id % self.n_nodes == self.rank:
+                self.send_client_write_ack(msg_id)
+
+    # Rolls back the writes applied from order index index on, which were ordered by a
+    # deposed leader alone. They wait in the write buffer for their order in the new term
+    def roll_back(self, index):
+        count = self.order_index - index
+        if count > len(self.recent_writes) or not self.data.keep_history or index - 1 < self.data.low_water:
+            logging.error("{}: cannot roll back {} writes to order index {}".format(self, count, index))
+            return
+
+        logging.warning("{}: rolling back {} writes to order index {}".format(self, count, index))
+        if self.trace_election is not None:
+            self.trace_election.warning("rolled_back", index, count)
+        now = self.now()
+        for _ in range(count):
+            msg_id, keys, values = self.recent_writes.pop()
+            self.data.roll_back(keys, index)
+            self.write_buffer[msg_id] = PendingElement(keys, values, stamp=now)
+            self.add_pending(keys)
+
+        self.order_index = index
+        self.highest_order = max(self.highest_order, index - 1)
+        if self.wal:
+            self.wal.snapshot(self.data, index)
+
+    # Removes a failed node, writes no longer wait for its acknowledgement
+    def remove_node(self, addr):
+        peer = normalize(addr)
+        if peer in self.peers:
+            self.removed_hosts.append(addr)
+        self.node_hosts = [host for host in self.node_hosts if normalize(host) != peer]
+        self.peers.discard(peer)
+        if self.reliable is not None:
+            self.reliable.remove(peer)
+
+        self.ack_quorum = len(self.node_hosts)
+        if self.config.ack_quorum is not None:
+            self.ack_quorum = min(self.config.ack_quorum, len(self.node_hosts))
+
+        for msg_id, pending_element in list(self.ack_buffer.items()):
+            if pending_element.is_complete(self.ack_quorum):
+                self.complete_write(msg_id, pending_element)
+
     # Handles incomming messages and calls the appropriare function for each message
     def on_message(self, addr, data):
         if data["type"] == "exit":
             logging.debug("{}: received exit message from {}".format(self, addr))
             self.is_connected = False
-            self.socket.close()
+            self.transport.close()
+            if self.wal:
+                self.wal.close()
+            if self.metrics_server:
+                self.metrics_server.close()
+        elif data["type"] == "stats":
+            self.handle_stats(addr, data)
         elif data["type"] == "write_order":
             self.handle_write_order(addr, data)
         elif data["type"] == "client_read":
@@ -194,6 +909,35 @@ class Follower(Node):
             self.handle_write(addr, data)
         elif data["type"] == "acknowledge":
             self.handle_acknowledge(addr, data)
+        elif data["type"] == "acknowledge_batch":
+            self.handle_acknowledge_batch(addr, data)
+        elif data["type"] == "write_order_batch":
+            self.handle_write_order_batch(addr, data)
+        elif data["type"] == "catch_up":
+            self.handle_catch_up(addr, data)
+        elif data["type"] == "lease_renew":
+            self.handle_lease_renew(addr, data)
+        elif data["type"] == "fetch":
+            self.handle_fetch(addr, data)
+        elif data["type"] == "heartbeat":
+            self.handle_heartbeat(addr, data)
+        elif data["type"] == "vote_request":
+            self.handle_vote_request(addr, data)
+        elif data["type"] == "vote":
+            self.handle_vote(addr, data)
+        elif data["type"] == "read_index_result":
+            self.handle_read_index_result(addr, data)
+
+    # Returns the metrics of this node to a client
+    def handle_stats(self, addr, data):
+        response = {
+            "type": "stats_result",
+            "stats": self.metrics.snapshot(),
+        }
+        if data.get("rid") is not None:
+            response["rid"] = data["rid"]
+
+        self.send(addr, response)
 
     # Allows you to print info about follower node as a string
     def __str__(self) -> str:
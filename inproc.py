@@ -0,0 +1,205 @@
+"""
+inproc.py
+
+Description:
+    This file contains the in-process transport, which connects nodes and
+    clients in a single process without sockets (config.transport = "inproc").
+    It has the same interface as the UdpTransport in transport.py. Endpoints
+    are bound to a port on a Network, which delivers a sent message to the
+    endpoint with the port of the destination address, the host is ignored.
+    Messages to ports that are not bound are dropped, as with UDP.
+
+    By default every endpoint has a queue that a node thread receives from,
+    so Node.run works as before. Network.attach switches nodes to direct
+    dispatch: a message to an attached node is handled by network.step on the
+    thread that calls it, and a client that waits for a response steps the
+    network until its response arrives. The whole system then runs on the
+    thread of the client, without thread switches. Direct dispatch is not
+    thread safe, all clients have to run on one thread.
+
+    Messages are not serialized, the receiver gets a copy of the top-level
+    dict only. With config.inproc_codec they are encoded and decoded with the
+    configured codec on every hop instead, like on the wire.
+"""
+
+from collections import deque
+import socket
+import threading
+import time
+
+import codec
+
+# Host of every in-process endpoint, the address that receivers see as the sender
+LOCALHOST = "127.0.0.1"
+
+# First port that is handed out to endpoints bound to port 0
+EPHEMERAL_PORT = 49152
+
+
+class Network:
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.next_port = EPHEMERAL_PORT
+
+        # Messages to attached nodes that are waiting for step, as (node, message, sender)
+        self.pending = deque()
+        self.nodes = []
+        self.delivered = 0
+
+    # Registers an endpoint on a port, port 0 picks a free one, returns the port
+    def bind(self, endpoint, port):
+        with self.lock:
+            if not port:
+                while self.next_port in self.endpoints:
+                    self.next_port += 1
+                port = self.next_port
+                self.next_port += 1
+            elif port in self.endpoints:
+                raise OSError("Port {} is already in use".format(port))
+
+            self.endpoints[port] = endpoint
+        return port
+
+    def unbind(self, port):
+        with self.lock:
+            self.endpoints.pop(port, None)
+
+    # Hands a message to the endpoint of the destination, it is dropped if there is none
+    def deliver(self, src, dst, message):
+        endpoint = self.endpoints.get(dst[1])
+        if endpoint is None:
+            return
+
+        self.delivered += 1
+        if endpoint.node is not None:
+            self.pending.append((endpoint.node, message, src))
+        else:
+            endpoint.put(message, src)
+
+    # Switches nodes to direct dispatch, their messages are handled by step
+    def attach(self, *nodes):
+        for node in nodes:
+            node.transport.node = node
+            self.nodes.append(node)
+
+    # Lets an attached node handle the oldest waiting message, returns False if there is none
+    def step(self):
+        if not self.pending:
+            return False
+
+        node, message, src = self.pending.popleft()
+        if node.is_connected:
+            node.handle_message(src, message)
+            if node.is_connected:
+                node.tick()
+        return True
+
+    # Handles messages until none is waiting, gives the timers of all nodes a chance
+    # to fire in between, returns the number of handled messages
+    def run_until_idle(self):
+        handled = 0
+        while True:
+            while self.step():
+                handled += 1
+            self.tick()
+            if not self.pending:
+                return handled
+
+    # Fires the timers of all attached nodes
+    def tick(self):
+        for node in self.nodes:
+            if node.is_connected:
+                node.tick()
+
+
+class InProcessTransport:
+    def __init__(self, port, config, network=None):
+        self.network = network or config.network or NETWORK
+        self.codec = codec.get_codec(config.codec) if config.inproc_codec else None
+        self.recv_batch_size = max(config.recv_batch, 1)
+        self.timeout = None
+
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.node = None
+        self.closed = False
+
+        self.port = self.network.bind(self, port)
+        self.addr = (LOCALHOST, self.port)
+
+    # Sends a copy of a message to addr
+    def send(self, message, addr):
+        if self.closed:
+            raise OSError("Transport is closed")
+
+        if self.codec is not None:
+            message = codec.decode(self.codec.encode(message))
+        else:
+            message = dict(message)
+        self.network.deliver(self.addr, addr, message)
+
+    # Queues a message for recv. Like a send on a socket, it gives other threads a chance to
+    # run, otherwise the receiving thread would wait for the sender to be switched out.
+    # With direct dispatch there is no other thread to yield to
+    def put(self, message, src):
+        with self.condition:
+            self.queue.append((message, src))
+            self.condition.notify()
+        if not self.network.nodes:
+            time.sleep(0)
+
+    # Waits for the next message, returns the message and the sender
+    def recv(self):
+        if self.network.nodes:
+            return self.dispatch_recv()
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queue or self.closed, self.timeout):
+                raise socket.timeout("timed out")
+            if self.closed:
+                raise OSError("Transport is closed")
+            return self.queue.popleft()
+
+    # Steps the network until a message for this endpoint arrives, used with direct dispatch
+    def dispatch_recv(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self.queue:
+            if self.network.step():
+                continue
+
+            # Nothing is in flight, only timers can still produce messages
+            self.network.tick()
+            if self.queue or self.network.pending:
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                raise socket.timeout("timed out")
+            time.sleep(0.001)
+
+        return self.queue.popleft()
+
+    # Waits for the next message and also returns the messages that are already
+    # waiting, at most recv_batch_size in total, as a list of (message, sender)
+    def recv_batch(self):
+        batch = [self.recv()]
+        with self.condition:
+            while self.queue and len(batch) < self.recv_batch_size:
+                batch.append(self.queue.popleft())
+        return batch
+
+    # Sets the timeout of a blocking receive in seconds
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    # Unbinds the port, messages to it are dropped from now on
+    def close(self):
+        self.closed = True
+        self.network.unbind(self.port)
+        if self.node is not None and self.node in self.network.nodes:
+            self.network.nodes.remove(self.node)
+        with self.condition:
+            self.condition.notify_all()
+
+
+# Network of all endpoints that are not given one
+NETWORK = Network()
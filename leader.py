@@ -7,51 +7,310 @@ Description:
     It overloads a few of the follower functions because it is in charge of the ordering.
 """
 
-import logging
 from follower import Follower
+import logging
+
+# Fraction of a lease that is given up to cover clocks that run at different rates
+LEASE_DRIFT = 0.05
 
 
 class Leader(Follower):
-    def __init__(self, port, node_ports, leader_port, order_on_write=False):
-        super().__init__(port, node_ports, leader_port, order_on_write=order_on_write)
+    def __init__(self, port, node_ports, leader_port, order_on_write=False, config=None):
+        super().__init__(port, node_ports, leader_port, order_on_write=order_on_write, config=config)
+        self.init_leader()
+
+    # Sets up the state of the leader, also used when a follower is elected leader
+    def init_leader(self):
+        # Message ids of consecutive orders, starting at order_batch_index,
+        # that are waiting to be sent as one batch
+        self.order_batch = []
+        self.order_batch_index = 0
+
+        # With a quorum, a write can be acknowledged by its quorum before it has reached the leader.
+        # Maps message ids to the time of the acknowledgement, in that order
+        self.early_acks = {}
+
+        # The lease is renewed every third of its duration. Rounds map to the time they
+        # were sent and the nodes that granted them, the lease runs from that time
+        self.lease_round = 0
+        self.lease_rounds = {}
+        self.lease_until = None
+        self.next_renewal = None
+        self.lease_reads = []
+        self.require_tick(self.config.lease_duration / 3)
+
+        # Heartbeats tell the followers that the leader is alive and how far it has ordered.
+        # Rounds map to the time they were sent and the nodes that acknowledged them, the
+        # leader steps down once no round sent within the election timeout reached a majority
+        self.next_heartbeat = None
+        self.heartbeat_round = 0
+        self.heartbeat_rounds = {}
+        self.confirmed_at = self.now()
+        # First order index of this term
+        self.term_start = self.order_index
 
     # Send write acck to client and stores data
     def send_client_write_ack(self, msg_id):
-        keys, values, client_addr = self.write_buffer[msg_id]
+        element = self.write_buffer[msg_id]
         # Stores data since it takes care of the ordering
-        self.store_data(msg_id, keys, values, client_addr)
+        self.store_data(msg_id, element.keys, element.values, element.client_addr, element.rid)
 
     # If the write is acknowledged by all nodes ordering can be taken care of
     def handle_client_write_ack(self, addr, data):
-        key, value, client_addr = self.write_buffer[data["id"]]
-        self.store_data(data["id"], key, value, client_addr)
+        if self.request_traces and data["id"] in self.request_traces:
+            self.trace_hop("client_write_ack", data["id"])
+        element = self.write_buffer.get(data["id"])
+        if element is None:
+            self.early_acks[data["id"]] = self.now()
+            return
+        self.store_data(data["id"], element.keys, element.values, element.client_addr, element.rid)
+
+    # Orders a write right away if its quorum was reached before it arrived here
+    def handle_write(self, addr, data):
+        super().handle_write(addr, data)
+        if data["id"] in self.early_acks:
+            del self.early_acks[data["id"]]
+            self.handle_client_write_ack(addr, data)
+
+    # Forgets the acknowledgements of writes that have not arrived within the election timeout,
+    # the node that sent them failed before the write reached the leader
+    def expire_early_acks(self, now):
+        expired = []
+        for msg_id, acked_at in self.early_acks.items():
+            if now - acked_at < self.config.election_timeout:
+                break
+            expired.append(msg_id)
+        for msg_id in expired:
+            del self.early_acks[msg_id]
+
+    # Answers leader reads from its own state while it holds the lease, otherwise they
+    # wait for the lease, so they never see a stale state
+    def handle_client_read(self, addr, data):
+        if data.get("leader") and self.config.lease_duration and not self.has_lease():
+            self.lease_reads.append((addr, data, self.now()))
+            return
+
+        super().handle_client_read(addr, data)
+
+    # The leader has applied every write it ordered, so it never waits for a read index
+    def read_after_index(self, addr, data):
+        self.read_latest(addr, data)
+
+    # Tells a node how far the writes have been ordered, its read waits until it has applied them
+    def handle_read_index(self, addr, data):
+        self.send(addr, {"type": "read_index_result", "round": data["round"], "index": self.order_index})
+
+    # Returns whether a majority of the nodes currently grants the lease
+    def has_lease(self):
+        return self.lease_until is not None and self.now() < self.lease_until
+
+    # Asks all nodes to renew the lease
+    def renew_lease(self, now):
+        # Rounds that were not granted before they would have expired are useless
+        for lease_round in [r for r, (sent_at, _) in self.lease_rounds.items()
+                            if now - sent_at >= self.config.lease_duration]:
+            del self.lease_rounds[lease_round]
+
+        self.lease_round += 1
+        self.lease_rounds[self.lease_round] = (now, 0)
+        self.next_renewal = now + self.config.lease_duration / 3
+        self.send_to_all({"type": "lease_renew", "round": self.lease_round})
+
+    # Extends the lease once a majority of the nodes, counting the leader, granted a round
+    def handle_lease_ack(self, addr, data):
+        entry = self.lease_rounds.get(data["round"])
+        if entry is None:
+            return
+
+        sent_at, granted = entry
+        granted |= self.peer_bit(addr)
+        self.lease_rounds[data["round"]] = (sent_at, granted)
+        if bin(granted).count("1") + 1 <= self.n_nodes // 2:
+            return
+
+        for lease_round in [r for r in self.lease_rounds if r <= data["round"]]:
+            del self.lease_rounds[lease_round]
+        self.lease_until = sent_at + self.config.lease_duration * (1 - LEASE_DRIFT)
+
+        reads, self.lease_reads = self.lease_reads, []
+        now = self.now()
+        for addr, data, since in reads:
+            self.read_blocked.record(now - since)
+            self.handle_client_read(addr, data)
+
+    # Renews the lease and sends heartbeats on time, in addition to the timers of the follower
+    def on_tick(self):
+        super().on_tick()
+        if not self.is_connected:
+            return
+
+        now = self.now()
+        if self.early_acks:
+            self.expire_early_acks(now)
+        if self.config.lease_duration and (self.next_renewal is None or now >= self.next_renewal):
+            self.renew_lease(now)
+        if not self.config.heartbeat_interval:
+            return
+
+        # The followers elect a new leader once it has been silent for the election
+        # timeout, so by then a leader that was cut off from them has stepped down
+        if now - self.confirmed_at >= self.config.election_timeout * (1 - LEASE_DRIFT):
+            self.step_down()
+            return
+        if self.next_heartbeat is None or now >= self.next_heartbeat:
+            self.send_heartbeat(now)
+
+    # Failed nodes receive the heartbeats as well, a deposed leader follows the new one
+    # once the network heals
+    def send_heartbeat(self, now):
+        self.next_heartbeat = now + self.config.heartbeat_interval
+        for heartbeat_round in [r for r, (sent_at, _) in self.heartbeat_rounds.items()
+                                if now - sent_at >= self.config.election_timeout]:
+            del self.heartbeat_rounds[heartbeat_round]
+
+        self.heartbeat_round += 1
+        self.heartbeat_rounds[self.heartbeat_round] = (now, 0)
+        data = {
+            "type": "heartbeat",
+            "term": self.term,
+            "index": self.order_index,
+            "round": self.heartbeat_round,
+            "start": self.term_start,
+        }
+
+        for host in self.node_hosts + self.removed_hosts:
+            self.send(host, data)
+
+    # Confirms the leadership up to the time a round was sent once a majority of the
+    # nodes, counting the leader, acknowledged it
+    def handle_heartbeat_ack(self, addr, data):
+        entry = self.heartbeat_rounds.get(data["round"])
+        if data["term"] != self.term or entry is None:
+            return
+
+        sent_at, granted = entry
+        granted |= self.peer_bit(addr)
+        self.heartbeat_rounds[data["round"]] = (sent_at, granted)
+        if bin(granted).count("1") + 1 <= self.n_nodes // 2:
+            return
+
+        for heartbeat_round in [r for r in self.heartbeat_rounds if r <= data["round"]]:
+            del self.heartbeat_rounds[heartbeat_round]
+        self.confirmed_at = max(self.confirmed_at, sent_at)
+
+    # A leader of a newer term was elected while this one was cut off
+    def handle_heartbeat(self, addr, data):
+        if data["term"] > self.term:
+            self.step_down()
+        super().handle_heartbeat(addr, data)
+
+    # Becomes a follower that the other nodes have removed, its reads wait until it
+    # follows the new leader, and the orders it applied alone are rolled back then.
+    # The state that only a leader uses is cleared, as init_leader sets it up again
+    def step_down(self):
+        logging.warning("{}: stepping down in term {} at order index {}".format(self, self.term, self.order_index))
+        if self.trace_election is not None:
+            self.trace_election.warning("deposed", self.term, self.order_index)
+        reads, self.lease_reads = self.lease_reads, []
+        self.early_acks.clear()
+        self.lease_rounds.clear()
+        self.lease_until = None
+        self.heartbeat_rounds.clear()
+
+        self.__class__ = Follower
+        self.tracer.name = str(self)
+        self.removed = True
+        self.reset_election_timer(self.now())
+
+        # Reads that waited for the lease wait for the new leader like the other reads of a removed node
+        for addr, data, _ in reads:
+            self.handle_client_read(addr, data)
+
+    # The leader orders the writes itself, so it never lags behind
+    def check_lag(self):
+        pass
+
+    # The leader does not wait for heartbeats
+    def check_leader(self):
+        pass
+
+    # A leader that is alive never votes for another one
+    def handle_vote_request(self, addr, data):
+        self.send(addr, {"type": "vote", "term": data["term"], "granted": False})
 
     # Exdends the on_message function with the client_write_ack message type
     def on_message(self, addr, data):
         super().on_message(addr, data)
         if data["type"] == "client_write_ack":
             self.handle_client_write_ack(addr, data)
+        elif data["type"] == "lease_ack":
+            self.handle_lease_ack(addr, data)
+        elif data["type"] == "read_index":
+            self.handle_read_index(addr, data)
+        elif data["type"] == "heartbeat_ack":
+            self.handle_heartbeat_ack(addr, data)
 
     # Stores the key-value pair(s) and takes care of the ordering
-    def store_data(self, msg_id, keys, values, client_addr):
-        for i in range(len(keys)):
-            self.data[keys[i]] = (values[i], self.order_index)
-        del self.write_buffer[msg_id]
+    def store_data(self, msg_id, keys, values, client_addr, rid=None):
+        self.store(keys, values, self.order_index, msg_id)
+        element = self.write_buffer.pop(msg_id)
+        self.apply_latency.record(self.now() - element.stamp)
+        if self.request_traces and msg_id in self.request_traces:
+            self.trace_hop("ordered", msg_id, self.order_index, done=True)
+        self.remove_pending(keys)
 
-        logging.info("{}: saved '{} = {}'".format(self, keys, values))
+        if self.trace_write is not None:
+            self.trace_write.debug("ordered", msg_id, self.order_index, keys, values)
 
         # Send order_index along with msg_id to all nodes
+        self.send_write_order(msg_id, self.order_index)
+        self.order_index += 1
+
+        if self.order_on_write and client_addr:
+            self.send_write_result(client_addr, keys, values, rid)
+        if client_addr:
+            self.finish_client_write()
+
+        # The leader never receives a write_order, so reads are released here
+        self.release_reads()
+
+    # Sends an order to all nodes, either directly or as part of the next batch
+    def send_write_order(self, msg_id, index):
+        if not self.config.batch_interval:
+            data = {
+                "type": "write_order",
+                "id": msg_id,
+                "index": index,
+                "term": self.term,
+            }
+
+            self.send_to_all(data)
+            return
+
+        if not self.order_batch:
+            self.order_batch_index = index
+        self.order_batch.append(msg_id)
+        self.start_batch()
+        if len(self.order_batch) >= self.config.batch_size:
+            self.flush_write_orders()
+
+    # Sends all waiting orders as a single message with a contiguous index range
+    def flush_write_orders(self):
         data = {
-            "type": "write_order",
-            "id": msg_id,
-            "index": self.order_index
+            "type": "write_order_batch",
+            "index": self.order_batch_index,
+            "ids": self.order_batch,
+            "term": self.term,
         }
 
+        self.order_batch = []
         self.send_to_all(data)
-        self.order_index += 1
 
-        if self.order_on_write and client_addr:
-            self.send_write_result(client_addr, keys, values)
+    # Extends the follower batches with the waiting orders
+    def flush_batches(self):
+        super().flush_batches()
+        if self.order_batch:
+            self.flush_write_orders()
 
     # Allows you to print info about leader node as a string
     def __str__(self) -> str:
@@ -0,0 +1,202 @@
+"""
+metrics.py
+
+Description:
+    This file contains the metrics that every node keeps about itself.
+    Counters of the received and sent messages per message type are plain
+    dicts, so counting a message costs a single increment. Latencies are
+    recorded into HDR-style histograms: values are counted in buckets whose
+    width grows with the value, so every value is kept with a relative error
+    of at most 1/SUB_BUCKETS in a small, bounded number of buckets. Gauges
+    are functions that are only called when the metrics are read, such as
+    the depths of the buffers of a node.
+    The metrics are returned to clients with a stats message and can be
+    served in the Prometheus text format over HTTP (config.metrics_port).
+"""
+
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+
+# Buckets per power of two of a histogram, the relative error of a recorded value
+SUB_BUCKETS = 32
+
+# Histograms count whole microseconds
+_UNIT = 1e-6
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # Records a value in seconds
+    def record(self, value):
+        self.counts[_bucket(int(value / _UNIT))] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    # Returns the value in seconds below which a fraction q of the recorded values lies
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(_bucket_value(bucket) * _UNIT, self.max)
+        return self.max
+
+    def summary(self):
+        summary = {"count": self.count, "sum": self.total, "max": self.max}
+        for q in QUANTILES:
+            summary["p{}".format(_quantile_name(q))] = self.quantile(q)
+        return summary
+
+
+class Metrics:
+    def __init__(self, clock):
+        self.clock = clock
+        self.started_at = clock()
+        self.received = defaultdict(int)
+        self.sent = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.histograms = {}
+        self.gauges = {}
+
+    # Returns the histogram with the given name, it is created on first use
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    # Registers a function that returns the current value of a gauge, or a dict of values
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    # Returns all metrics as a dict that can be sent in a message
+    def snapshot(self):
+        uptime = self.clock() - self.started_at
+        received = dict(self.received)
+
+        gauges = {}
+        for name, function in list(self.gauges.items()):
+            value = function()
+            if isinstance(value, dict):
+                gauges.update(("{}_{}".format(name, k), v) for k, v in value.items())
+            else:
+                gauges[name] = value
+
+        return {
+            "uptime": uptime,
+            "received": received,
+            "received_rate": {t: n / uptime for t, n in received.items()} if uptime > 0 else {},
+            "sent": dict(self.sent),
+            "counters": dict(self.counters),
+            "gauges": gauges,
+            "histograms": {name: h.summary() for name, h in list(self.histograms.items())},
+        }
+
+    # Returns all metrics in the Prometheus text exposition format
+    def prometheus(self, labels):
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append("# TYPE mangodb_{} {}".format(name, kind))
+            for extra, value in samples:
+                lines.append("mangodb_{}{} {}".format(name, _labels(dict(labels, **extra)), _number(value)))
+
+        metric("uptime_seconds", "gauge", [({}, snapshot["uptime"])])
+        metric("messages_received_total", "counter",
+               [({"type": t}, n) for t, n in sorted(snapshot["received"].items())])
+        metric("messages_sent_total", "counter",
+               [({"type": t}, n) for t, n in sorted(snapshot["sent"].items())])
+        for name, value in sorted(snapshot["counters"].items()):
+            metric("{}_total".format(name), "counter", [({}, value)])
+        for name, value in sorted(snapshot["gauges"].items()):
+            if isinstance(value, (int, float)):
+                metric(name, "gauge", [({}, value)])
+
+        for name, histogram in sorted(self.histograms.items()):
+            samples = [({"quantile": str(q)}, histogram.quantile(q)) for q in QUANTILES]
+            metric(name, "summary", samples)
+            lines.append("mangodb_{}_sum{} {}".format(name, _labels(labels), _number(histogram.total)))
+            lines.append("mangodb_{}_count{} {}".format(name, _labels(labels), histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+
+# Serves the metrics of a node over HTTP: /metrics in the Prometheus text format, /stats as JSON
+class MetricsServer:
+    def __init__(self, metrics, labels, port):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.prometheus(labels).encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/stats":
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Requests are not logged
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Returns the bucket of a value, values below 2 * SUB_BUCKETS have a bucket of their own
+def _bucket(value):
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKETS.bit_length()
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+# Returns the highest value that falls in a bucket
+def _bucket_value(bucket):
+    if bucket < 2 * SUB_BUCKETS:
+        return bucket
+    shift = bucket // SUB_BUCKETS - 1
+    return ((bucket - shift * SUB_BUCKETS + 1) << shift) - 1
+
+
+def _quantile_name(q):
+    return "{:g}".format(q * 100).replace(".", "")
+
+
+def _labels(labels):
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in sorted(labels.items())) + "}"
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return int(value)
+    return value
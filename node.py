@@ -10,42 +10,124 @@ Description:
 
 import threading
 import logging
-import json
 import random
 import signal
 import socket
 import time
 
+from config import Config
+from metrics import Metrics, MetricsServer
+from reliable import ReliableDelivery, normalize
+from tracing import Tracer
+from transport import make_transport
+import aio
+
 
 class Node:
-    def __init__(self, host, node_hosts, leader_port):
+    def __init__(self, host, node_hosts, leader_port, config=None):
+        self.config = config or Config()
+        if self.config.clock is not None:
+            self.now = self.config.clock
+        self.random = self.config.rng or random
         self.host = host
         self.port = host[1]
         self.node_hosts = node_hosts
         self.leader = leader_port
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind(("", self.port))
+        self.transport = make_transport(self.port, self.config)
         self.is_connected = True
 
+        # Subsystems that are not traced are None, see tracing.py
+        self.tracer = Tracer(str(self), self.config, clock=self.now)
+        self.trace_net = self.tracer.subsystem("net")
+        self.trace_write = self.tracer.subsystem("write")
+        self.trace_reliable = self.tracer.subsystem("reliable")
+        self.trace_election = self.tracer.subsystem("election")
+        self.trace_request = self.tracer.subsystem("request")
+
+        # Counters, histograms and gauges of this node, see metrics.py
+        self.metrics = Metrics(self.now)
+
+        # Seconds between calls to on_tick while no messages arrive, None disables it
+        self.tick_interval = None
+
+        # Peers are all other nodes, messages to clients are never retransmitted
+        self.peers = {normalize(host) for host in node_hosts}
+
+        # Every node has a fixed rank among all nodes, used for message ids
+        # and as its bit in acknowledgement bitmasks
+        all_hosts = sorted(self.peers | {normalize(host)})
+        self.n_nodes = len(all_hosts)
+        self.rank = all_hosts.index(normalize(host))
+        self.peer_bits = {peer: 1 << all_hosts.index(peer) for peer in self.peers}
+        self.reliable = None
+        if self.config.reliable:
+            self.reliable = ReliableDelivery(self)
+            self.require_tick(min(self.config.ack_delay, self.config.rto_min))
+            self.metrics.gauge("reliable", lambda: self.reliable.stats)
+
+        # Every node serves its metrics on its own port, metrics_port plus its rank
+        self.metrics_server = None
+        if self.config.metrics_port is not None:
+            port = self.config.metrics_port + self.rank if self.config.metrics_port else 0
+            self.metrics_server = MetricsServer(self.metrics, {"node": "{}:{}".format(*host)}, port)
+
         logging.info("{} listining on port {}".format(self, self.port))
 
     # Waits for incomming messages and calls on_message function to handle it
     def run(self):
+        if self.config.event_loop == "asyncio":
+            aio.run_nodes([self])
+            return
+
+        self.transport.settimeout(self.tick_interval)
         while self.is_connected:
-            data, addr = self.socket.recvfrom(1024)
-            message = json.loads(data.decode())
-            logging.debug("{}, received message: {} from {}".format(self, message, addr))
-            self.on_message(addr, message)
+            self.receive()
 
     # The same as run, only with a artificial delay for testing
     def run_delayed(self):
+        self.transport.settimeout(self.tick_interval)
         while self.is_connected:
             time.sleep(.05) # Artificial delay
-            data, addr = self.socket.recvfrom(1024)
-            message = json.loads(data.decode())
-            logging.debug("{}, received message: {} from {}".format(self, message, addr))
-            self.on_message(addr, message)
+            self.receive()
+
+    # Handles the incomming messages that are waiting and gives timers a chance to fire
+    def receive(self):
+        try:
+            batch = self.transport.recv_batch()
+        except socket.timeout:
+            batch = ()
+
+        for message, addr in batch:
+            if self.trace_net is not None:
+                self.trace_net.debug("received", addr, message)
+            self.handle_message(addr, message)
+            if not self.is_connected:
+                break
+
+        if self.is_connected:
+            self.tick()
+
+    # Filters out reliable delivery messages and duplicates before on_message sees them
+    def handle_message(self, addr, message):
+        self.metrics.received[message["type"]] += 1
+        if self.reliable is not None:
+            if not self.reliable.accept(addr, message):
+                return
+            if message["type"] == "rel_ack":
+                self.reliable.handle_ack(addr, message)
+                return
+            if "ack" in message:
+                self.reliable.acknowledge(addr, message.pop("ack"))
+            if "seq" in message and not self.reliable.receive(addr, message):
+                return
+
+        self.on_message(addr, message)
+
+    # Fires the timers of the reliable delivery layer and the node
+    def tick(self):
+        if self.reliable is not None:
+            self.reliable.tick(self.now())
+        self.on_tick()
 
     # Sends 'data' to all other known hosts by looping over them
     def send_to_all(self, data):
@@ -54,13 +136,49 @@ class Node:
 
     # Sends a message to a specific host
     def send(self, addr, message):
-        logging.debug("{}, sent message: {} to {}".format(self, message, addr))
-        self.socket.sendto(json.dumps(message).encode(), addr)
+        if self.reliable is not None and self.reliable.is_peer(addr):
+            self.reliable.send(addr, message)
+        else:
+            self.transmit(addr, message)
+
+    # Returns the bit of a node in acknowledgement bitmasks, 0 for unknown senders
+    def peer_bit(self, addr):
+        bit = self.peer_bits.get(addr)
+        if bit is None:
+            bit = self.peer_bits[addr] = self.peer_bits.get(normalize(addr), 0)
+        return bit
+
+    # Puts a message on the wire, messages to other nodes may be dropped by loss_rate
+    def transmit(self, addr, message):
+        if self.config.loss_rate and normalize(addr) in self.peers and self.random.random() < self.config.loss_rate:
+            if self.trace_net is not None:
+                self.trace_net.debug("dropped", addr, message)
+            return
+
+        if self.trace_net is not None:
+            self.trace_net.debug("sent", addr, message)
+        self.metrics.sent[message["type"]] += 1
+        self.transport.send(message, addr)
 
     # This function handles incomming messages and will be overloaded by child classes
     def on_message(self, addr, message):
         pass
 
+    # Called after every message and every tick_interval, overloaded by child classes with timers
+    def on_tick(self):
+        pass
+
+    # Makes sure on_tick is called at least every interval seconds, a node that is already
+    # running receives with the shorter timeout from now on
+    def require_tick(self, interval):
+        if interval and (self.tick_interval is None or interval < self.tick_interval):
+            self.tick_interval = interval
+            self.transport.settimeout(interval)
+
+    # Returns the current time in seconds, used for timers
+    def now(self):
+        return time.monotonic()
+
     # Allows you to print a node as a string
     def __str__(self) -> str:
         return "Node:{}:{}".format(self.host[0], self.host[1])
@@ -11,13 +11,15 @@ Description:
 """
 
 class ReadTransaction():
-    def __init__(self, addr):
+    def __init__(self, addr, rid=None, started_at=None):
         self.n_keys = 0
         self.n_pending = 0
         self.keys = []
         self.values = {}
         self.write_orders = {}
         self.addr = addr
+        self.rid = rid
+        self.started_at = started_at
         self.pending = []
 
     # Adds a key to the list of pending keys
@@ -58,4 +60,8 @@ class ReadTransaction():
             "order_index": return_write_orders
         }
 
+        # Echo the request id so the client can match the response to its request
+        if self.rid is not None:
+            data["rid"] = self.rid
+
         return data
@@ -0,0 +1,271 @@
+"""
+reliable.py
+
+Description:
+    This file contains the reliable delivery layer between nodes.
+    Every message to another node gets a sequence number per node pair and
+    is kept until the receiver acknowledges it. The receiver sends
+    cumulative acknowledgements (rel_ack) with the highest sequence number up
+    to which it received everything, plus the sequence numbers it received
+    beyond that. Messages that are not acknowledged within the retransmission
+    timeout are sent again; the timeout adapts to the measured round trip
+    time as in TCP (RFC 6298). Retransmitted messages that were already
+    received are suppressed, so the node handles every message only once.
+    Messages are delivered as soon as they arrive, so a lost message does
+    not hold back later ones.
+    Every node numbers its channels anew when it starts, so messages carry
+    the incarnation of the sender and the incarnation of the receiver that
+    the sender knows. When a peer restarts, both ends reset their channel and
+    the messages that are still unacknowledged are numbered again.
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+import socket
+import time
+
+
+class Channel:
+    def __init__(self, rto):
+        # Sending side
+        self.next_seq = 0
+        self.unacked = OrderedDict()
+        self.srtt = None
+        self.rttvar = None
+        self.rto = rto
+
+        # Receiving side
+        self.received_upto = -1
+        self.received = set()
+        self.ack_due_at = None
+
+        # Incarnation of the peer, None until it has sent something
+        self.peer_incarnation = None
+
+
+class ReliableDelivery:
+    def __init__(self, node):
+        self.node = node
+        self.config = node.config
+        self.peers = node.peers
+        self.channels = {}
+        # Sequence numbers start at 0 again when the node restarts, the incarnation
+        # tells the peers that the numbers they have seen no longer apply
+        self.incarnation = time.time_ns()
+        # Channels by the address as given, which saves normalizing it on every message
+        self.by_addr = {}
+        # Earliest time at which an acknowledgement is due or a message may time out,
+        # ticks before it have nothing to do
+        self.next_timer = None
+        self.stats = {
+            "sent": 0,
+            "retransmitted": 0,
+            "duplicates": 0,
+            "acks_sent": 0,
+            "acks_piggybacked": 0,
+            "resets": 0,
+        }
+
+    # Returns whether messages to addr go through the reliable layer
+    def is_peer(self, addr):
+        return normalize(addr) in self.peers
+
+    def channel(self, addr):
+        channel = self.by_addr.get(addr)
+        if channel is None:
+            key = normalize(addr)
+            if key not in self.channels:
+                self.channels[key] = Channel(self.config.rto_initial)
+            channel = self.by_addr[addr] = self.channels[key]
+        return channel
+
+    # Makes sure the next tick does its work at time at or earlier
+    def set_timer(self, at):
+        if self.next_timer is None or at < self.next_timer:
+            self.next_timer = at
+
+    # Forgets the channel of a node that was removed
+    def remove(self, peer):
+        channel = self.channels.pop(peer, None)
+        self.by_addr = {addr: c for addr, c in self.by_addr.items() if c is not channel}
+
+    # Checks the incarnations of a message from addr and takes them off. Resets the
+    # channel when the peer restarted, returns False if the message was numbered for a
+    # previous incarnation of this node, the next acknowledgement tells the peer about it
+    def accept(self, addr, message):
+        incarnation = message.pop("inc", None)
+        if incarnation is None:
+            return True
+        to_incarnation = message.pop("to_inc")
+
+        channel = self.channel(addr)
+        if incarnation != channel.peer_incarnation:
+            if channel.peer_incarnation is not None:
+                self.reset(addr, channel)
+            channel.peer_incarnation = incarnation
+
+        if to_incarnation is not None and to_incarnation != self.incarnation:
+            if channel.ack_due_at is None:
+                channel.ack_due_at = self.node.now() + self.config.ack_delay
+                self.set_timer(channel.ack_due_at)
+            return False
+        return True
+
+    # Starts the channel to a restarted peer over, the messages it has not acknowledged
+    # are numbered from 0 and sent again on the next tick
+    def reset(self, addr, channel):
+        pending = [message for message, _, _ in channel.unacked.values()]
+        channel.unacked.clear()
+        channel.next_seq = 0
+        channel.received_upto = -1
+        channel.received.clear()
+        channel.ack_due_at = None
+
+        now = self.node.now()
+        for message in pending:
+            # A piggybacked acknowledgement refers to the old numbering of the peer
+            message.pop("ack", None)
+            message["seq"] = channel.next_seq
+            channel.unacked[channel.next_seq] = [message, now - channel.rto, True]
+            channel.next_seq += 1
+        if pending:
+            self.set_timer(now)
+
+        self.stats["resets"] += 1
+        if self.node.trace_reliable is not None:
+            self.node.trace_reliable.debug("reset", addr, len(pending))
+
+    # Sends a message with the next sequence number of the channel. An acknowledgement
+    # that is due rides along, unless messages arrived out of order, which only a
+    # rel_ack can report with its sack
+    def send(self, addr, message):
+        channel = self.channel(addr)
+        message = dict(message, seq=channel.next_seq, inc=self.incarnation, to_inc=channel.peer_incarnation)
+        if channel.ack_due_at is not None and not channel.received:
+            message["ack"] = channel.received_upto
+            channel.ack_due_at = None
+            self.stats["acks_piggybacked"] += 1
+        now = self.node.now()
+        channel.unacked[channel.next_seq] = [message, now, False]
+        channel.next_seq += 1
+        self.set_timer(now + channel.rto)
+
+        self.stats["sent"] += 1
+        self.node.transmit(addr, message)
+
+    # Registers a received message, returns False if it is a duplicate
+    def receive(self, addr, message):
+        channel = self.channel(addr)
+        seq = message.pop("seq")
+
+        if channel.ack_due_at is None:
+            channel.ack_due_at = self.node.now() + self.config.ack_delay
+            self.set_timer(channel.ack_due_at)
+
+        # Fast path: the next message in sequence, with nothing out of order
+        if seq == channel.received_upto + 1 and not channel.received:
+            channel.received_upto = seq
+            return True
+
+        if seq <= channel.received_upto or seq in channel.received:
+            self.stats["duplicates"] += 1
+            return False
+
+        channel.received.add(seq)
+        while channel.received_upto + 1 in channel.received:
+            channel.received_upto += 1
+            channel.received.remove(channel.received_upto)
+
+        return True
+
+    # Removes acknowledged messages and updates the retransmission timeout
+    def handle_ack(self, addr, message):
+        self.acknowledge(addr, message["upto"], message["sack"])
+
+    # Removes the messages up to upto and those in sack, upto is piggybacked on
+    # other messages as their "ack" field
+    def acknowledge(self, addr, upto, sack=()):
+        channel = self.channel(addr)
+        if not channel.unacked:
+            return
+        now = self.node.now()
+
+        acked = [seq for seq in channel.unacked if seq <= upto]
+        acked.extend(seq for seq in sack if seq in channel.unacked)
+        for seq in acked:
+            _, sent_at, retransmitted = channel.unacked.pop(seq)
+            # Only messages that were sent once give a valid sample (Karn's algorithm)
+            if not retransmitted:
+                self.update_rto(channel, now - sent_at)
+
+    def update_rto(self, channel, rtt):
+        if channel.srtt is None:
+            channel.srtt = rtt
+            channel.rttvar = rtt / 2
+        else:
+            channel.rttvar = 0.75 * channel.rttvar + 0.25 * abs(channel.srtt - rtt)
+            channel.srtt = 0.875 * channel.srtt + 0.125 * rtt
+
+        rto = channel.srtt + max(4 * channel.rttvar, self.config.ack_delay)
+        channel.rto = min(max(rto, self.config.rto_min), self.config.rto_max)
+
+    # Sends the acknowledgements that are due and retransmits timed out messages
+    def tick(self, now):
+        if self.next_timer is None or now < self.next_timer:
+            return
+
+        self.next_timer = None
+        for addr, channel in self.channels.items():
+            if channel.ack_due_at is not None:
+                if now >= channel.ack_due_at:
+                    self.send_ack(addr, channel)
+                else:
+                    self.set_timer(channel.ack_due_at)
+
+            if not channel.unacked:
+                continue
+
+            # Messages are kept in the order they were (re)sent, so the scan stops at the first recent one
+            timed_out = []
+            for seq, (_, sent_at, _) in channel.unacked.items():
+                if now - sent_at < channel.rto:
+                    break
+                timed_out.append(seq)
+
+            for seq in timed_out:
+                entry = channel.unacked.pop(seq)
+                entry[1] = now
+                entry[2] = True
+                channel.unacked[seq] = entry
+
+                self.stats["retransmitted"] += 1
+                if self.node.trace_reliable is not None:
+                    self.node.trace_reliable.debug("retransmit", addr, seq, channel.rto)
+                entry[0]["to_inc"] = channel.peer_incarnation
+                self.node.transmit(addr, entry[0])
+
+            # Back off until the retransmissions get through
+            if timed_out:
+                channel.rto = min(channel.rto * 2, self.config.rto_max)
+
+            # The oldest message that is (re)sent times out first
+            self.set_timer(next(iter(channel.unacked.values()))[1] + channel.rto)
+
+    def send_ack(self, addr, channel):
+        data = {
+            "type": "rel_ack",
+            "upto": channel.received_upto,
+            "sack": sorted(channel.received),
+            "inc": self.incarnation,
+            "to_inc": channel.peer_incarnation,
+        }
+
+        channel.ack_due_at = None
+        self.stats["acks_sent"] += 1
+        self.node.transmit(addr, data)
+
+
+# Node hosts can be given by name while packets arrive from an IP address
+@lru_cache(maxsize=1024)
+def normalize(addr):
+    return (socket.gethostbyname(addr[0]), addr[1])
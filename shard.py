@@ -0,0 +1,142 @@
+"""
+shard.py
+
+Description:
+    This file contains the sharded deployment mode.
+    The key space is hash-partitioned over a number of shards. Every shard is
+    an independent cluster of followers with its own leader and its own
+    order_index sequence, and every node runs in its own process so the
+    shards can use all cores.
+    The ShardedClient routes each key to its shard and splits multi-key
+    reads and writes over the shards involved. A multi-key write that spans
+    shards is ordered per shard, not atomically across shards.
+"""
+
+from multiprocessing import Event, Process
+import json
+import logging
+import zlib
+
+from client import Client
+from follower import Follower
+from leader import Leader
+
+
+# Returns the shard a key belongs to, the hash is stable across processes
+def shard_of(key, n_shards):
+    return zlib.crc32(json.dumps(key).encode()) % n_shards
+
+
+# Returns the node hosts of each shard, the last host of a shard is its leader
+def shard_hosts(n_shards, nodes_per_shard, start_port=25000, hostname="127.0.0.1"):
+    return [[(hostname, start_port + shard * nodes_per_shard + i) for i in range(nodes_per_shard)]
+            for shard in range(n_shards)]
+
+
+# Process target that constructs a single node and runs it until it exits,
+# ready is set once the node is listening
+def run_node(host, node_hosts, order_on_write=False, config=None, ready=None):
+    others = [h for h in node_hosts if h != host]
+    if host == node_hosts[-1]:
+        node = Leader(host, others, host, order_on_write=order_on_write, config=config)
+    else:
+        node = Follower(host, others, node_hosts[-1], order_on_write=order_on_write, config=config)
+
+    if ready is not None:
+        ready.set()
+    node.run()
+
+
+# Starts every node of every shard in its own process and waits until all are listening
+def start_shards(shards, order_on_write=False, config=None):
+    # In-process endpoints cannot reach nodes in other processes
+    if config is not None and config.transport != "udp":
+        raise ValueError("Sharded mode needs the udp transport")
+
+    processes = []
+    events = []
+    for node_hosts in shards:
+        for host in node_hosts:
+            ready = Event()
+            process = Process(target=run_node, args=(host, node_hosts, order_on_write, config, ready))
+            process.start()
+            processes.append(process)
+            events.append(ready)
+
+    for ready in events:
+        ready.wait()
+
+    logging.info("Started {} shards in {} processes".format(len(shards), len(processes)))
+    return processes
+
+
+class ShardedClient:
+    def __init__(self, shards, config=None):
+        self.shards = shards
+        self.node_hosts = [host for node_hosts in shards for host in node_hosts]
+        # One client per shard, so responses of different shards never mix
+        self.clients = [Client(node_hosts, config=config) for node_hosts in shards]
+
+    # Groups the positions of the keys by shard
+    def split(self, keys):
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(shard_of(key, len(self.shards)), []).append(i)
+        return groups
+
+    # Performs a write operation on every shard that owns one of the keys
+    def write(self, keys, values, blocking=True):
+        keys = keys if type(keys) == list else [keys]
+        values = values if type(values) == list else [values]
+
+        if len(keys) != len(values) or len(keys) != len(set(keys)):
+            logging.debug("ShardedClient: invalid key-value pair(s)")
+            return None
+
+        # The writes are sent to all shards first and then awaited
+        groups = self.split(keys)
+        hosts = []
+        for shard, positions in groups.items():
+            hosts.append(self.clients[shard].write([keys[i] for i in positions],
+                [values[i] for i in positions], blocking=False))
+
+        if blocking:
+            for shard in groups:
+                self.clients[shard].write_recv()
+
+        return hosts[0] if len(hosts) == 1 else hosts
+
+    # Performs a read operation and merges the results in the order of the keys
+    def read(self, key):
+        keys = key if isinstance(key, list) else [key]
+
+        groups = self.split(keys)
+        hosts = {}
+        for shard, positions in groups.items():
+            hosts[shard] = self.clients[shard].read([keys[i] for i in positions], blocking=False)
+
+        values = [None] * len(keys)
+        order_indices = [None] * len(keys)
+        for shard, positions in groups.items():
+            result = self.clients[shard].write_recv()
+            shard_values = result["value"] if len(positions) > 1 else [result["value"]]
+            shard_orders = result["order_index"] if len(positions) > 1 else [result["order_index"]]
+            for i, value, order_index in zip(positions, shard_values, shard_orders):
+                values[i] = value
+                order_indices[i] = order_index
+
+        # Order indices are only comparable between keys of the same shard
+        result = {
+            "type": "read_result",
+            "key": keys,
+            "value": values if len(keys) > 1 else values[0],
+            "order_index": order_indices if len(keys) > 1 else order_indices[0],
+            "host": list(hosts.values())[0] if len(hosts) == 1 else list(hosts.values()),
+        }
+
+        return result
+
+    # Function to shut down the nodes of all shards
+    def exit(self):
+        for client in self.clients:
+            client.exit()
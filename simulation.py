@@ -0,0 +1,414 @@
+"""
+simulation.py
+
+Description:
+    This file contains a deterministic discrete-event simulator of a cluster.
+    The Follower and Leader classes run unchanged on an in-process network
+    (see inproc.py) whose messages are events on a heap ordered by virtual
+    time. Nodes read the virtual clock through config.clock, so their timers
+    fire in virtual time and a simulated minute takes as long as the handlers
+    need to process its messages.
+
+    Every message gets a latency from a distribution, messages between nodes
+    can be lost, held back so that later ones overtake them, or dropped by a
+    partition, and nodes can be crashed. Every node is a single server: a
+    message that arrives while the node is busy waits, and messages sent by a
+    handler leave after its service time. Closed-loop clients send reads and
+    writes and record their latencies in virtual time.
+
+    All random choices, including those of the nodes (election timeouts,
+    config.loss_rate, which they draw from config.rng), are drawn from
+    generators seeded by the seed of the simulation, so a run with the same seed and options is repeated exactly.
+    Within one process that is; across processes string hashing also has to
+    be fixed with PYTHONHASHSEED, as sets are iterated by the nodes.
+
+    The simulation also checks the safety of a run: every node has to apply
+    the same write at every order index, and a read may not return an older
+    value than that of a write to its key that completed before it was sent.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+import copy
+import heapq
+import math
+import random
+
+from config import Config
+from follower import Follower
+from inproc import LOCALHOST, Network
+from leader import Leader
+from metrics import Histogram
+
+
+# Returns a latency distribution of a fixed number of seconds
+def constant(seconds):
+    return lambda rng: seconds
+
+
+def uniform(low, high):
+    return lambda rng: rng.uniform(low, high)
+
+
+# Returns a latency distribution of base seconds plus an exponential delay with the given mean
+def exponential(mean, base=0.0):
+    return lambda rng: base + rng.expovariate(1 / mean)
+
+
+# Returns a long-tailed latency distribution with the given median in seconds
+def lognormal(median, sigma):
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class Simulation(Network):
+    def __init__(self, n_nodes, seed=0, latency=constant(0.0001), service_time=0.00002, loss_rate=0.0,
+                 reorder_rate=0.0, reorder_delay=0.001, config=None, start_port=30000):
+        super().__init__()
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        self.latency = latency
+        self.service_time = service_time if callable(service_time) else constant(service_time)
+        self.loss_rate = loss_rate
+        self.reorder_rate = reorder_rate
+        self.reorder_delay = reorder_delay
+
+        # Events as (time, sequence, function, args), the sequence keeps events of
+        # the same time in the order they were scheduled
+        self.events = []
+        self.sequence = 0
+        self.time = 0.0
+        self.in_flight = 0
+        self.dropped = 0
+
+        # Group of every node port while partitioned, nodes in different groups are cut off
+        self.groups = None
+
+        # Virtual time until which a node is busy, and the extra delay of messages sent by
+        # the handler that runs
+        self.busy_until = {}
+        self.send_delay = 0.0
+
+        # The nodes get a copy of the config, the one that was given is left as it is
+        self.config = copy.copy(config or Config())
+        self.config.transport = "inproc"
+        self.config.network = self
+        self.config.clock = self.now
+        self.config.rng = random.Random(seed)
+
+        self.node_hosts = [(LOCALHOST, port) for port in range(start_port, start_port + n_nodes)]
+        self.followers = [Follower(host, [h for h in self.node_hosts if h != host], self.node_hosts[-1],
+                                   config=self.config) for host in self.node_hosts[:-1]]
+        self.leader = Leader(self.node_hosts[-1], self.node_hosts[:-1], self.node_hosts[-1], config=self.config)
+        self.attach(self.leader, *self.followers)
+        self.node_ports = {host[1] for host in self.node_hosts}
+
+        # The write applied at every order index per node, and the index of every written value
+        self.applied = {}
+        self.value_index = {}
+        for node in self.nodes:
+            self.record_order(node)
+            if node.tick_interval is not None:
+                self.schedule(node.tick_interval, self.tick_node, node)
+
+        self.clients = []
+        self.latencies = defaultdict(Histogram)
+        self.completed = defaultdict(int)
+        self.timeouts = 0
+        # Completed writes as (completed at, value) per key and reads as (key, sent at, order_index, value)
+        self.writes = defaultdict(list)
+        self.reads = []
+        self.started_at = 0.0
+
+    # Returns the virtual time in seconds, the clock of all nodes
+    def now(self):
+        return self.time
+
+    # Calls function(*args) at virtual time at
+    def schedule(self, at, function, *args):
+        self.sequence += 1
+        heapq.heappush(self.events, (at, self.sequence, function, args))
+
+    # Schedules the arrival of a message after its latency, unless it is lost or cut off
+    def deliver(self, src, dst, message):
+        endpoint = self.endpoints.get(dst[1])
+        if endpoint is None:
+            return
+
+        between_nodes = src[1] in self.node_ports and dst[1] in self.node_ports
+        if between_nodes:
+            if self.groups is not None and self.groups.get(src[1]) != self.groups.get(dst[1]):
+                self.dropped += 1
+                return
+            if self.loss_rate and self.rng.random() < self.loss_rate:
+                self.dropped += 1
+                return
+
+        delay = self.send_delay + self.latency(self.rng)
+        if self.reorder_rate and self.rng.random() < self.reorder_rate:
+            delay += self.reorder_delay
+
+        self.in_flight += 1
+        self.schedule(self.time + delay, self.arrive, endpoint, message, src)
+
+    # Hands an arrived message to its node, which handles it once it is not busy anymore
+    def arrive(self, endpoint, message, src):
+        node = endpoint.node
+        if node is None:
+            self.in_flight -= 1
+            self.delivered += 1
+            endpoint.put(message, src)
+            return
+
+        busy_until = self.busy_until.get(node, 0.0)
+        if busy_until > self.time:
+            self.schedule(busy_until, self.arrive, endpoint, message, src)
+            return
+
+        self.in_flight -= 1
+        if not node.is_connected:
+            return
+
+        self.delivered += 1
+        service = self.service_time(self.rng)
+        self.busy_until[node] = self.time + service
+        self.send_delay = service
+        try:
+            node.handle_message(src, message)
+            if node.is_connected:
+                node.tick()
+        finally:
+            self.send_delay = 0.0
+
+    # Fires the timers of a node every tick_interval, like the timeout of its receive
+    def tick_node(self, node):
+        if node.is_connected:
+            node.tick()
+            self.schedule(self.time + node.tick_interval, self.tick_node, node)
+
+    # Handles the next event, returns False if there is none
+    def step(self):
+        if not self.events:
+            return False
+
+        at, _, function, args = heapq.heappop(self.events)
+        self.time = max(self.time, at)
+        function(*args)
+        return True
+
+    # Handles all events up to virtual time until
+    def run(self, until):
+        while self.events and self.events[0][0] <= until:
+            self.step()
+        self.time = max(self.time, until)
+
+    # Handles events until no message is in flight anymore, at most until virtual time
+    # limit, as timers keep producing events. Returns the number of delivered messages
+    def run_until_idle(self, limit=None):
+        delivered = self.delivered
+        limit = self.time + 60 if limit is None else limit
+        while self.in_flight and self.events and self.events[0][0] <= limit:
+            self.step()
+        return self.delivered - delivered
+
+    # Cuts the network into groups of node hosts at virtual time at, nodes that are
+    # not in a group form a group together. Clients can reach every node
+    def partition(self, *groups, at=None):
+        ports = {}
+        for i, group in enumerate(groups):
+            ports.update((host[1], i) for host in group)
+        self.schedule(self.time if at is None else at, setattr, self, "groups", ports)
+
+    # Ends a partition at virtual time at
+    def heal(self, at=None):
+        self.schedule(self.time if at is None else at, setattr, self, "groups", None)
+
+    # Stops a node at virtual time at, as if it received an exit message
+    def crash(self, host, at=None):
+        node = next(node for node in self.nodes if node.host == host)
+        self.schedule(self.time if at is None else at, self.stop_node, node)
+
+    def stop_node(self, node):
+        if node.is_connected:
+            node.on_message(None, {"type": "exit"})
+
+    # Starts n closed-loop clients, every client sends a request, waits for its response
+    # and sends the next one after think_time. A fraction write_ratio of the requests are
+    # writes, the keys are chosen from n_keys. Requests without a response for timeout
+    # seconds are given up
+    def add_clients(self, n, write_ratio=0.5, n_keys=100, think_time=0.0, timeout=1.0, hosts=None):
+        self.started_at = self.time
+        for _ in range(n):
+            client = SimulatedClient(self, hosts or self.node_hosts, write_ratio, n_keys, think_time, timeout)
+            self.clients.append(client)
+            self.schedule(self.time, client.send_next)
+
+    # Lets the clients finish their outstanding requests without sending new ones
+    def stop_clients(self):
+        for client in self.clients:
+            client.stopped = True
+
+    # Records the latency of a completed request and what it wrote or read
+    def complete(self, kind, key, value, order_index, sent_at):
+        self.latencies[kind].record(self.time - sent_at)
+        self.completed[kind] += 1
+        if kind == "write":
+            self.writes[key].append((self.time, value))
+        elif kind == "read":
+            self.reads.append((key, sent_at, order_index, value))
+
+    # Records the write that a node applies at every order index, by wrapping Follower.store
+    # of the node. Orders of a deposed leader that the node rolls back are forgotten
+    def record_order(self, node):
+        store = node.store
+        roll_back = node.roll_back
+        applied = self.applied[node.host] = {}
+
+        def record(keys, values, index, msg_id=None):
+            applied[index] = (tuple(keys), tuple(values))
+            for value in values:
+                self.value_index.setdefault(value, index)
+            store(keys, values, index, msg_id)
+
+        def forget(index):
+            end = node.order_index
+            roll_back(index)
+            forgotten = set()
+            for i in range(node.order_index, end):
+                forgotten.update(value for value in applied.pop(i)[1] if self.value_index.get(value) == i)
+
+            # Values that a rolled back order applied first get the index of their current order
+            for value in forgotten:
+                del self.value_index[value]
+            for writes in self.applied.values():
+                for i, (_, values) in writes.items():
+                    for value in values:
+                        if value in forgotten:
+                            self.value_index.setdefault(value, i)
+
+        node.store = record
+        node.roll_back = forget
+
+    # Returns the safety violations of the run: different writes at the same order index,
+    # and reads that returned an older value than a write that completed before them
+    def check(self):
+        violations = []
+        order = {}
+        for node in self.nodes:
+            for index, write in sorted(self.applied[node.host].items()):
+                first = order.setdefault(index, write)
+                if first != write:
+                    violations.append("{} applied {} at order index {}, another node applied {}".format(
+                        node, write, index, first))
+
+        completed = {key: ([at for at, _ in writes], [value for _, value in writes])
+                     for key, writes in self.writes.items()}
+
+        for key, sent_at, order_index, value in self.reads:
+            if key not in completed:
+                continue
+            # A deposed leader returns values under order indices that it rolls back later
+            if value is not None:
+                order_index = self.value_index.get(value, order_index)
+            times, values = completed[key]
+            newest = None
+            for value in values[:bisect_left(times, sent_at)]:
+                index = self.value_index.get(value)
+                if index is not None and (newest is None or index > newest):
+                    newest = index
+            if newest is not None and (order_index is None or order_index < newest):
+                violations.append("read of {} at {:.6f} returned order index {}, a completed write has {}".format(
+                    key, sent_at, order_index, newest))
+
+        return violations
+
+    # Returns the throughput and latencies of the clients and the state of the network
+    def report(self):
+        elapsed = self.time - self.started_at
+        completed = sum(self.completed.values())
+        connected = [node for node in self.nodes if node.is_connected]
+        return {
+            "seed": self.seed,
+            "simulated_seconds": elapsed,
+            "completed": dict(self.completed),
+            "throughput": completed / elapsed if elapsed > 0 else 0.0,
+            "timeouts": self.timeouts,
+            "latency": {kind: histogram.summary() for kind, histogram in sorted(self.latencies.items())},
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "order_index": [node.order_index for node in connected],
+            "violations": len(self.check()),
+        }
+
+    # Stops all nodes
+    def close(self):
+        for node in list(self.nodes):
+            self.stop_node(node)
+        for client in self.clients:
+            self.unbind(client.port)
+
+
+class SimulatedClient:
+    def __init__(self, simulation, hosts, write_ratio, n_keys, think_time, timeout):
+        self.simulation = simulation
+        self.hosts = hosts
+        self.write_ratio = write_ratio
+        self.n_keys = n_keys
+        self.think_time = think_time
+        self.timeout = timeout
+
+        # Responses are handed to put, not to a node
+        self.node = None
+        self.port = simulation.bind(self, 0)
+        self.addr = (LOCALHOST, self.port)
+
+        self.rid = 0
+        self.stopped = False
+        # The request that waits for its response as (rid, kind, key, value, sent at)
+        self.outstanding = None
+
+    # Sends the next request to a random node
+    def send_next(self):
+        if self.stopped:
+            return
+
+        simulation = self.simulation
+        rng = simulation.rng
+        key = "key{}".format(rng.randrange(self.n_keys))
+        host = rng.choice(self.hosts)
+        self.rid += 1
+
+        if rng.random() < self.write_ratio:
+            value = "{}:{}".format(self.port, self.rid)
+            kind = "write"
+            message = {"type": "client_write", "keys": [key], "values": [value], "rid": self.rid}
+        else:
+            value = None
+            kind = "read"
+            message = {"type": "client_read", "key": [key], "rid": self.rid}
+
+        self.outstanding = (self.rid, kind, key, value, simulation.time)
+        simulation.deliver(self.addr, host, message)
+        simulation.schedule(simulation.time + self.timeout, self.expire, self.rid)
+
+    # Handles a response, responses to requests that were given up are ignored
+    def put(self, message, src):
+        if self.outstanding is None or message.get("rid") != self.outstanding[0]:
+            return
+
+        _, kind, key, value, sent_at = self.outstanding
+        self.outstanding = None
+        if message["type"] == "busy":
+            kind = "busy"
+        elif kind == "read":
+            value = message.get("value")
+        self.simulation.complete(kind, key, value, message.get("order_index"), sent_at)
+        self.simulation.schedule(self.simulation.time + self.think_time, self.send_next)
+
+    # Gives up a request that did not get a response in time and sends the next one
+    def expire(self, rid):
+        if self.outstanding is not None and self.outstanding[0] == rid:
+            self.outstanding = None
+            self.simulation.timeouts += 1
+            self.send_next()
@@ -0,0 +1,119 @@
+"""
+store.py
+
+Description:
+    This file contains the multi-version store of a node.
+    The latest (value, order_index) of every key is kept in a plain dict, so
+    normal reads cost a single lookup. When a key is overwritten its previous
+    version moves to a version chain of that key, ordered by order_index,
+    which allows reads of the store as it was at an earlier order index
+    (a snapshot). Versions that are no longer visible at the low-water mark,
+    the oldest index a snapshot can still be read at, are garbage collected.
+"""
+
+from bisect import bisect_left, bisect_right
+
+# Value and order index of a key that has never been written
+NO_ENTRY = (None, None)
+
+
+class VersionedStore:
+    def __init__(self, keep_history=True):
+        self.keep_history = keep_history
+        self.latest = {}
+        # Older versions per key as two lists in ascending order: ([order_index], [value])
+        self.history = {}
+        # Snapshots at an order index below this are no longer complete
+        self.low_water = -1
+
+    # Returns the latest (value, order_index) of a key
+    def get(self, key, default=NO_ENTRY):
+        return self.latest.get(key, default)
+
+    def __getitem__(self, key):
+        return self.latest.get(key, NO_ENTRY)
+
+    def __len__(self):
+        return len(self.latest)
+
+    # Returns the latest (key, (value, order_index)) pairs
+    def items(self):
+        return self.latest.items()
+
+    # Loads latest versions, used on recovery
+    def update(self, data):
+        self.latest.update(data)
+
+    # Stores a new version of a key, indices have to increase per key
+    def put(self, key, value, index):
+        previous = self.latest.get(key)
+        if previous is not None and self.keep_history:
+            indices, values = self.history.setdefault(key, ([], []))
+            indices.append(previous[1])
+            values.append(previous[0])
+
+        self.latest[key] = (value, index)
+        # Without history only the latest applied index can be read as a snapshot
+        if not self.keep_history:
+            self.low_water = index
+
+    # Returns the (value, order_index) of a key as it was at order index index
+    def read_at(self, key, index):
+        entry = self.latest.get(key, NO_ENTRY)
+        if entry[1] is None or entry[1] <= index:
+            return entry
+
+        chain = self.history.get(key)
+        if chain is None:
+            return NO_ENTRY
+
+        indices, values = chain
+        i = bisect_right(indices, index) - 1
+        if i < 0:
+            return NO_ENTRY
+        return values[i], indices[i]
+
+    # Drops the versions of the keys at order index index or later, the newest older version
+    # becomes the latest again. The version visible at index - 1 has to be kept, so index
+    # has to be above low_water
+    def roll_back(self, keys, index):
+        for key in keys:
+            entry = self.latest.get(key)
+            if entry is None or entry[1] < index:
+                continue
+
+            chain = self.history.get(key)
+            if chain is not None:
+                indices, values = chain
+                i = bisect_left(indices, index)
+                del indices[i:]
+                del values[i:]
+                if indices:
+                    self.latest[key] = (values.pop(), indices.pop())
+                    if not indices:
+                        del self.history[key]
+                    continue
+                del self.history[key]
+
+            # The key was not written before index
+            del self.latest[key]
+
+    # Drops every version that is not visible at low_water or later, returns the number dropped
+    def collect(self, low_water):
+        removed = 0
+        for key, (indices, values) in list(self.history.items()):
+            # Without a newer version the chain is only needed for older snapshots
+            if self.latest[key][1] <= low_water:
+                removed += len(indices)
+                del self.history[key]
+                continue
+
+            # The newest version at or below low_water is still visible there
+            i = bisect_right(indices, low_water) - 1
+            if i > 0:
+                del indices[:i]
+                del values[:i]
+                removed += i
+
+        self.low_water = max(self.low_water, low_water)
+        return removed
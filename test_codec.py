@@ -0,0 +1,116 @@
+'''
+Test the wire formats of MangoDB. These include:
+   - Round trips of every message type through both codecs
+   - Decoding of messages that were encoded with another codec
+   - Reads and writes on a cluster that uses the binary codec
+
+Please run with `pytest -v`
+'''
+
+import pytest
+import codec
+from config import Config
+from test_functional_requirements import setup
+
+
+MESSAGES = [
+    {"type": "exit"},
+    {"type": "write", "id": "127.0.0.1:25000:3", "keys": ["World!", "keyTest"], "values": ["Hello?", 0.25], "from": ["127.0.0.1", 25000]},
+    {"type": "acknowledge", "id": "127.0.0.1:25000:3", "from": ["127.0.0.1", 25001]},
+    {"type": "write_order", "id": "127.0.0.1:25000:3", "index": 41},
+    {"type": "client_write", "keys": ["World!"], "values": [None]},
+    {"type": "client_read", "key": ["World!", "keyTest"]},
+    {"type": "client_write_ack", "id": "127.0.0.1:25000:3"},
+    {"type": "write_result", "key": ["World!"], "value": [True]},
+    {"type": "read_result", "key": ["World!"], "value": "Hello?", "order_index": 0},
+    {"type": "read_result", "key": ["a", "b"], "value": [{"nested": 1}, -3], "order_index": [None, 2]},
+    {"type": "stats"},
+    {"type": "stats_result", "stats": {"received": {"write": 3}, "histograms": {"write_ack_seconds": {"p99": 0.002}}}},
+]
+
+
+class TestCodec:
+    '''
+    Class that contains the tests of the message encoding.
+    '''
+    @pytest.mark.parametrize('name', ['json', 'binary'])
+    @pytest.mark.parametrize('message', MESSAGES)
+    def test_round_trip(self, name, message):
+        '''
+        Encode and decode every message type and compare it with the original.
+        '''
+        assert codec.decode(codec.get_codec(name).encode(message)) == message
+
+    @pytest.mark.parametrize('message', MESSAGES)
+    def test_binary_is_smaller(self, message):
+        '''
+        The binary encoding of a message should never be larger than the JSON encoding.
+        '''
+        binary = codec.get_codec('binary').encode(message)
+        json = codec.get_codec('json').encode(message)
+
+        assert len(binary) <= len(json)
+
+    @pytest.mark.parametrize('name', ['json', 'binary'])
+    @pytest.mark.parametrize('message', MESSAGES)
+    def test_decode_from_buffer(self, name, message):
+        '''
+        Messages are decoded straight from a memoryview of a larger receive buffer.
+        '''
+        encoded = codec.get_codec(name).encode(message)
+        buffer = bytearray(len(encoded) + 16)
+        buffer[:len(encoded)] = encoded
+
+        assert codec.decode(memoryview(buffer)[:len(encoded)]) == message
+
+    def test_extra_fields(self):
+        '''
+        Fields that are not part of the fixed layout of a message type are kept.
+        '''
+        message = {"type": "write_order", "id": 7, "index": 3, "extra": ["x", 1]}
+
+        assert codec.decode(codec.get_codec('binary').encode(message)) == message
+
+    def test_unknown_type_falls_back_to_json(self):
+        '''
+        Message types without a binary layout are sent as JSON.
+        '''
+        message = {"type": "unknown", "value": 1}
+        encoded = codec.get_codec('binary').encode(message)
+
+        assert encoded[0] == codec.JSON_START and codec.decode(encoded) == message
+
+
+class TestBinaryCluster:
+    '''
+    Simple read and write tests on a cluster that uses the binary codec.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 follower nodes, a leader and 2 clients.
+        '''
+        node_hosts, nodes, leader, clients, threads = setup(3, 2, config=Config(codec='binary'))
+        self.node_hosts = node_hosts
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_read_after_write(self, execution_number):
+        '''
+        Write values to multiple keys and read them back from every node.
+        '''
+        client = self.clients[0]
+        client.write(["World!", "keyTest"], ['Hello?', 1.5])
+
+        for host in self.node_hosts:
+            result = client.read(["World!", "keyTest"], host=host)
+            assert result["value"] == ['Hello?', 1.5] and result["order_index"] == [0, 0]
@@ -9,22 +9,38 @@ The randomness is derived from the fact that we chose random follower nodes.
 Please run with `pytest -v`
 '''
 
+import asyncio
+import os
 import threading
 import random
 import pytest
+import aio
+from asyncclient import AsyncClient
+import shard
+from config import Config
 from follower import Follower
 from leader import Leader
-from client import Client
+from client import BusyError, Client
+from simulation import Simulation
 
+# Tests of the asyncio loop and sharded processes need real sockets
+udp_only = pytest.mark.skipif(os.environ.get("MANGODB_TRANSPORT", "udp") != "udp",
+                              reason="needs the udp transport")
 
-def setup(num_nodes, num_clients, start_port=25000, delayed=False):
+
+def setup(num_nodes, num_clients, start_port=25000, delayed=False, config=None, start_threads=True):
     '''
     Create the nodes, clients and threads necessary to run MangoDB.
+    With MANGODB_TRANSPORT=inproc they are connected without sockets.
     '''
+    if os.environ.get("MANGODB_TRANSPORT") and (config is None or config.transport == "udp"):
+        config = config or Config()
+        config.transport = os.environ["MANGODB_TRANSPORT"]
+
     node_ports = list(range(start_port, start_port + num_nodes))
     node_hosts = [("127.0.0.1", port) for port in node_ports]
-    nodes = [Follower(("127.0.0.1", port), [h for h in node_hosts if h[1] != port], node_hosts[-1]) for port in node_ports[:-1]]
-    leader = Leader(node_hosts[-1], node_hosts[:-1], node_hosts[-1])
+    nodes = [Follower(("127.0.0.1", port), [h for h in node_hosts if h[1] != port], node_hosts[-1], config=config) for port in node_ports[:-1]]
+    leader = Leader(node_hosts[-1], node_hosts[:-1], node_hosts[-1], config=config)
     threads = [threading.Thread(target=node.run) for node in [leader, *nodes]]
     clients = [Client(node_hosts) for _ in range(num_clients)]
 
@@ -35,10 +51,11 @@ def setup(num_nodes, num_clients, start_port=25000, delayed=False):
         else:
             threads.append(threading.Thread(target=node.run))
 
-    clients = [Client(node_hosts) for _ in range(num_clients)]
+    clients = [Client(node_hosts, config=config, leader_host=node_hosts[-1]) for _ in range(num_clients)]
 
-    for thread in threads:
-        thread.start()
+    if start_threads:
+        for thread in threads:
+            thread.start()
 
     return node_hosts, nodes, leader, clients, threads
 
@@ -353,3 +370,957 @@ class TestConsistency_delay:
         if length == 1:
             order_index = value_set.pop()
             assert order_index[1] == 4 and order_index[0] == 'Hello2?'
+
+
+class TestLargeValues:
+    '''
+    Tests for values that do not fit in a single datagram.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 follower nodes, a leader and 1 client.
+        '''
+        node_hosts, nodes, leader, clients, threads = setup(3, 1)
+        self.node_hosts = node_hosts
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('size', [10000, 100000, 1000000])
+    def test_large_value(self, size):
+        '''
+        Write a large value next to a small one and read both back from every node.
+        '''
+        value = ''.join(random.choice('abcdefghij') for _ in range(size))
+        client = self.clients[0]
+        client.write(["large", "small"], [value, "Hello?"])
+
+        for host in self.node_hosts:
+            assert client.read(["large", "small"], host=host)["value"] == [value, "Hello?"]
+
+
+class TestBatching:
+    '''
+    Consistency tests with batched acknowledgements and write orders.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 5 follower nodes, a leader and 2 clients that batch every 5 ms.
+        '''
+        node_hosts, nodes, leader, clients, threads = setup(5, 2, config=Config(batch_interval=0.005, batch_size=16))
+        self.node_hosts = node_hosts
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_read_after_five_writes(self, execution_number):
+        '''
+        Blocking writes complete when their batch is sent after the batch interval.
+        '''
+        client = self.clients[0]
+        for i in range(5):
+            client.write("World!", "Hello{}?".format(i))
+
+        result = client.read('World!')
+        assert result["value"] == 'Hello4?' and result["order_index"] == 4
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_multi_async(self, execution_number):
+        '''
+        Async writes fill complete batches, all nodes end up with the same last value.
+        '''
+        client = self.clients[0]
+        for i in range(100):
+            client.write("World!", "Hello{}?".format(i), blocking=False)
+
+        for i in range(100):
+            client.write_recv()
+
+        values = set()
+        for host in self.node_hosts:
+            result = self.clients[1].read('World!', host=host)
+            values.add((result["value"], result["order_index"]))
+
+        assert len(values) == 1 and values.pop()[1] == 99
+
+
+@udp_only
+class TestAsyncio:
+    '''
+    Simple tests on nodes that run on asyncio event loops.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 follower nodes, a leader and 2 clients.
+        The nodes of test_single_loop share one event loop, the others call Node.run.
+        '''
+        config = Config(event_loop='asyncio', batch_interval=0.005)
+        node_hosts, nodes, leader, clients, threads = setup(3, 2, config=config, start_threads=False)
+        if method.__name__ == 'test_single_loop':
+            threads = [threading.Thread(target=aio.run_nodes, args=([leader, *nodes],))]
+
+        for thread in threads:
+            thread.start()
+
+        self.node_hosts = node_hosts
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    def check_writes(self):
+        '''
+        Send 50 async writes and check that all nodes agree on the last value.
+        '''
+        client = self.clients[0]
+        for i in range(50):
+            client.write("World!", "Hello{}?".format(i), blocking=False)
+
+        for i in range(50):
+            client.write_recv()
+
+        values = set()
+        for host in self.node_hosts:
+            result = self.clients[1].read('World!', host=host)
+            values.add((result["value"], result["order_index"]))
+
+        assert len(values) == 1 and values.pop()[1] == 49
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_loop_per_thread(self, execution_number):
+        '''
+        Every node runs its own event loop through Node.run.
+        '''
+        self.check_writes()
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_single_loop(self, execution_number):
+        '''
+        All nodes run on one event loop in a single thread.
+        '''
+        self.check_writes()
+
+
+@udp_only
+class TestAsyncClient:
+    '''
+    Tests for the asyncio client that pipelines many requests over one socket.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 follower nodes, a leader and 1 client to shut them down.
+        '''
+        node_hosts, nodes, leader, clients, threads = setup(3, 1)
+        self.node_hosts = node_hosts
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_pipelined_requests(self, execution_number):
+        '''
+        Send 500 writes and then 500 reads without waiting for responses in between,
+        every response has to be matched to the request for its own key.
+        '''
+        async def run():
+            client = await AsyncClient(self.node_hosts).start()
+            await asyncio.gather(*[client.write("key{}".format(i), "value{}".format(i)) for i in range(500)])
+            results = await asyncio.gather(*[client.read("key{}".format(i)) for i in range(500)])
+            client.close()
+            return results
+
+        loop = asyncio.new_event_loop()
+        results = loop.run_until_complete(run())
+        loop.close()
+
+        assert [result["value"] for result in results] == ["value{}".format(i) for i in range(500)]
+        assert sorted(result["order_index"] for result in results) == list(range(500))
+
+    def test_read_options(self):
+        '''
+        Leader and bounded staleness reads of the asyncio client, the same as those of Client.
+        '''
+        async def run():
+            client = await AsyncClient(self.node_hosts, leader_host=self.node_hosts[-1]).start()
+            await client.write("World!", "Hello?")
+            results = await asyncio.gather(client.read("World!", leader=True),
+                                           client.read("World!", max_staleness=10, max_staleness_ms=1000))
+            client.close()
+            return results
+
+        loop = asyncio.new_event_loop()
+        leader_result, bounded_result = loop.run_until_complete(run())
+        loop.close()
+
+        assert leader_result["value"] == "Hello?"
+        assert bounded_result["staleness"] <= 10 and "staleness_ms" in bounded_result
+
+
+@udp_only
+class TestSharded:
+    '''
+    Tests for the sharded deployment, where every node runs in its own process.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 shards of 3 nodes each and a sharded client.
+        '''
+        self.shards = shard.shard_hosts(3, 3)
+        self.processes = shard.start_shards(self.shards)
+        self.client = shard.ShardedClient(self.shards)
+
+    def teardown_method(self):
+        '''
+        Safely close the client and all node processes.
+        '''
+        self.client.exit()
+        for process in self.processes:
+            process.join()
+
+    def test_multi_shard_write_read(self):
+        '''
+        Write 20 keys in one request, which spans all shards, and read them back in one request.
+        '''
+        keys = ["key{}".format(i) for i in range(20)]
+        values = ["value{}".format(i) for i in range(20)]
+        assert len({shard.shard_of(key, 3) for key in keys}) == 3
+
+        self.client.write(keys, values)
+        result = self.client.read(keys)
+
+        assert result["key"] == keys and result["value"] == values
+
+    def test_order_per_shard(self):
+        '''
+        Every shard has its own order_index sequence.
+        '''
+        keys = ["key{}".format(i) for i in range(20)]
+        for key in keys:
+            self.client.write(key, "Hello?")
+
+        order_indices = {}
+        for key in keys:
+            order_indices.setdefault(shard.shard_of(key, 3), []).append(self.client.read(key)["order_index"])
+
+        for indices in order_indices.values():
+            assert sorted(indices) == list(range(len(indices)))
+
+
+class TestWriteWindow:
+    '''
+    Tests for the bounded window of client writes that are in flight on a node.
+    '''
+    def start(self, config):
+        node_hosts, nodes, leader, clients, threads = setup(3, 1, config=config)
+        self.node_hosts = node_hosts
+        self.nodes = nodes
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    def test_queue(self):
+        '''
+        Writes beyond the window are queued and all of them complete.
+        '''
+        self.start(Config(write_window=2, window_policy='queue'))
+        client = self.clients[0]
+        for i in range(50):
+            client.write("World!", "Hello{}?".format(i), host=self.node_hosts[0], blocking=False)
+        for i in range(50):
+            assert client.write_recv()["type"] == "write_result"
+
+        metrics = self.nodes[0].window_metrics()
+        assert metrics["max_in_flight"] <= 2 and metrics["queue_wait_count"] > 0
+        assert client.read("World!", host=self.node_hosts[0])["order_index"] == 49
+
+    def test_busy(self):
+        '''
+        Writes beyond the window are rejected with a busy response.
+        '''
+        self.start(Config(write_window=2, window_policy='busy'))
+        client = self.clients[0]
+        for i in range(200):
+            client.write("World!", "Hello{}?".format(i), host=self.node_hosts[0], blocking=False)
+        results = [client.write_recv()["type"] for _ in range(200)]
+
+        metrics = self.nodes[0].window_metrics()
+        assert "busy" in results and results.count("busy") == metrics["busy"]
+        assert metrics["max_in_flight"] <= 2 and metrics["queued"] == 0
+
+    def test_blocking_busy(self):
+        '''
+        A blocking write that is rejected raises BusyError. The peer of the node is not
+        running, so the first write is never acknowledged and keeps the window full.
+        '''
+        host, peer = ("127.0.0.1", 25000), ("127.0.0.1", 25001)
+        config = Config(write_window=1, window_policy='busy')
+        if os.environ.get("MANGODB_TRANSPORT"):
+            config.transport = os.environ["MANGODB_TRANSPORT"]
+        follower = Follower(host, [peer], peer, config=config)
+        self.threads = [threading.Thread(target=follower.run)]
+        self.threads[0].start()
+        client = Client([host], config=config)
+        self.clients = []
+
+        client.write("World!", "Hello0?", host=host, blocking=False)
+        with pytest.raises(BusyError):
+            client.write("World!", "Hello1?", host=host)
+
+        client.exit_single(host)
+        client.transport.close()
+        assert follower.window_metrics()["busy"] == 1
+
+
+class TestReliable:
+    '''
+    Tests for the reliable delivery layer between nodes, with and without lost datagrams.
+    '''
+    def start(self, config):
+        node_hosts, nodes, leader, clients, threads = setup(3, 1, config=config)
+        self.node_hosts = node_hosts
+        self.nodes = [leader, *nodes]
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('loss_rate', [0.0, 0.1])
+    def test_writes_complete(self, loss_rate):
+        '''
+        All writes complete and every node ends up with the same order.
+        '''
+        self.start(Config(reliable=True, loss_rate=loss_rate))
+        client = self.clients[0]
+        for i in range(50):
+            client.write("World!", "Hello{}?".format(i))
+
+        for host in self.node_hosts:
+            result = client.read("World!", host=host)
+            assert result["value"] == "Hello49?" and result["order_index"] == 49
+
+        stats = [node.reliable.stats for node in self.nodes]
+        if loss_rate:
+            assert sum(s["retransmitted"] for s in stats) > 0
+        else:
+            assert sum(s["duplicates"] for s in stats) == 0
+            assert sum(s["acks_piggybacked"] for s in stats) > sum(s["acks_sent"] for s in stats)
+
+    def test_restarted_node(self, tmp_path):
+        '''
+        A node that restarts from its WAL numbers its messages from 0 again, its peers
+        reset their channel to it instead of dropping its messages as duplicates.
+        '''
+        config = Config(reliable=True, wal_dir=str(tmp_path))
+        self.start(config)
+        client = self.clients[0]
+        # The restarted node counts its write ids from 0 again, so it must not have written before
+        for i in range(5):
+            client.write("World!", "Hello{}?".format(i), host=self.node_hosts[1])
+
+        host = self.node_hosts[0]
+        client.exit_single(host)
+        self.threads[1].join()
+        restarted = Follower(host, self.node_hosts[1:], self.node_hosts[-1], config=config)
+        self.nodes[1] = restarted
+        self.threads[1] = threading.Thread(target=restarted.run)
+        self.threads[1].start()
+
+        client.write("World!", "Hello5?", host=host)
+        result = client.read("World!", host=self.node_hosts[1])
+        assert result["value"] == "Hello5?" and result["order_index"] == 5
+        # The node that sent the first writes has heard from the previous incarnation
+        assert self.nodes[2].reliable.stats["resets"] == 1
+
+
+class TestBulk:
+    '''
+    Tests for the chunked and pipelined bulk operations of the client.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 follower nodes, a leader and 1 client.
+        '''
+        node_hosts, nodes, leader, clients, threads = setup(3, 1)
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    def test_bulk_write_read(self):
+        '''
+        Write and read back many keys in chunks.
+        '''
+        client = self.clients[0]
+        items = (("key{}".format(i), i) for i in range(2000))
+        results = list(client.bulk_write(items, chunk_size=50, window=4))
+        assert len(results) == 40 and all(r["type"] == "write_result" for r in results)
+
+        read = {key: value for key, value, _ in client.bulk_read(["key{}".format(i) for i in range(2000)], chunk_size=64)}
+        assert read == {"key{}".format(i): i for i in range(2000)}
+
+    def test_same_key_in_order(self):
+        '''
+        Writes of the same key keep the order in which they were given.
+        '''
+        client = self.clients[0]
+        items = [("World!", "Hello{}?".format(i)) for i in range(20)] + [("key", 1)]
+        results = list(client.bulk_write(items, chunk_size=8, window=8))
+        assert len(results) == 20
+
+        assert list(client.bulk_read(["World!"])) == [("World!", "Hello19?", 19)]
+
+
+class TestQuorum:
+    '''
+    Tests for writes that only wait for a quorum of acknowledgements.
+    '''
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_slow_node(self, execution_number):
+        '''
+        Writes do not wait for the delayed node, which still reads them in order.
+        '''
+        node_hosts, nodes, leader, clients, threads = setup(4, 1, delayed=True, config=Config(ack_quorum=2))
+        self.clients = clients
+        self.threads = threads
+
+        client = clients[0]
+        for i in range(10):
+            client.write(["World!", "key"], ["Hello{}?".format(i), i], host=random.choice(node_hosts[1:]))
+
+        # The first follower is the delayed node
+        result = client.read(["World!", "key"], host=node_hosts[0])
+        assert result["value"] == ["Hello9?", 9] and result["order_index"] == [9, 9]
+
+
+class TestCatchUp:
+    '''
+    Tests for a single follower that fetches a missed write from the leader, messages are not sent.
+    '''
+    def setup_method(self, method):
+        '''
+        Create a follower that records the messages it sends.
+        '''
+        self.clients = []
+        self.follower = Follower(("127.0.0.1", 0), [("127.0.0.1", 1), ("127.0.0.1", 2)], ("127.0.0.1", 2),
+                                 config=Config(ack_quorum=1, catchup_timeout=0))
+        self.sent = []
+        self.follower.send = lambda addr, message: self.sent.append(message)
+
+    def teardown_method(self):
+        self.follower.transport.close()
+
+    def test_missed_write(self):
+        '''
+        A read waits for the missed write, which is fetched, applied once and then read.
+        '''
+        write = {"type": "write", "id": 5, "keys": ["World!"], "values": ["Hello?"], "from": ("127.0.0.1", 1)}
+        self.follower.handle_write_order(None, {"type": "write_order", "id": 5, "index": 0, "term": 0})
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"]})
+        self.follower.handle_read_index_result(None, {"type": "read_index_result", "round": 1, "index": 1})
+        assert self.sent == [{"type": "read_index", "round": 1}]
+
+        self.sent.clear()
+        self.follower.on_tick()
+        self.follower.on_tick()
+        assert self.sent == [{"type": "fetch", "index": 0}]
+
+        self.follower.handle_catch_up(None, dict(write, type="catch_up", index=0, term=0))
+        assert self.sent[-1]["type"] == "read_result" and self.sent[-1]["value"] == "Hello?"
+
+        # The write itself arrives late and is dropped
+        self.follower.handle_write(("127.0.0.1", 1), write)
+        assert not self.follower.write_buffer and not self.follower.pending_keys
+        assert self.follower.data["World!"] == ("Hello?", 0)
+
+    def test_missed_order(self):
+        '''
+        A node outside the quorum that lost a write and its order learns of them from the leader.
+        '''
+        self.follower.handle_client_read(("127.0.0.1", 3), {"type": "client_read", "key": ["World!"]})
+        self.follower.handle_client_read(("127.0.0.1", 3), {"type": "client_read", "key": ["World!"], "rid": 1})
+        assert self.sent == [{"type": "read_index", "round": 1}]
+
+        # The second read arrived after the round was sent, so it is asked with the next one
+        self.follower.handle_read_index_result(None, {"type": "read_index_result", "round": 1, "index": 1})
+        assert self.sent[1:] == [{"type": "read_index", "round": 2}]
+        self.follower.handle_read_index_result(None, {"type": "read_index_result", "round": 2, "index": 1})
+        assert len(self.sent) == 2
+
+        self.follower.on_tick()
+        self.follower.on_tick()
+        assert self.sent[-1] == {"type": "fetch", "index": 0}
+
+        self.follower.handle_catch_up(None, {"type": "catch_up", "term": 0, "index": 0, "id": 5,
+                                             "keys": ["World!"], "values": ["Hello?"]})
+        results = [message for message in self.sent if message["type"] == "read_result"]
+        assert [(r["value"], r["order_index"]) for r in results] == [("Hello?", 0), ("Hello?", 0)]
+
+    def test_lost_round(self):
+        '''
+        A read index round whose answer was lost is asked again, a late answer of an old round is ignored.
+        '''
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"]})
+        self.follower.on_tick()
+        assert self.sent == [{"type": "read_index", "round": 1}] * 2
+
+        self.follower.handle_read_index_result(None, {"type": "read_index_result", "round": 0, "index": 0})
+        assert len(self.sent) == 2
+        self.follower.handle_read_index_result(None, {"type": "read_index_result", "round": 1, "index": 0})
+        assert self.sent[-1]["type"] == "read_result" and self.sent[-1]["order_index"] is None
+
+
+class TestLeaderReads:
+    '''
+    Tests for reads that are answered by the leader while it holds its lease.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 follower nodes, a leader and 1 client that reads from the leader.
+        '''
+        node_hosts, nodes, leader, clients, threads = setup(4, 1, config=Config(lease_duration=0.5, leader_reads=True))
+        self.node_hosts = node_hosts
+        self.leader = leader
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_read_after_write(self, execution_number):
+        '''
+        Reads go to the leader and see the last write.
+        '''
+        client = self.clients[0]
+        for i in range(10):
+            client.write("World!", "Hello{}?".format(i))
+            result = client.read("World!")
+            assert result["host"] == self.node_hosts[-1] and result["value"] == "Hello{}?".format(i)
+
+        assert self.leader.has_lease()
+        assert client.read("World!", leader=False)["value"] == "Hello9?"
+
+    def test_unknown_leader(self):
+        '''
+        A leader read of a client that does not know the leader is rejected instead of sent to any node.
+        '''
+        client = Client(self.node_hosts)
+        with pytest.raises(ValueError):
+            client.read("World!", leader=True)
+        client.transport.close()
+
+
+class TestLease:
+    '''
+    Tests for the lease of a single leader, messages are not sent.
+    '''
+    def setup_method(self, method):
+        '''
+        Create a leader of 4 followers that records the messages it sends.
+        '''
+        followers = [("127.0.0.1", port) for port in range(1, 5)]
+        self.leader = Leader(("127.0.0.1", 0), followers, ("127.0.0.1", 0), config=Config(lease_duration=10))
+        self.sent = []
+        self.leader.send = lambda addr, message: self.sent.append(message)
+
+    def teardown_method(self):
+        self.leader.transport.close()
+
+    def test_majority(self):
+        '''
+        Leader reads wait until a majority of the nodes granted the lease.
+        '''
+        self.leader.handle_client_read(None, {"type": "client_read", "key": ["World!"], "leader": True})
+        self.leader.on_tick()
+        assert self.sent == [{"type": "lease_renew", "round": 1}] * 4
+
+        self.leader.handle_lease_ack(("127.0.0.1", 1), {"type": "lease_ack", "round": 1})
+        self.leader.handle_lease_ack(("127.0.0.1", 1), {"type": "lease_ack", "round": 1})
+        assert not self.leader.has_lease() and len(self.sent) == 4
+
+        self.leader.handle_lease_ack(("127.0.0.1", 2), {"type": "lease_ack", "round": 1})
+        assert self.leader.has_lease() and self.sent[-1]["type"] == "read_result"
+
+    def test_step_down(self):
+        '''
+        Leader reads that wait for the lease wait for the new leader once the leader steps down.
+        '''
+        read = {"type": "client_read", "key": ["World!"], "leader": True}
+        self.leader.handle_client_read(None, read)
+        self.leader.step_down()
+
+        assert not isinstance(self.leader, Leader) and self.leader.lease_reads == []
+        assert [data for _, data, _ in self.leader.round_reads] == [read]
+
+    def test_early_acks_expire(self):
+        '''
+        Acknowledgements of writes that never reach the leader are forgotten after the election timeout.
+        '''
+        self.leader.handle_client_write_ack(("127.0.0.1", 1), {"type": "client_write_ack", "id": 1})
+        self.leader.expire_early_acks(self.leader.now())
+        assert list(self.leader.early_acks) == [1]
+
+        self.leader.expire_early_acks(self.leader.now() + self.leader.config.election_timeout)
+        assert self.leader.early_acks == {}
+
+    def test_tick_interval(self):
+        '''
+        A shorter tick interval that is required later also shortens the receive timeout.
+        '''
+        timeouts = []
+        self.leader.transport.settimeout = timeouts.append
+        self.leader.require_tick(self.leader.tick_interval * 2)
+        self.leader.require_tick(self.leader.tick_interval / 2)
+        assert timeouts == [self.leader.tick_interval]
+
+
+class TestBoundedStaleness:
+    '''
+    Tests for reads that accept values up to a bound of staleness, messages are not sent.
+    '''
+    def setup_method(self, method):
+        '''
+        Create a follower with a value and a pending write of that value, that records the messages it sends.
+        '''
+        self.follower = Follower(("127.0.0.1", 0), [("127.0.0.1", 1)], ("127.0.0.1", 1))
+        self.sent = []
+        self.follower.send = lambda addr, message: self.sent.append(message)
+
+        for i in range(2):
+            self.follower.handle_write(("127.0.0.1", 1), {"type": "write", "id": i, "keys": ["World!"],
+                                                          "values": ["Hello{}?".format(i)], "from": ("127.0.0.1", 1)})
+        self.follower.handle_write_order(None, {"type": "write_order", "id": 0, "index": 0, "term": 0})
+        self.sent.clear()
+
+    def teardown_method(self):
+        self.follower.transport.close()
+
+    def test_within_bound(self):
+        '''
+        A read within the bound is answered right away and reports its staleness.
+        '''
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"], "max_staleness": 1,
+                                                "max_staleness_ms": 60000})
+        assert self.sent[0]["value"] == "Hello0?" and self.sent[0]["staleness"] == 1
+        assert 0 <= self.sent[0]["staleness_ms"] < 60000
+
+    def test_beyond_bound(self):
+        '''
+        A read beyond the bound waits for the pending write.
+        '''
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"], "max_staleness": 0})
+        assert self.sent == []
+
+        self.follower.handle_write_order(None, {"type": "write_order", "id": 1, "index": 1, "term": 0})
+        assert self.sent[0]["value"] == "Hello1?" and "staleness" not in self.sent[0]
+
+
+class TestPendingKeys:
+    '''
+    Tests for the index of keys with writes in flight, messages are not sent.
+    '''
+    def setup_method(self, method):
+        '''
+        Create a follower and a leader of one other node that record the messages they send.
+        '''
+        self.sent = []
+        self.follower = Follower(("127.0.0.1", 0), [("127.0.0.1", 1)], ("127.0.0.1", 1))
+        self.leader = Leader(("127.0.0.1", 0), [("127.0.0.1", 1)], ("127.0.0.1", 0))
+        for node in [self.follower, self.leader]:
+            node.send = lambda addr, message: self.sent.append(message)
+
+    def teardown_method(self):
+        self.follower.transport.close()
+        self.leader.transport.close()
+
+    def test_counts(self):
+        '''
+        A key stays pending from the client write until its last write is ordered.
+        '''
+        follower = self.follower
+        for i in range(2):
+            follower.handle_client_write(("127.0.0.1", 9), {"type": "client_write", "keys": ["World!"],
+                                                            "values": ["Hello{}?".format(i)]})
+        assert follower.pending_keys == {"World!": 2} and "World!" in follower.pending_since
+
+        follower.handle_acknowledge(("127.0.0.1", 1), {"type": "acknowledge", "id": 0})
+        assert follower.pending_keys == {"World!": 2} and 0 in follower.write_buffer
+
+        follower.handle_write_order(None, {"type": "write_order", "id": 0, "index": 0, "term": 0})
+        assert follower.pending_keys == {"World!": 1}
+
+        follower.handle_acknowledge(("127.0.0.1", 1), {"type": "acknowledge", "id": 2})
+        follower.handle_write_order(None, {"type": "write_order", "id": 2, "index": 1, "term": 0})
+        assert not follower.pending_keys and not follower.pending_since
+        assert follower.data["World!"] == ("Hello1?", 1)
+
+    def test_leader_releases_reads(self):
+        '''
+        A read that waits on the leader is answered once the leader orders the write.
+        '''
+        self.leader.handle_write(("127.0.0.1", 1), {"type": "write", "id": 1, "keys": ["World!"],
+                                                    "values": ["Hello?"], "from": ("127.0.0.1", 1)})
+        self.sent.clear()
+        self.leader.handle_client_read(("127.0.0.1", 9), {"type": "client_read", "key": ["World!"]})
+        assert self.sent == []
+
+        self.leader.handle_client_write_ack(("127.0.0.1", 1), {"type": "client_write_ack", "id": 1})
+        result = self.sent[-1]
+        assert result["type"] == "read_result" and result["value"] == "Hello?" and result["order_index"] == 0
+        assert not self.leader.pending_keys and not self.leader.read_buffer
+
+
+class TestReadPath:
+    '''
+    Tests for reads with and without pending writes of their keys, messages are not sent.
+    '''
+    def setup_method(self, method):
+        '''
+        Create a follower with one applied write that records the messages it sends.
+        '''
+        self.follower = Follower(("127.0.0.1", 0), [("127.0.0.1", 1)], ("127.0.0.1", 1))
+        self.sent = []
+        self.follower.send = lambda addr, message: self.sent.append(message)
+        self.write(1, "World!", "Hello?", 0)
+
+    def teardown_method(self):
+        self.follower.transport.close()
+
+    def write(self, msg_id, key, value, index=None):
+        self.follower.handle_write(("127.0.0.1", 1), {"type": "write", "id": msg_id, "keys": [key],
+                                                      "values": [value], "from": ("127.0.0.1", 1)})
+        if index is not None:
+            self.follower.handle_write_order(None, {"type": "write_order", "id": msg_id, "index": index, "term": 0})
+        self.sent.clear()
+
+    def test_fast_path(self):
+        '''
+        Keys without pending writes are answered right away, unknown keys are not added to the store.
+        '''
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"], "rid": 4})
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!", "missing"]})
+
+        assert self.sent[0] == {"type": "read_result", "key": ["World!"], "value": "Hello?", "order_index": 0,
+                                "rid": 4}
+        assert self.sent[1]["value"] == ["Hello?", None] and self.sent[1]["order_index"] == [0, None]
+        assert "missing" not in self.follower.data.latest and not self.follower.read_buffer
+
+    def test_pending_path(self):
+        '''
+        A read of a pending key and a key without pending write waits for the pending one only.
+        '''
+        self.write(3, "key", 1)
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!", "key"], "rid": 5})
+        assert self.sent == [] and list(self.follower.read_buffer) == ["key"]
+
+        self.write(5, "World!", "Bye!", 2)
+        assert self.sent == []
+        self.follower.handle_write_order(None, {"type": "write_order", "id": 3, "index": 1, "term": 0})
+        assert self.sent[0]["value"] == ["Hello?", 1] and self.sent[0]["order_index"] == [0, 1]
+        assert self.sent[0]["rid"] == 5 and not self.follower.read_buffer
+
+
+class TestWriteOrder:
+    '''
+    Tests for orders that arrive before or after their writes, messages are not sent.
+    '''
+    def setup_method(self, method):
+        '''
+        Create a follower that records the messages it sends.
+        '''
+        self.follower = Follower(("127.0.0.1", 0), [("127.0.0.1", 1)], ("127.0.0.1", 1))
+        self.follower.send = lambda addr, message: None
+
+    def teardown_method(self):
+        self.follower.transport.close()
+
+    def write(self, msg_id):
+        self.follower.handle_write(("127.0.0.1", 1), {"type": "write", "id": msg_id, "keys": ["key{}".format(msg_id)],
+                                                      "values": [msg_id], "from": ("127.0.0.1", 1)})
+
+    def order(self, msg_id, index):
+        self.follower.handle_write_order(None, {"type": "write_order", "id": msg_id, "index": index, "term": 0})
+
+    def test_orders_before_writes(self):
+        '''
+        Orders 1, 0 and 2 arrive before and after their writes, every write is applied at its own index.
+        '''
+        follower = self.follower
+        self.order(11, 1)
+        self.write(10)
+        assert follower.order_index == 0
+
+        # Order 0 completes the run 0, 1, but the write of order 1 has not arrived yet
+        self.order(10, 0)
+        assert follower.order_index == 1 and follower.data["key10"] == (10, 0)
+
+        # The write resumes the run
+        self.write(11)
+        assert follower.order_index == 2 and follower.data["key11"] == (11, 1)
+
+        self.write(12)
+        assert follower.data["key12"] == (None, None) and follower.is_key_pending("key12")
+        self.order(12, 2)
+        assert follower.order_index == 3 and follower.data["key12"] == (12, 2)
+        assert not follower.order_buffer and not follower.write_buffer and not follower.pending_keys
+
+    def test_consecutive_run(self):
+        '''
+        Orders that arrive in reverse are applied in one run once the first one arrives.
+        '''
+        for msg_id in range(5):
+            self.write(msg_id)
+        for index in reversed(range(1, 5)):
+            self.order(index, index)
+        assert self.follower.order_index == 0 and len(self.follower.order_buffer) == 4
+
+        self.order(0, 0)
+        assert self.follower.order_index == 5 and not self.follower.order_buffer
+        assert [self.follower.data["key{}".format(i)] for i in range(5)] == [(i, i) for i in range(5)]
+
+        # Orders that were already applied are ignored
+        self.order(3, 3)
+        assert self.follower.order_index == 5 and not self.follower.order_buffer
+
+
+class TestFailover:
+    '''
+    Tests for the election of a new leader after the leader failed.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 4 follower nodes, a leader and 1 client, with fast failure detection.
+        '''
+        config = Config(heartbeat_interval=0.02, election_timeout=0.2)
+        node_hosts, nodes, leader, clients, threads = setup(5, 1, config=config)
+        self.node_hosts = node_hosts
+        self.nodes = nodes
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('execution_number', range(3))
+    def test_leader_failure(self, execution_number):
+        '''
+        Writes continue after the leader exits, and all followers agree on their order.
+        '''
+        client = self.clients[0]
+        followers = self.node_hosts[:-1]
+        for i in range(5):
+            client.write("World!", "Hello{}?".format(i), host=random.choice(followers))
+
+        # The leader thread is the first one
+        client.exit_single(self.node_hosts[-1])
+        self.threads[0].join()
+
+        for i in range(5, 10):
+            client.write("World!", "Hello{}?".format(i), host=random.choice(followers))
+
+        for host in followers:
+            result = client.read("World!", host=host)
+            assert result["value"] == "Hello9?" and result["order_index"] == 9
+        assert len([node for node in self.nodes if isinstance(node, Leader)]) == 1
+
+
+class TestPartitionedLeader:
+    '''
+    Tests for a leader that is cut off from the followers in the simulator, instead of failing.
+    '''
+    def teardown_method(self):
+        self.sim.close()
+
+    @pytest.mark.parametrize('seed', range(3))
+    def test_heal(self, seed):
+        '''
+        The cut off leader steps down, and after the partition heals it follows the new leader,
+        rolls back the orders it applied alone and catches up.
+        '''
+        self.sim = sim = Simulation(5, seed=seed, config=Config(heartbeat_interval=0.05, election_timeout=0.25))
+        sim.add_clients(8)
+        sim.partition([sim.leader.host], [follower.host for follower in sim.followers], at=0.3)
+        sim.heal(at=0.9)
+        sim.run(1.2)
+        sim.stop_clients()
+        sim.run(1.6)
+
+        leaders = [node for node in sim.nodes if isinstance(node, Leader)]
+        assert len(leaders) == 1 and leaders[0] is not sim.leader and sim.leader.removed
+        assert {node.term for node in sim.nodes} == {1} and len({node.order_index for node in sim.nodes}) == 1
+        assert sim.completed["write"] > 1000 and sim.check() == []
@@ -0,0 +1,128 @@
+'''
+Test the in-process transport of MangoDB. These include:
+   - Binding ports and delivering messages without sockets
+   - Copies of messages and the codec option
+   - A cluster on one thread with direct dispatch
+
+Please run with `pytest -v`
+'''
+
+import pytest
+
+from config import Config
+from inproc import InProcessTransport, Network
+from test_functional_requirements import setup
+
+
+class TestNetwork:
+    '''
+    Class that contains the tests of in-process endpoints.
+    '''
+    def setup_method(self):
+        self.network = Network()
+        self.config = Config(transport="inproc", network=self.network)
+
+    def test_send_recv(self):
+        '''
+        A message arrives at the endpoint of the port, with the address of the sender.
+        '''
+        receiver = InProcessTransport(25000, self.config)
+        sender = InProcessTransport(0, self.config)
+        sender.send({"type": "write_order", "id": 1, "index": 0}, ("127.0.0.1", 25000))
+
+        message, addr = receiver.recv()
+
+        assert message == {"type": "write_order", "id": 1, "index": 0}
+        assert addr == ("127.0.0.1", sender.port)
+
+    def test_ports(self):
+        '''
+        A port can only be bound once, port 0 picks a free one, messages to unbound ports are dropped.
+        '''
+        transport = InProcessTransport(25000, self.config)
+        with pytest.raises(OSError):
+            InProcessTransport(25000, self.config)
+
+        free = InProcessTransport(0, self.config)
+        free.send({"type": "exit"}, ("127.0.0.1", 25001))
+        transport.close()
+        InProcessTransport(25000, self.config)
+
+        assert free.port != 25000 and self.network.delivered == 0
+
+    def test_copies(self):
+        '''
+        The receiver gets a copy of the message, with inproc_codec a decoded one.
+        '''
+        receiver = InProcessTransport(25000, self.config)
+        sender = InProcessTransport(0, self.config)
+        message = {"type": "acknowledge", "id": 1, "from": ("127.0.0.1", 1)}
+        sender.send(message, receiver.addr)
+        received, _ = receiver.recv()
+        received["seq"] = 3
+
+        codec_sender = InProcessTransport(0, Config(transport="inproc", network=self.network, inproc_codec=True))
+        codec_sender.send(message, receiver.addr)
+        decoded, _ = receiver.recv()
+
+        assert "seq" not in message and received["from"] is message["from"]
+        assert decoded == {"type": "acknowledge", "id": 1, "from": ["127.0.0.1", 1]}
+
+    def test_timeout(self):
+        '''
+        A receive without messages times out like a socket.
+        '''
+        transport = InProcessTransport(0, self.config)
+        transport.settimeout(0.01)
+
+        with pytest.raises(OSError):
+            transport.recv()
+
+
+class TestDirectDispatch:
+    '''
+    Class that contains the tests of a cluster that runs on the thread of its client.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 follower nodes, a leader and 1 client without threads.
+        '''
+        self.network = Network()
+        config = Config(transport="inproc", network=self.network)
+        node_hosts, nodes, leader, clients, threads = setup(4, 1, config=config, start_threads=False)
+        self.network.attach(leader, *nodes)
+        self.node_hosts = node_hosts
+        self.nodes = [leader, *nodes]
+        self.clients = clients
+
+    def teardown_method(self):
+        '''
+        Deliver the exit messages, which close all nodes.
+        '''
+        for client in self.clients:
+            client.exit()
+        self.network.run_until_idle()
+
+    def test_read_after_write(self):
+        '''
+        Writes complete and are applied on every node without any thread.
+        '''
+        client = self.clients[0]
+        for i in range(200):
+            client.write("key{}".format(i % 10), i)
+        self.network.run_until_idle()
+
+        for host in self.node_hosts:
+            result = client.read("key9", host=host)
+            assert result["value"] == 199 and result["order_index"] == 199
+        assert all(node.order_index == 200 for node in self.nodes)
+
+    def test_exit(self):
+        '''
+        All nodes stop once the exit messages are delivered.
+        '''
+        self.clients[0].write("World!", "Hello?")
+        self.clients[0].exit_single(self.node_hosts[0])
+        self.network.run_until_idle()
+
+        assert not self.nodes[1].is_connected and all(node.is_connected for node in self.nodes[2:])
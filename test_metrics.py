@@ -0,0 +1,98 @@
+'''
+Test the metrics of MangoDB. These include:
+   - The accuracy of the histograms
+   - The stats message of a running cluster
+   - The Prometheus endpoint
+
+Please run with `pytest -v`
+'''
+
+import random
+from urllib.request import urlopen
+
+from config import Config
+from metrics import Histogram, SUB_BUCKETS
+from test_functional_requirements import setup
+
+
+class TestHistogram:
+    '''
+    Class that contains the tests of the HDR-style histogram.
+    '''
+    def test_quantiles(self):
+        '''
+        Quantiles are within the relative error of a bucket of the exact values.
+        '''
+        random.seed(7)
+        values = sorted(random.expovariate(1 / 0.002) for _ in range(20000))
+        histogram = Histogram()
+        for value in values:
+            histogram.record(value)
+
+        for q in [0.5, 0.9, 0.99]:
+            exact = values[int(q * len(values)) - 1]
+            assert abs(histogram.quantile(q) - exact) <= exact / SUB_BUCKETS + 2e-6
+
+        assert histogram.count == len(values) and histogram.max == values[-1]
+
+    def test_empty(self):
+        '''
+        An empty histogram reports zeros.
+        '''
+        summary = Histogram().summary()
+
+        assert summary["count"] == 0 and summary["p99"] == 0.0
+
+
+class TestStats:
+    '''
+    Class that contains the tests of the metrics of a running cluster.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 2 follower nodes, a leader and 1 client, every node serves its metrics.
+        '''
+        node_hosts, nodes, leader, clients, threads = setup(3, 1, config=Config(metrics_port=0))
+        self.node_hosts = node_hosts
+        self.nodes = nodes
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    def test_stats_message(self):
+        '''
+        A stats message returns the message counts, buffer depths and latencies of a node.
+        '''
+        client = self.clients[0]
+        for i in range(10):
+            client.write("World!", "Hello{}?".format(i), host=self.node_hosts[0])
+        client.read("World!", host=self.node_hosts[0])
+
+        stats = client.stats(self.node_hosts[0])
+
+        assert stats["received"]["client_write"] == 10 and stats["received"]["client_read"] == 1
+        assert stats["received"]["acknowledge"] == 20
+        assert stats["histograms"]["write_ack_seconds"]["count"] == 10
+        assert stats["gauges"]["ack_buffer"] == 0 and stats["gauges"]["window_in_flight"] >= 0
+
+    def test_prometheus(self):
+        '''
+        The HTTP endpoint serves the metrics in the Prometheus text format.
+        '''
+        self.clients[0].write("World!", "Hello?", host=self.node_hosts[0])
+
+        port = self.nodes[0].metrics_server.port
+        text = urlopen("http://127.0.0.1:{}/metrics".format(port), timeout=5).read().decode()
+
+        assert '# TYPE mangodb_messages_received_total counter' in text
+        assert 'mangodb_messages_received_total{{node="127.0.0.1:{}",type="client_write"}} 1'.format(
+            self.node_hosts[0][1]) in text
+        assert 'mangodb_write_ack_seconds_count{{node="127.0.0.1:{}"}} 1'.format(self.node_hosts[0][1]) in text
@@ -0,0 +1,118 @@
+'''
+Test the deterministic simulator of MangoDB. These include:
+   - Repeating a run exactly with the same seed
+   - Leaving the given config and the module random alone
+   - Writes that stall during a partition and complete after it heals
+   - Reads with a quorum that see every completed write
+   - The safety checks of the order and of reads
+
+Please run with `pytest -v`
+'''
+
+import random
+
+from config import Config
+from simulation import Simulation, constant, exponential
+
+
+class TestSimulation:
+    '''
+    Class that contains the tests of simulated clusters.
+    '''
+    def setup_method(self):
+        self.simulations = []
+
+    def teardown_method(self):
+        '''
+        Stop the nodes of all simulations.
+        '''
+        for sim in self.simulations:
+            sim.close()
+
+    def simulate(self, n_nodes, seed=0, **options):
+        sim = Simulation(n_nodes, seed=seed, **options)
+        self.simulations.append(sim)
+        return sim
+
+    def test_deterministic(self):
+        '''
+        The same seed gives the same run, down to every latency; another seed does not.
+        '''
+        reports = []
+        for seed in [1, 1, 2]:
+            sim = self.simulate(4, seed=seed, latency=exponential(0.0002, 0.0001), loss_rate=0.05,
+                                reorder_rate=0.1, config=Config(reliable=True))
+            sim.add_clients(4)
+            sim.run(0.2)
+            reports.append(sim.report())
+
+        assert reports[0] == reports[1] and reports[0] != reports[2]
+        assert reports[0]["completed"]["write"] > 50 and reports[0]["violations"] == 0
+
+    def test_isolated(self):
+        '''
+        A simulation works on a copy of its config and draws from its own generators only.
+        '''
+        config = Config(reliable=True, loss_rate=0.05)
+        state = random.getstate()
+        sim = self.simulate(3, seed=5, config=config)
+        sim.add_clients(2)
+        sim.run(0.1)
+
+        assert sim.completed["write"] > 0 and random.getstate() == state
+        assert config.transport == "udp" and config.network is None and config.clock is None and config.rng is None
+
+    def test_latency(self):
+        '''
+        With a constant latency and no service time, a write takes four hops and a read two.
+        '''
+        sim = self.simulate(3, latency=constant(0.001), service_time=0)
+        sim.add_clients(1, write_ratio=0.5)
+        sim.run(1.0)
+        report = sim.report()
+
+        assert abs(report["latency"]["write"]["p50"] - 0.004) < 0.0002
+        assert abs(report["latency"]["read"]["p50"] - 0.002) < 0.0002
+        assert sim.time == 1.0 and len(set(report["order_index"])) <= 2
+
+    def test_partition(self):
+        '''
+        Writes stall while a follower is cut off and complete once the partition heals.
+        '''
+        sim = self.simulate(3, config=Config(reliable=True))
+        sim.add_clients(2, write_ratio=1.0, timeout=2.0)
+        sim.partition([sim.node_hosts[0]], at=0.1)
+        sim.heal(at=0.4)
+
+        sim.run(0.1)
+        before = sim.completed["write"]
+        sim.run(0.4)
+        stalled = sim.completed["write"]
+        sim.run(0.6)
+        sim.stop_clients()
+        sim.run_until_idle()
+
+        assert before > 0 and stalled - before <= 2 and sim.completed["write"] > stalled
+        assert sim.dropped > 0 and sim.latencies["write"].max >= 0.29
+        assert len({node.order_index for node in sim.nodes}) == 1 and sim.check() == []
+
+    def test_quorum_reads(self):
+        '''
+        With a quorum, reads at nodes that have not received a completed write yet still return it.
+        '''
+        sim = self.simulate(5, reorder_rate=0.1, config=Config(ack_quorum=2))
+        sim.add_clients(8)
+        sim.run(0.3)
+
+        assert sim.completed["read"] > 100 and sim.check() == []
+
+    def test_check(self):
+        '''
+        A read that returns an older value than a write that completed before it was sent is reported.
+        '''
+        sim = self.simulate(3)
+        sim.value_index.update({"old": 3, "new": 5})
+        sim.writes["World!"] = [(1.0, "old"), (2.0, "new")]
+        sim.reads = [("World!", 1.5, 3, "old"), ("World!", 2.5, 5, "new"), ("World!", 2.5, 3, "old")]
+
+        assert len(sim.check()) == 1
@@ -0,0 +1,153 @@
+'''
+Test the multi-version store of MangoDB. These include:
+   - Reads of the latest version and of earlier versions
+   - Garbage collection below the low-water mark
+   - Rolling back the versions of orders that a deposed leader applied alone
+   - Snapshot reads on a follower that do not wait for pending writes
+
+Please run with `pytest -v`
+'''
+
+from config import Config
+from store import NO_ENTRY, VersionedStore
+from follower import Follower
+
+
+class TestVersionedStore:
+    '''
+    Class that contains the tests of the store itself.
+    '''
+    def setup_method(self, method):
+        '''
+        Write three versions of one key and one version of another.
+        '''
+        self.store = VersionedStore()
+        self.store.put("World!", "Hello?", 0)
+        self.store.put("key", 1, 1)
+        self.store.put("World!", "Hello!", 2)
+        self.store.put("World!", "Bye!", 5)
+
+    def test_read_latest(self):
+        '''
+        Normal reads return the latest version.
+        '''
+        assert self.store["World!"] == ("Bye!", 5)
+        assert self.store.get("missing") == NO_ENTRY
+
+    def test_read_at(self):
+        '''
+        A read at an order index returns the version that was visible then.
+        '''
+        assert self.store.read_at("World!", 0) == ("Hello?", 0)
+        assert self.store.read_at("World!", 4) == ("Hello!", 2)
+        assert self.store.read_at("World!", 9) == ("Bye!", 5)
+        assert self.store.read_at("key", 0) == NO_ENTRY
+
+    def test_collect(self):
+        '''
+        Versions that are not visible at the low-water mark are dropped.
+        '''
+        assert self.store.collect(3) == 1
+        assert self.store.read_at("World!", 3) == ("Hello!", 2)
+        assert self.store.collect(5) == 1
+        assert self.store.history == {} and self.store.low_water == 5
+
+    def test_roll_back(self):
+        '''
+        Rolling back drops the newer versions, a key that was not written before is removed.
+        '''
+        self.store.put("new", 0, 6)
+        self.store.roll_back(["World!", "new", "key"], 2)
+        assert self.store["World!"] == ("Hello?", 0) and self.store["key"] == (1, 1)
+        assert self.store.get("new") == NO_ENTRY and self.store.history == {}
+
+    def test_without_history(self):
+        '''
+        Without history only the latest version is kept.
+        '''
+        store = VersionedStore(keep_history=False)
+        store.put("World!", "Hello?", 0)
+        store.put("World!", "Bye!", 1)
+        assert store.history == {} and store.read_at("World!", 0) == NO_ENTRY
+        assert store.low_water == 1
+
+
+class TestSnapshotRead:
+    '''
+    Snapshot reads on a single follower, messages are not sent.
+    '''
+    def setup_method(self, method):
+        '''
+        Create a follower that records the messages it sends.
+        '''
+        self.start(Config())
+
+    def start(self, config):
+        self.follower = Follower(("127.0.0.1", 0), [("127.0.0.1", 1)], ("127.0.0.1", 1), config=config)
+        self.sent = []
+        self.follower.send = lambda addr, message: self.sent.append(message)
+
+    def restart(self, config):
+        self.follower.on_message(None, {"type": "exit"})
+        self.start(config)
+
+    def teardown_method(self):
+        self.follower.transport.close()
+
+    def write(self, msg_id, keys, values, index):
+        self.follower.handle_write(None, {"type": "write", "id": msg_id, "keys": keys,
+                                          "values": values, "from": ("127.0.0.1", 1)})
+        if index is not None:
+            self.follower.handle_write_order(None, {"type": "write_order", "id": msg_id, "index": index, "term": 0})
+
+    def test_pending_write(self):
+        '''
+        A snapshot read answers right away while a normal read waits.
+        '''
+        self.write("a", ["World!", "key"], ["Hello?", 1], 0)
+        self.write("b", ["World!"], ["Bye!"], None)
+        self.sent.clear()
+
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"]})
+        assert self.sent == []
+
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!", "key"], "snapshot": True})
+        assert self.sent[0]["value"] == ["Hello?", 1] and self.sent[0]["snapshot"] == 0
+
+    def test_pinned_index(self):
+        '''
+        A read at a pinned index does not see later writes.
+        '''
+        self.write("a", ["World!", "key"], ["Hello?", 1], 0)
+        self.write("b", ["World!", "key"], ["Bye!", 2], 1)
+        self.sent.clear()
+
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!", "key"], "snapshot": 0})
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"], "snapshot": 7})
+        assert self.sent[0]["value"] == ["Hello?", 1] and self.sent[0]["order_index"] == [0, 0]
+        assert self.sent[1]["value"] == "Bye!" and self.sent[1]["snapshot"] == 1
+
+    def test_without_history(self):
+        '''
+        Without history a read at an overwritten index returns the oldest version that is kept.
+        '''
+        self.restart(Config(version_retention=0))
+        self.write("a", ["World!"], ["v0"], 0)
+        self.write("b", ["World!"], ["v1"], 1)
+        self.sent.clear()
+
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"], "snapshot": 0})
+        assert self.sent[0]["value"] == "v1" and self.sent[0]["snapshot"] == 1
+
+    def test_after_recovery(self, tmp_path):
+        '''
+        After recovery from the WAL, versions before the recovered index are not known.
+        '''
+        config = Config(wal_dir=str(tmp_path), wal_fsync="always")
+        self.restart(config)
+        self.write("a", ["World!"], ["v0"], 0)
+        self.write("b", ["World!"], ["v1"], 1)
+        self.restart(config)
+
+        self.follower.handle_client_read(None, {"type": "client_read", "key": ["World!"], "snapshot": 0})
+        assert self.sent[0]["value"] == "v1" and self.sent[0]["snapshot"] == 1
@@ -0,0 +1,201 @@
+'''
+Test the tracing of MangoDB. These include:
+   - Disabled subsystems and levels per subsystem
+   - The ring buffer and sampling
+   - Events recorded by a running cluster
+   - The hops of requests that carry a trace id
+
+Please run with `pytest -v`
+'''
+
+import json
+import time
+
+from config import Config
+from tracing import Tracer
+from test_functional_requirements import setup
+
+
+class TestTracer:
+    '''
+    Class that contains the tests of the tracer of a single node.
+    '''
+    def test_disabled(self):
+        '''
+        Without a trace level every subsystem is disabled.
+        '''
+        tracer = Tracer("node", Config())
+
+        assert tracer.subsystem("net") is None and tracer.subsystem("write") is None
+
+    def test_levels(self):
+        '''
+        Levels per subsystem override the level of all subsystems.
+        '''
+        tracer = Tracer("node", Config(trace_level="info", trace_levels={"net": "debug", "write": None}))
+        net = tracer.subsystem("net")
+        election = tracer.subsystem("election")
+
+        net.debug("sent", 1)
+        election.debug("candidate", 2)
+        election.info("candidate", 3)
+
+        assert tracer.subsystem("write") is None
+        assert [(e["subsystem"], e["level"], e["fields"]) for e in tracer.snapshot()] == \
+            [("net", "DEBUG", (1,)), ("election", "INFO", (3,))]
+
+    def test_ring_buffer(self):
+        '''
+        Only the most recent trace_buffer_size events are kept.
+        '''
+        tracer = Tracer("node", Config(trace_level="debug", trace_buffer_size=10))
+        net = tracer.subsystem("net")
+        for i in range(25):
+            net.debug("sent", i)
+
+        assert [e["fields"][0] for e in tracer.snapshot()] == list(range(15, 25))
+
+    def test_sampling(self):
+        '''
+        Only a fraction of the debug events is recorded, other levels are never sampled.
+        '''
+        tracer = Tracer("node", Config(trace_level="debug", trace_sample=0.1))
+        net = tracer.subsystem("net")
+        for i in range(2000):
+            net.debug("sent", i)
+        net.warning("dropped", 0)
+
+        events = tracer.snapshot()
+        assert 100 < len(events) < 400
+        assert events[-1]["event"] == "dropped"
+
+    def test_message_copied(self):
+        '''
+        A recorded message keeps the fields that are taken off it after it was recorded.
+        '''
+        tracer = Tracer("node", Config(trace_level="debug"))
+        message = {"type": "write_order", "id": 0, "index": 0, "seq": 3}
+        tracer.subsystem("net").debug("received", ("127.0.0.1", 25000), message)
+        message.pop("seq")
+
+        assert tracer.snapshot()[0]["fields"][1]["seq"] == 3
+
+
+class TestClusterTrace:
+    '''
+    Class that contains the tests of the events a running cluster records.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 3 follower nodes, a leader and 1 client with tracing enabled.
+        '''
+        config = Config(trace_level="debug")
+        node_hosts, nodes, leader, clients, threads = setup(3, 1, config=config)
+        self.nodes = nodes
+        self.leader = leader
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    def test_write_events(self):
+        '''
+        A write is traced on the wire, when it is ordered and when it is applied.
+        '''
+        self.clients[0].write("World!", "Hello?")
+
+        # Ordering and applying continue after the client got its acknowledgement
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            applied = [e for node in self.nodes for e in node.tracer.snapshot() if e["event"] == "applied"]
+            if len(applied) == len(self.nodes):
+                break
+            time.sleep(0.01)
+
+        leader_events = [e["event"] for e in self.leader.tracer.snapshot()]
+        assert "received" in leader_events and "sent" in leader_events and "ordered" in leader_events
+        assert len(applied) == len(self.nodes) and all(e["fields"][2] == ["World!"] for e in applied)
+
+    def test_client_events(self):
+        '''
+        The client traces its requests and responses instead of logging them.
+        '''
+        client = self.clients[0]
+        client.read("World!")
+
+        events = [(e["subsystem"], e["event"], e["fields"][1]["type"]) for e in client.tracer.snapshot()]
+        assert events == [("net", "sent", "client_read"), ("net", "received", "read_result")]
+
+
+class TestRequestTrace:
+    '''
+    Class that contains the tests of tracing requests across nodes.
+    '''
+    def setup_method(self, method):
+        '''
+        Create 2 follower nodes, a leader and 1 client that tags every request.
+        '''
+        config = Config(request_trace_sample=1.0)
+        node_hosts, nodes, leader, clients, threads = setup(3, 1, config=config)
+        self.node_hosts = node_hosts
+        self.nodes = nodes
+        self.leader = leader
+        self.clients = clients
+        self.threads = threads
+
+    def teardown_method(self):
+        '''
+        Safely close all connected clients and running threads.
+        '''
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    def events(self, node):
+        return [(e["event"], e["fields"][0]) for e in node.tracer.snapshot() if e["subsystem"] == "request"]
+
+    def test_write_hops(self):
+        '''
+        Every node records the hops of a tagged write under the trace id of the client.
+        '''
+        client = self.clients[0]
+        client.write("World!", "Hello?", host=self.node_hosts[0])
+        trace = client.tracer.snapshot()[0]["fields"][0]
+
+        # The write is ordered and applied after the client got its acknowledgement
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline and ("applied", trace) not in self.events(self.nodes[1]):
+            time.sleep(0.01)
+
+        origin = self.events(self.nodes[0])
+        assert [event for event, _ in origin if event in ("client_write", "ack", "acked")] == \
+            ["client_write", "ack", "ack", "acked"]
+        assert all(t == trace for _, t in origin)
+        assert ("write", trace) in self.events(self.nodes[1])
+        assert ("client_write_ack", trace) in self.events(self.leader)
+        assert ("ordered", trace) in self.events(self.leader)
+        assert ("applied", trace) in self.events(self.nodes[1])
+        assert [e["event"] for e in client.tracer.snapshot()] == ["sent", "received"]
+
+    def test_dump(self, tmp_path):
+        '''
+        A dump holds the clock offset of the node and its request events.
+        '''
+        self.clients[0].read("World!", host=self.node_hosts[0])
+        path = str(tmp_path / "node.trace")
+        self.nodes[0].tracer.dump(path, subsystems=["request"])
+
+        with open(path) as file:
+            header = json.loads(file.readline())
+            events = [json.loads(line) for line in file]
+
+        assert header["node"] == str(self.nodes[0]) and header["clock_offset"] > 0
+        assert [event[2] for event in events] == ["client_read"]
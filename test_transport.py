@@ -0,0 +1,104 @@
+'''
+Test the UDP transport of MangoDB. These include:
+   - Receiving the datagrams that are waiting as one batch
+   - Fragmented messages in a batch
+   - The batch size limit
+   - Malformed fragments
+
+Please run with `pytest -v`
+'''
+
+import json
+import struct
+import time
+
+from config import Config
+from transport import UdpTransport, FRAGMENT
+
+# Tag, message id, fragment index and number of fragments, as sent by transport.py
+FRAGMENT_HEADER = struct.Struct("!BIHH")
+
+
+class TestRecvBatch:
+    '''
+    Class that contains the tests of batched receives.
+    '''
+    def setup_method(self):
+        self.receiver = UdpTransport(0, Config(recv_batch=4, max_datagram_size=512))
+        self.receiver.settimeout(1)
+        self.sender = UdpTransport(0, Config(codec="binary", max_datagram_size=512))
+        self.addr = ("127.0.0.1", self.receiver.socket.getsockname()[1])
+
+    def teardown_method(self):
+        self.receiver.close()
+        self.sender.close()
+
+    def send(self, messages):
+        for message in messages:
+            self.sender.send(message, self.addr)
+        # Gives the datagrams time to arrive in the receive buffer
+        time.sleep(0.05)
+
+    def test_batch(self):
+        '''
+        All messages that are waiting are returned by a single receive, in order.
+        '''
+        messages = [{"type": "write_order", "id": i, "index": i} for i in range(3)]
+        self.send(messages)
+
+        batch = self.receiver.recv_batch()
+
+        assert [message for message, _ in batch] == messages
+
+    def test_fragments(self):
+        '''
+        A fragmented message in the middle of a batch is reassembled.
+        '''
+        messages = [
+            {"type": "write_order", "id": 0, "index": 0},
+            {"type": "client_write", "keys": ["large"], "values": ["x" * 2000]},
+            {"type": "write_order", "id": 1, "index": 1},
+        ]
+        self.send(messages)
+
+        batch = self.receiver.recv_batch()
+
+        assert [message for message, _ in batch] == messages
+
+    def test_batch_size(self):
+        '''
+        A batch holds at most recv_batch messages, the rest stays for the next receive.
+        '''
+        messages = [{"type": "write_order", "id": i, "index": i} for i in range(6)]
+        self.send(messages)
+
+        first = self.receiver.recv_batch()
+        second = self.receiver.recv_batch()
+
+        assert len(first) == 4
+        assert [message for message, _ in first + second] == messages
+
+    def test_malformed_fragments(self):
+        '''
+        Fragments with an impossible index or count are dropped, the message of their id
+        is still reassembled from its valid fragments.
+        '''
+        message = {"type": "write_order", "id": 0, "index": 0}
+        payload = json.dumps(message).encode()
+        first, second = payload[:10], payload[10:]
+        datagrams = [
+            b"\xfe",
+            FRAGMENT_HEADER.pack(FRAGMENT, 7, 0, 0) + first,
+            FRAGMENT_HEADER.pack(FRAGMENT, 7, 2, 2) + first,
+            FRAGMENT_HEADER.pack(FRAGMENT, 7, 0, 2) + first,
+            FRAGMENT_HEADER.pack(FRAGMENT, 7, 2, 3) + second,
+            FRAGMENT_HEADER.pack(FRAGMENT, 7, 1, 2) + second,
+        ]
+        for datagram in datagrams:
+            self.sender.socket.sendto(datagram, self.addr)
+        time.sleep(0.05)
+
+        batch = self.receiver.recv_batch()
+
+        assert [message for message, _ in batch] == [message]
+        assert self.receiver.fragments == {}
@@ -0,0 +1,113 @@
+'''
+Test the write-ahead log of MangoDB. These include:
+   - Recovery of appended records for every fsync policy
+   - Recovery from a snapshot combined with the log
+   - Recovery of a log with a torn record at the end
+   - A restart of a whole cluster
+
+Please run with `pytest -v`
+'''
+
+import pytest
+from config import Config
+from wal import WriteAheadLog
+from test_functional_requirements import setup
+
+
+class TestWriteAheadLog:
+    '''
+    Class that contains the tests of the log itself.
+    '''
+    @pytest.mark.parametrize('fsync', ['always', 'batch', 'off'])
+    def test_recover(self, tmp_path, fsync):
+        '''
+        Append a few records, close the log and recover them.
+        '''
+        wal = WriteAheadLog(str(tmp_path), fsync=fsync, batch_size=4)
+        wal.recover()
+        for i in range(10):
+            wal.append(i, ["World!", "key{}".format(i)], ["Hello{}?".format(i), i], now=0)
+        wal.close()
+
+        data, next_index = WriteAheadLog(str(tmp_path)).recover()
+        assert next_index == 10
+        assert data["World!"] == ("Hello9?", 9) and data["key3"] == (3, 3)
+
+    def test_snapshot(self, tmp_path):
+        '''
+        A snapshot replaces the log, later records are replayed on top of it.
+        '''
+        wal = WriteAheadLog(str(tmp_path), snapshot_interval=5)
+        wal.recover()
+        data = {}
+        for i in range(12):
+            wal.append(i, ["key{}".format(i % 3)], [i], now=0)
+            data["key{}".format(i % 3)] = (i, i)
+            if wal.needs_snapshot():
+                wal.snapshot(data, i + 1)
+        wal.close()
+
+        recovered, next_index = WriteAheadLog(str(tmp_path)).recover()
+        assert next_index == 12 and recovered == data
+
+    def test_torn_record(self, tmp_path):
+        '''
+        A record that was only partly written is dropped on recovery.
+        '''
+        wal = WriteAheadLog(str(tmp_path), fsync='always')
+        wal.recover()
+        wal.append(0, ["World!"], ["Hello?"], now=0)
+        wal.close()
+        with open(wal.log_path, 'ab') as f:
+            f.write(b'[1, ["World!"], ["By')
+
+        wal = WriteAheadLog(str(tmp_path), fsync='always')
+        data, next_index = wal.recover()
+        assert data == {"World!": ("Hello?", 0)} and next_index == 1
+
+        # New records are appended after the last valid record
+        wal.append(1, ["World!"], ["Bye!"], now=0)
+        wal.close()
+        data, next_index = WriteAheadLog(str(tmp_path)).recover()
+        assert data == {"World!": ("Bye!", 1)} and next_index == 2
+
+
+class TestRestart:
+    '''
+    Restart a whole cluster that uses a write-ahead log.
+    '''
+    def start(self, config):
+        node_hosts, nodes, leader, clients, threads = setup(3, 1, config=config)
+        self.node_hosts = node_hosts
+        self.clients = clients
+        self.threads = threads
+
+    def stop(self):
+        for client in self.clients:
+            client.exit()
+        for thread in self.threads:
+            thread.join()
+
+    @pytest.mark.parametrize('snapshot_interval', [3, 100000])
+    def test_restart(self, tmp_path, snapshot_interval):
+        '''
+        Values and the order index survive a restart of all nodes.
+        '''
+        config = Config(wal_dir=str(tmp_path), snapshot_interval=snapshot_interval)
+        self.start(config)
+        for i in range(10):
+            self.clients[0].write(["World!", "key{}".format(i)], ["Hello{}?".format(i), i])
+
+        # A read waits until the last write has been ordered on that node
+        for host in self.node_hosts:
+            assert self.clients[0].read("World!", host=host)["order_index"] == 9
+        self.stop()
+
+        self.start(config)
+        try:
+            self.clients[0].write("World!", "Bye!")
+            for host in self.node_hosts:
+                result = self.clients[0].read(["World!", "key4"], host=host)
+                assert result["value"] == ["Bye!", 4] and result["order_index"] == [10, 4]
+        finally:
+            self.stop()
@@ -0,0 +1,115 @@
+"""
+tracing.py
+
+Description:
+    This file contains the tracing facility of a node.
+    Events on the message hot path are recorded as structured tuples
+    (time, node, subsystem, level, event, fields) into a ring buffer that
+    keeps the most recent trace_buffer_size events.
+    Every subsystem ("net", "write", "reliable", "election") has its own
+    level. A node keeps one Subsystem object per enabled subsystem and None
+    for a disabled one, so a call site costs a single attribute check when
+    tracing is off:
+
+        if self.trace_net is not None:
+            self.trace_net.debug("sent", addr, message)
+
+    Events can be sampled, only a trace_sample fraction of the debug events
+    is recorded. With trace_log the recorded events are also passed to the
+    logging module, which only formats them if its level lets them through.
+    Fields are stored as they are, not copied.
+    The "request" subsystem records the hops of requests that a client tagged
+    with a trace id (config.request_trace_sample). dump writes the events of a
+    node to a file, experiments/trace_report.py merges the files of all nodes
+    and clients into a breakdown per request.
+"""
+
+from collections import deque
+import json
+import logging
+import random
+import time
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING}
+
+SUBSYSTEMS = ("net", "write", "reliable", "election", "request")
+
+
+class Tracer:
+    def __init__(self, name, config, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.events = deque(maxlen=config.trace_buffer_size)
+        self.sample = config.trace_sample
+        self.random = config.rng or random
+        self.log = config.trace_log
+
+        self.levels = {}
+        for subsystem in SUBSYSTEMS:
+            level = config.trace_levels.get(subsystem, config.trace_level)
+            # Tagged requests are recorded whenever clients tag them
+            if subsystem == "request" and level is None and config.request_trace_sample:
+                level = "info"
+            if level is not None:
+                self.levels[subsystem] = LEVELS[level] if isinstance(level, str) else level
+
+    # Returns the Subsystem that records the events of a subsystem, None if it is disabled
+    def subsystem(self, name):
+        if name not in self.levels:
+            return None
+        return Subsystem(self, name, self.levels[name])
+
+    # Returns the recorded events, oldest first, as dicts. The copy of the ring buffer
+    # is taken at once, so it can be called while the node is running
+    def snapshot(self):
+        return [{"time": at, "node": node, "subsystem": subsystem, "level": logging.getLevelName(level),
+                 "event": event, "fields": fields}
+                for at, node, subsystem, level, event, fields in list(self.events)]
+
+    def clear(self):
+        self.events.clear()
+
+    # Writes the recorded events to a file as JSON lines. The first line holds the name and
+    # the offset of the clock to the wall clock, so the events of nodes can be merged
+    def dump(self, path, subsystems=None):
+        with open(path, "w") as file:
+            file.write(json.dumps({"node": self.name, "clock_offset": time.time() - self.clock()}) + "\n")
+            for at, node, subsystem, level, event, fields in list(self.events):
+                if subsystems is None or subsystem in subsystems:
+                    file.write(json.dumps([at, subsystem, event, fields], default=str) + "\n")
+
+
+class Subsystem:
+    def __init__(self, tracer, name, level):
+        self.tracer = tracer
+        self.name = name
+        self.level = level
+        self.events = tracer.events
+
+    def debug(self, event, *fields):
+        if self.level > DEBUG:
+            return
+        # Debug events fire for every message, so only these are sampled
+        if self.tracer.sample < 1 and self.tracer.random.random() >= self.tracer.sample:
+            return
+        self.record(DEBUG, event, fields)
+
+    def info(self, event, *fields):
+        if self.level <= INFO:
+            self.record(INFO, event, fields)
+
+    def warning(self, event, *fields):
+        if self.level <= WARNING:
+            self.record(WARNING, event, fields)
+
+    # Messages are copied, the reliable layer and the handlers take fields off them later
+    def record(self, level, event, fields):
+        tracer = self.tracer
+        fields = tuple(dict(field) if type(field) is dict else field for field in fields)
+        self.events.append((tracer.clock(), tracer.name, self.name, level, event, fields))
+        if tracer.log:
+            logging.log(level, "%s: [%s] %s %s", tracer.name, self.name, event, fields)
@@ -0,0 +1,187 @@
+"""
+transport.py
+
+Description:
+    This file contains the UDP transport that is used by nodes and clients
+    to send and receive messages.
+    Messages are encoded with the configured codec. Messages that do not fit
+    in a single datagram are split into fragments, which are reassembled by
+    the receiver before the message is decoded.
+    Datagrams are received into a buffer that is reused for every datagram
+    and decoded straight from a memoryview of it. recv_batch drains the
+    datagrams that are already waiting without blocking, so a busy node
+    handles a batch of them per blocking receive.
+"""
+
+import os
+import socket
+import struct
+import time
+
+import codec
+
+# Largest payload that fits in a single UDP datagram
+MAX_DATAGRAM = 65507
+
+# First byte of a fragment, it does not collide with a JSON or binary message
+FRAGMENT = 0xfe
+
+# Fragment header: tag, message id, fragment index, number of fragments
+_FRAGMENT_HEADER = struct.Struct("!BIHH")
+_MAX_FRAGMENTS = 2 ** 16 - 1
+
+# Receive flag that makes a single receive non-blocking, not available on every platform
+_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+# Returns the transport of config.transport bound to port, 0 picks a free port
+def make_transport(port, config):
+    if config.transport == "inproc":
+        from inproc import InProcessTransport
+        return InProcessTransport(port, config)
+    if config.transport != "udp":
+        raise ValueError("Unknown transport: {}".format(config.transport))
+    return UdpTransport(port, config)
+
+
+class UdpTransport:
+    def __init__(self, port, config):
+        self.codec = codec.get_codec(config.codec)
+        self.max_datagram_size = min(config.max_datagram_size, MAX_DATAGRAM)
+        self.fragment_timeout = config.fragment_timeout
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # The OS silently caps these at its configured maximum
+        recv_buffer_size = config.recv_buffer_size or config.socket_buffer_size
+        send_buffer_size = config.send_buffer_size or config.socket_buffer_size
+        if recv_buffer_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer_size)
+        if send_buffer_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer_size)
+        self.socket.bind(("", port))
+        self.port = self.socket.getsockname()[1]
+
+        self.buffer = bytearray(MAX_DATAGRAM)
+        self.view = memoryview(self.buffer)
+
+        # A socket with a timeout polls before every receive, the drain socket shares
+        # the file descriptor but never waits, so it only takes datagrams that are there.
+        # It is created on the first recv_batch
+        self.recv_batch_size = max(config.recv_batch, 1)
+        self.drain_socket = None
+        self.fragment_id = 0
+        self.fragments = {}
+
+    # Encodes a message and sends it to addr, fragmenting it if necessary
+    def send(self, message, addr):
+        for datagram in self.datagrams(message):
+            self.socket.sendto(datagram, addr)
+
+    # Encodes a message into one or more datagrams
+    def datagrams(self, message):
+        payload = self.codec.encode(message)
+        if len(payload) <= self.max_datagram_size:
+            return (payload,)
+        return self.fragment(payload)
+
+    # Splits a payload into datagrams that each fit in max_datagram_size
+    def fragment(self, payload):
+        size = self.max_datagram_size - _FRAGMENT_HEADER.size
+        count = (len(payload) + size - 1) // size
+        if count > _MAX_FRAGMENTS:
+            raise ValueError("Message of {} bytes is too large to send".format(len(payload)))
+
+        self.fragment_id = (self.fragment_id + 1) & 0xffffffff
+        view = memoryview(payload)
+        for i in range(count):
+            header = _FRAGMENT_HEADER.pack(FRAGMENT, self.fragment_id, i, count)
+            yield header + view[i * size:(i + 1) * size]
+
+    # Waits for the next complete message, returns the message and the sender
+    def recv(self):
+        while True:
+            n_bytes, addr = self.socket.recvfrom_into(self.buffer)
+            message = self.decode_datagram(self.view[:n_bytes], addr)
+            if message is not None:
+                return message, addr
+
+    # Waits for the next complete message and also returns the messages that arrived
+    # after it, at most recv_batch_size in total, as a list of (message, sender)
+    def recv_batch(self):
+        batch = [self.recv()]
+        if self.recv_batch_size == 1 or not _DONTWAIT:
+            return batch
+        if self.drain_socket is None:
+            self.drain_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, fileno=os.dup(self.socket.fileno()))
+
+        while len(batch) < self.recv_batch_size:
+            try:
+                n_bytes, addr = self.drain_socket.recvfrom_into(self.buffer, 0, _DONTWAIT)
+            except BlockingIOError:
+                break
+
+            message = self.decode_datagram(self.view[:n_bytes], addr)
+            if message is not None:
+                batch.append((message, addr))
+
+        return batch
+
+    # Decodes a received datagram, returns None while a message is incomplete
+    def decode_datagram(self, datagram, addr):
+        if not len(datagram):
+            return None
+
+        if datagram[0] == FRAGMENT:
+            payload = self.reassemble(datagram, addr)
+            if payload is None:
+                return None
+        else:
+            payload = datagram
+
+        return codec.decode(payload)
+
+    # Stores a fragment, returns the complete payload once all fragments arrived.
+    # Malformed fragments are dropped, so they never break the message of their id
+    def reassemble(self, datagram, addr):
+        if len(datagram) < _FRAGMENT_HEADER.size:
+            return None
+        _, fragment_id, index, count = _FRAGMENT_HEADER.unpack_from(datagram)
+        if count == 0 or count > _MAX_FRAGMENTS or index >= count:
+            return None
+        now = time.monotonic()
+
+        key = (addr, fragment_id)
+        if key not in self.fragments:
+            self.expire_fragments(now)
+            self.fragments[key] = [now, count, [None] * count]
+
+        entry = self.fragments[key]
+        parts = entry[2]
+        if len(parts) != count:
+            return None
+        if parts[index] is None:
+            parts[index] = bytes(datagram[_FRAGMENT_HEADER.size:])
+            entry[1] -= 1
+
+        if entry[1]:
+            return None
+
+        del self.fragments[key]
+        return b"".join(parts)
+
+    # Drops partially received messages of which a fragment got lost
+    def expire_fragments(self, now):
+        for key, entry in list(self.fragments.items()):
+            if now - entry[0] > self.fragment_timeout:
+                del self.fragments[key]
+
+    # Sets the timeout of a blocking receive in seconds
+    def settimeout(self, timeout):
+        self.socket.settimeout(timeout)
+
+    # Closes the underlying socket
+    def close(self):
+        if self.drain_socket is not None:
+            self.drain_socket.close()
+        self.socket.close()
@@ -0,0 +1,143 @@
+"""
+wal.py
+
+Description:
+    This file contains the write-ahead log of a node.
+    Every applied write is appended as a (order_index, keys, values) record
+    before it is stored in memory. Records are written in groups, and the
+    fsync policy decides how often they are forced to disk:
+        "always"  every record is written and synced before it is applied
+        "batch"   records are written and synced together once enough of
+                  them are waiting or commit_interval has passed
+        "off"     records are written in groups but never synced
+    Every snapshot_interval records a compact snapshot of the whole store is
+    written and the log is truncated, which bounds the recovery time.
+    On restart the snapshot is loaded and the log is replayed on top of it.
+"""
+
+import json
+import logging
+import os
+
+FSYNC_POLICIES = ("always", "batch", "off")
+
+
+class WriteAheadLog:
+    def __init__(self, directory, fsync="batch", batch_size=128, commit_interval=0.01,
+                 snapshot_interval=100000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy: {}".format(fsync))
+
+        self.directory = directory
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.snapshot_interval = snapshot_interval
+
+        self.log_path = os.path.join(directory, "wal.log")
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+
+        os.makedirs(directory, exist_ok=True)
+        self.file = None
+        self.buffer = []
+        self.buffered_at = None
+        self.n_records = 0
+
+    # Loads the snapshot and replays the log, returns the entries as a dict of
+    # key -> (value, order_index) and the next order index
+    def recover(self):
+        data = {}
+        next_index = 0
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = json.loads(f.read().decode())
+            next_index = snapshot["index"]
+            for key, value, index in snapshot["data"]:
+                data[key] = (value, index)
+
+        valid_bytes = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    # A torn record at the end of the log was never acknowledged
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        index, keys, values = json.loads(line.decode())
+                    except ValueError:
+                        break
+
+                    valid_bytes += len(line)
+                    self.n_records += 1
+                    if index < next_index:
+                        continue
+
+                    for i in range(len(keys)):
+                        data[keys[i]] = (values[i], index)
+                    next_index = index + 1
+
+            # Drop the torn tail, so new records are appended to a valid log
+            if valid_bytes != os.path.getsize(self.log_path):
+                logging.warning("WAL {}: truncating torn record at byte {}".format(self.log_path, valid_bytes))
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(valid_bytes)
+
+        self.file = open(self.log_path, "ab")
+        return data, next_index
+
+    # Appends a record, depending on the fsync policy it is written right away
+    def append(self, index, keys, values, now):
+        if not self.buffer:
+            self.buffered_at = now
+        self.buffer.append(json.dumps([index, keys, values]).encode() + b"\n")
+        if self.fsync == "always" or len(self.buffer) >= self.batch_size:
+            self.commit()
+
+    # Commits the waiting records once the oldest has waited for commit_interval
+    def tick(self, now):
+        if self.buffer and now - self.buffered_at >= self.commit_interval:
+            self.commit()
+
+    # Writes all waiting records in one go (group commit)
+    def commit(self):
+        if not self.buffer:
+            return
+
+        self.file.write(b"".join(self.buffer))
+        self.file.flush()
+        if self.fsync != "off":
+            os.fsync(self.file.fileno())
+
+        self.n_records += len(self.buffer)
+        self.buffer = []
+
+    # Returns whether the log has grown enough to be replaced by a snapshot
+    def needs_snapshot(self):
+        return self.n_records + len(self.buffer) >= self.snapshot_interval
+
+    # Writes the whole store as a snapshot and empties the log
+    def snapshot(self, data, next_index):
+        entries = [[key, value, index] for key, (value, index) in data.items() if index is not None]
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps({"index": next_index, "data": entries}).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # All records, including the ones still waiting, are part of the snapshot
+        self.buffer = []
+        self.file.close()
+        self.file = open(self.log_path, "wb")
+        self.n_records = 0
+
+    # Commits the waiting records and closes the log
+    def close(self):
+        if self.file is None:
+            return
+
+        self.commit()
+        self.file.close()
+        self.file = None
+